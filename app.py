@@ -1,208 +1,406 @@
-import json
+import atexit
 import logging
 import os
 import threading
 import time
-import uuid
-from datetime import datetime, timezone
-from typing import Any, Dict, Optional
+from typing import Any, Optional
 
 import boto3
-import psycopg2
-from flask import Flask, jsonify, request
-
-LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
-logging.basicConfig(level=LOG_LEVEL)
+from flask import Flask, g, jsonify, request
+
+from orders import emf, metrics, profiling, tracing
+from orders.api import (
+    READ_YOUR_WRITES_COOKIE,
+    new_order,
+    page_body,
+    page_status,
+    parse_page_query,
+    read_your_writes_cookie,
+)
+from orders.cache import (
+    ORDERS_CACHE_LISTEN_SECONDS,
+    ORDERS_CACHE_SECONDS,
+    ResponseCache,
+)
+from orders.consumer import SqsConsumer, persist_orders
+from orders.db import (
+    DB_EXPORT_POOL_MAX,
+    DB_READER_POOL_MAX,
+    DB_READER_POOL_MIN,
+    ConnectionPool,
+    db_config,
+    direct_config,
+    export_config,
+    reader_config,
+)
+from orders.export import EXPORT_CONCURRENCY, EXPORT_FORMATS, ExportStream, export_headers, parse_since
+from orders.ingest import INGEST_READ_BYTES, OrderBatchSender, body_format, ingest_orders
+from orders.logs import configure_logging
+from orders.notify import ORDERS_LISTEN, OrdersChangedListener
+from orders.pages import INDEX_PAGE
+from orders.publisher import SqsPublisher, create_publisher
+from orders.relay import start_relays
+from orders.serialization import OrdersJSONProvider
+from orders.store import (
+    EXPORT_FETCH_SIZE,
+    MemoryOrderStore,
+    OrderStore,
+    PostgresOrderStore,
+    create_store,
+)
+
+configure_logging()
 logger = logging.getLogger("flexis-orders")
 
 app = Flask(__name__)
+app.json = OrdersJSONProvider(app)
+if profiling.PROFILE_ENABLED:
+    app.wsgi_app = profiling.ProfilingMiddleware(app.wsgi_app)  # type: ignore[method-assign]
+
+DB_CHECK_CACHE_SECONDS = float(os.getenv("DB_CHECK_CACHE_SECONDS", "5"))
+DB_CHECK_TIMEOUT = float(os.getenv("DB_CHECK_TIMEOUT", "2"))
+_db_check_lock = threading.Lock()
+_db_check_cache: dict[str, tuple[float, dict[str, Any], int]] = {}
 
-ORDERS: list[Dict[str, Any]] = []
+# each running export holds a reader connection and a request thread
+_export_slots = threading.BoundedSemaphore(max(1, EXPORT_CONCURRENCY))
+
+# set once pools hold their minimum connections and the SQS client is live
+READY = threading.Event()
 
 SQS_QUEUE_URL = os.getenv("SQS_QUEUE_URL")
-SQS_POLL_SECONDS = int(os.getenv("SQS_POLL_SECONDS", "10"))
 SQS_ENABLED = bool(SQS_QUEUE_URL)
-
-sqs_client = boto3.client("sqs") if SQS_ENABLED else None
-
-
-INDEX_HTML = """
-<!doctype html>
-<html lang="en">
-  <head>
-    <meta charset="utf-8" />
-    <meta name="viewport" content="width=device-width, initial-scale=1" />
-    <title>Flexicx Order Processing</title>
-    <style>
-      body { font-family: Arial, sans-serif; margin: 32px; }
-      h1 { margin-bottom: 8px; }
-      .card { border: 1px solid #ddd; padding: 16px; border-radius: 8px; max-width: 720px; }
-      label { display: block; margin-top: 12px; }
-      input, textarea { width: 100%; padding: 8px; margin-top: 4px; }
-      button { margin-top: 12px; padding: 10px 16px; }
-      .orders { margin-top: 24px; }
-      .order { padding: 8px 0; border-bottom: 1px solid #eee; }
-      .muted { color: #666; font-size: 12px; }
-    </style>
-  </head>
-  <body>
-    <div class="card">
-      <h1>Flexicx Order Processing</h1>
-      <p class="muted">This is a simple demo app that submits orders and pushes them to SQS.</p>
-      <form id="order-form">
-        <label>Customer Name
-          <input name="customer" required />
-        </label>
-        <label>Order Notes
-          <textarea name="notes" rows="3"></textarea>
-        </label>
-        <button type="submit">Submit Order</button>
-      </form>
-      <div class="orders">
-        <h3>Recent Orders</h3>
-        <div id="orders"></div>
-      </div>
-    </div>
-    <script>
-      async function loadOrders() {
-        const res = await fetch('/api/orders');
-        const data = await res.json();
-        const container = document.getElementById('orders');
-        container.innerHTML = '';
-        (data.orders || []).forEach(order => {
-          const div = document.createElement('div');
-          div.className = 'order';
-          div.innerHTML = `<strong>${order.customer}</strong> - ${order.id}<div class="muted">${order.createdAt}</div>`;
-          container.appendChild(div);
-        });
-      }
-
-      document.getElementById('order-form').addEventListener('submit', async (event) => {
-        event.preventDefault();
-        const form = event.target;
-        const payload = {
-          customer: form.customer.value,
-          notes: form.notes.value
-        };
-        await fetch('/api/orders', {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify(payload)
-        });
-        form.reset();
-        await loadOrders();
-      });
-
-      loadOrders();
-    </script>
-  </body>
-</html>
-"""
-
-
-def now_iso() -> str:
-    return datetime.now(timezone.utc).isoformat()
-
-
-def db_config() -> Optional[dict[str, Any]]:
-    host = os.getenv("DB_HOST")
-    if not host:
-        return None
-
-    return {
-        "host": host,
-        "port": int(os.getenv("DB_PORT", "5432")),
-        "dbname": os.getenv("DB_NAME", "orders"),
-        "user": os.getenv("DB_USER", "postgres"),
-        "password": os.getenv("DB_PASSWORD"),
-        "connect_timeout": 5,
-    }
+# turn off when a dedicated `python -m orders.worker` service consumes the queue
+SQS_POLL_ENABLED = os.getenv("SQS_POLL_ENABLED", "true").lower() in ("1", "true", "yes")
+OUTBOX_RELAY_ENABLED = os.getenv(
+    "OUTBOX_RELAY_ENABLED", str(SQS_POLL_ENABLED)
+).lower() in ("1", "true", "yes")
+
+SQS_ENDPOINT_URL = os.getenv("SQS_ENDPOINT_URL")
+
+# gunicorn.conf.py sets this when preloading so the master never opens
+# sockets or starts threads; each worker calls init_runtime() after fork
+APP_DEFER_INIT = os.getenv("APP_DEFER_INIT", "").lower() in ("1", "true", "yes")
+
+# per-process resources, created by init_runtime()
+db_pool: Optional[ConnectionPool] = None
+reader_pool: Optional[ConnectionPool] = None
+export_pool: Optional[ConnectionPool] = None
+order_store: Optional[OrderStore] = None
+sqs_client: Any = None
+sqs_publisher: Optional[SqsPublisher] = None
+batch_sender: Optional[OrderBatchSender] = None
+orders_cache: Optional[ResponseCache] = None
+orders_listener: Optional[OrdersChangedListener] = None
+_runtime_pid: Optional[int] = None
 
 
 def send_to_sqs(order: dict[str, Any]) -> None:
-    if not SQS_ENABLED or sqs_client is None:
+    if sqs_publisher is None:
         return
 
-    try:
-        sqs_client.send_message(
-            QueueUrl=SQS_QUEUE_URL,
-            MessageBody=json.dumps(order),
-        )
-    except Exception:
-        logger.exception("failed to send order to SQS")
+    sqs_publisher.publish(order)
 
 
 def poll_sqs() -> None:
     if not SQS_ENABLED or sqs_client is None:
         return
 
-    logger.info("starting SQS poller")
-    while True:
-        try:
-            response = sqs_client.receive_message(
-                QueueUrl=SQS_QUEUE_URL,
-                MaxNumberOfMessages=10,
-                WaitTimeSeconds=SQS_POLL_SECONDS,
-                VisibilityTimeout=30,
-            )
-            for message in response.get("Messages", []):
-                logger.info("received order message: %s", message.get("Body"))
-                sqs_client.delete_message(
-                    QueueUrl=SQS_QUEUE_URL,
-                    ReceiptHandle=message["ReceiptHandle"],
-                )
-        except Exception:
-            logger.exception("error while polling SQS")
-            time.sleep(5)
+    batch_handler = persist_orders(order_store) if isinstance(order_store, PostgresOrderStore) else None
+    SqsConsumer(sqs_client, SQS_QUEUE_URL, batch_handler=batch_handler).run()
+
+
+@app.before_request
+def start_timer() -> None:
+    g.request_started = time.perf_counter()
+    if tracing.TRACE_ENABLED:
+        span = tracing.start_span(
+            request.method,
+            kind=tracing.SERVER,
+            parent=tracing.parse_traceparent(request.headers.get("traceparent")),
+            attributes={"http.request.method": request.method, "url.path": request.path},
+        )
+        g.trace_span = span
+        g.trace_token = tracing.activate(span)
+
+
+@app.after_request
+def observe_request(response: Any) -> Any:
+    started = g.get("request_started")
+    if started is not None:
+        # the rule template, not the path, keeps label cardinality bounded
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        metrics.HTTP_REQUEST_SECONDS.labels(request.method, route, response.status_code).observe(
+            time.perf_counter() - started
+        )
+        span = g.get("trace_span")
+        if span is not None:
+            span.name = f"{request.method} {route}"
+            span.set_attribute("http.route", route)
+            span.set_attribute("http.response.status_code", response.status_code)
+            if response.status_code >= 500:
+                span.set_error(f"HTTP {response.status_code}")
+    return response
+
+
+@app.teardown_request
+def end_trace(exc: Optional[BaseException]) -> None:
+    span = g.pop("trace_span", None)
+    if span is None:
+        return
+    if exc is not None:
+        span.set_error(repr(exc))
+    tracing.deactivate(g.pop("trace_token"))
+    span.end()
 
 
 @app.route("/")
-def index() -> str:
-    return INDEX_HTML
+def index() -> Any:
+    coding = INDEX_PAGE.select(request.headers.get("Accept-Encoding"))
+    if INDEX_PAGE.not_modified(coding, request.headers.get("If-None-Match")):
+        return "", 304, INDEX_PAGE.headers(coding, body=False)
+    return INDEX_PAGE.bodies[coding], 200, INDEX_PAGE.headers(coding)
 
 
 @app.route("/api/orders", methods=["GET"])
 def list_orders() -> Any:
-    return jsonify({"orders": ORDERS[:20]})
+    try:
+        query = parse_page_query(request.args, request.cookies)
+    except ValueError as exc:
+        return jsonify({"status": "error", "error": str(exc)}), 400
+
+    version = order_store.version
+    entry = None if query.consistent else orders_cache.get(query.cache_key, version)
+    if entry is None:
+        try:
+            orders, has_more = order_store.page(query.limit, query.after, consistent=query.consistent)
+        except Exception as exc:
+            logger.exception("failed to list orders")
+            return jsonify({"status": "error", "error": str(exc)}), 503
+        entry = orders_cache.put(query.cache_key, version, page_body(orders, has_more))
+
+    status, headers = page_status(entry, request.headers.get("If-None-Match"))
+    if status == 304:
+        return "", 304, headers
+    return app.response_class(entry.body, mimetype="application/json", headers=headers)
+
+
+@app.route("/api/orders/export", methods=["GET"])
+def export_orders() -> Any:
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"status": "error", "error": "format must be ndjson or csv"}), 400
+    try:
+        since = parse_since(request.args.get("since"))
+    except ValueError as exc:
+        return jsonify({"status": "error", "error": str(exc)}), 400
+
+    if not _export_slots.acquire(blocking=False):
+        return jsonify({"status": "error", "error": "too many exports in progress"}), 429
+    try:
+        batches = order_store.export(since, EXPORT_FETCH_SIZE)
+        # the first fetch runs here so a database error is still a 503
+        first = next(batches, [])
+    except Exception as exc:
+        _export_slots.release()
+        logger.exception("failed to export orders")
+        return jsonify({"status": "error", "error": str(exc)}), 503
+
+    body = ExportStream(fmt, first, batches, on_close=_export_slots.release)
+    return app.response_class(body, mimetype=EXPORT_FORMATS[fmt], headers=export_headers(fmt))
 
 
 @app.route("/api/orders", methods=["POST"])
 def create_order() -> Any:
     payload = request.get_json(silent=True) or request.form or {}
-    order = {
-        "id": str(uuid.uuid4()),
-        "customer": payload.get("customer", "anonymous"),
-        "notes": payload.get("notes", ""),
-        "createdAt": now_iso(),
-    }
-    ORDERS.insert(0, order)
+    order = new_order(payload)
+    try:
+        with tracing.span("orders insert", kind=tracing.CLIENT, attributes={"order.id": order["id"]}):
+            order_store.add(order)
+    except Exception as exc:
+        logger.exception("failed to store order")
+        return jsonify({"status": "error", "error": str(exc)}), 503
     send_to_sqs(order)
-    return jsonify(order), 201
+
+    response = jsonify(order)
+    cookie = read_your_writes_cookie()
+    if cookie is not None:
+        value, max_age = cookie
+        response.set_cookie(READ_YOUR_WRITES_COOKIE, value, max_age=max_age, httponly=True, samesite="Lax")
+    return response, 201
+
+
+@app.route("/api/orders/batch", methods=["POST"])
+def create_orders_batch() -> Any:
+    fmt = body_format(request.content_type)
+    if fmt is None:
+        return jsonify({"status": "error", "error": "send a JSON array or application/x-ndjson"}), 415
+
+    # read in fixed-size pieces so the body is never held in memory
+    chunks = iter(lambda: request.stream.read(INGEST_READ_BYTES), b"")
+    report = ingest_orders(chunks, fmt, order_store, batch_sender)
+    return jsonify(report.to_dict()), report.status
 
 
 @app.route("/health")
 def health() -> Any:
-    return jsonify({"status": "ok"})
+    body: dict[str, Any] = {"status": "ok"}
+    if isinstance(order_store, MemoryOrderStore):
+        body["orderBuffer"] = order_store.stats()
+    if sqs_publisher is not None:
+        body["sqsPublisher"] = sqs_publisher.stats()
+    if orders_cache is not None:
+        body["ordersCache"] = orders_cache.stats()
+    if orders_listener is not None:
+        body["ordersListener"] = orders_listener.stats()
+    return jsonify(body)
+
+
+def check_db() -> tuple[dict[str, Any], int]:
+    now = time.monotonic()
+    with _db_check_lock:
+        cached = _db_check_cache.get("result")
+        if cached and cached[0] > now:
+            return cached[1], cached[2]
+
+        try:
+            with db_pool.connection(timeout=DB_CHECK_TIMEOUT) as conn, conn.cursor() as cur:
+                cur.execute("SELECT 1")
+                cur.fetchone()
+            result: tuple[dict[str, Any], int] = ({"status": "ok"}, 200)
+        except Exception as exc:
+            logger.exception("db check failed")
+            result = ({"status": "error", "error": str(exc)}, 503)
+
+        _db_check_cache["result"] = (now + DB_CHECK_CACHE_SECONDS, *result)
+        return result
 
 
 @app.route("/db-check")
 def db_check() -> Any:
-    cfg = db_config()
-    if not cfg or not cfg.get("password"):
+    if db_pool is None:
         return jsonify({"status": "skipped", "reason": "missing db env"})
 
-    try:
-        conn = psycopg2.connect(**cfg)
-        conn.close()
-        return jsonify({"status": "ok"})
-    except Exception as exc:
-        logger.exception("db check failed")
-        return jsonify({"status": "error", "error": str(exc)}), 503
+    body, status = check_db()
+    return jsonify(body), status
+
+
+@app.route("/metrics")
+def metrics_endpoint() -> Any:
+    return app.response_class(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 
+@app.route("/ready")
+def ready() -> Any:
+    if not READY.is_set():
+        return jsonify({"status": "starting"}), 503
+    return jsonify({"status": "ready"})
 
-if SQS_ENABLED:
-    thread = threading.Thread(target=poll_sqs, daemon=True)
-    thread.start()
+
+def warm_up() -> None:
+    delay = 0.5
+    while True:
+        try:
+            for pool in {db_pool, reader_pool} - {None}:
+                pool.warm()
+            if sqs_client is not None:
+                # resolves credentials and opens the TLS connection up front
+                sqs_client.get_queue_attributes(
+                    QueueUrl=SQS_QUEUE_URL,
+                    AttributeNames=["QueueArn"],
+                )
+            break
+        except Exception:
+            logger.exception("warm-up failed, retrying in %.1fs", delay)
+            time.sleep(delay)
+            delay = min(delay * 2, 10)
+
+    READY.set()
+    logger.info("warm-up complete, ready for traffic")
+
+
+def init_runtime() -> None:
+    """Create this process's pools, SQS client and background threads.
+
+    Neither psycopg2 connections nor boto3 clients survive a fork, so this
+    runs once per process: at import, or from gunicorn's post_fork hook
+    when the app is preloaded.
+    """
+    global db_pool, reader_pool, export_pool, order_store, sqs_client, sqs_publisher, orders_cache, orders_listener
+    global batch_sender, _runtime_pid
+    if _runtime_pid == os.getpid():
+        return
+    _runtime_pid = os.getpid()
+
+    cfg = db_config()
+    db_pool = ConnectionPool(cfg) if cfg and cfg.get("password") else None
+    reader_cfg = reader_config()
+    reader_pool = (
+        ConnectionPool(reader_cfg, minsize=DB_READER_POOL_MIN, maxsize=DB_READER_POOL_MAX, name="reader")
+        if db_pool is not None and reader_cfg
+        else None
+    )
+    export_cfg = None if reader_cfg else export_config()
+    export_pool = (
+        ConnectionPool(export_cfg, minsize=0, maxsize=DB_EXPORT_POOL_MAX, name="export")
+        if db_pool is not None and export_cfg
+        else None
+    )
+    order_store = create_store(db_pool, reader_pool, export_pool)
+    if isinstance(order_store, MemoryOrderStore):
+        # every write to the memory store goes through this process
+        orders_cache = ResponseCache()
+        metrics.ORDER_BUFFER_ORDERS.labels().set_function(lambda: len(order_store.buffer))
+        metrics.ORDER_BUFFER_BYTES.labels().set_function(lambda: order_store.stats()["bytes"])
+    elif ORDERS_LISTEN:
+        # other tasks' writes arrive as orders_changed notifications
+        orders_listener = OrdersChangedListener(direct_config(), order_store.bump_version)
+        orders_listener.start()
+        orders_cache = ResponseCache(ttl=ORDERS_CACHE_LISTEN_SECONDS)
+    else:
+        orders_cache = ResponseCache(ttl=ORDERS_CACHE_SECONDS)
+    outbox_enabled = isinstance(order_store, PostgresOrderStore) and order_store.outbox
+
+    sqs_client = boto3.client("sqs", endpoint_url=SQS_ENDPOINT_URL) if SQS_ENABLED else None
+    # in outbox mode the relay publishes from order_outbox instead
+    sqs_publisher = None if outbox_enabled else create_publisher(sqs_client, SQS_QUEUE_URL)
+    if sqs_client is not None and not outbox_enabled:
+        batch_sender = OrderBatchSender(sqs_client, SQS_QUEUE_URL)
+    atexit.register(shutdown_runtime)
+    metrics.start_writer()
+    emf.start()
+    tracing.start()
+    profiling.install_signal_handler()
+
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+    if SQS_ENABLED and SQS_POLL_ENABLED:
+        thread = threading.Thread(target=poll_sqs, name="sqs-poller", daemon=True)
+        thread.start()
+
+    if SQS_ENABLED and outbox_enabled and OUTBOX_RELAY_ENABLED:
+        start_relays(order_store.pool, sqs_client, SQS_QUEUE_URL)
+
+
+def shutdown_runtime() -> None:
+    if _runtime_pid != os.getpid():
+        return
+    if orders_listener is not None:
+        orders_listener.stop()
+    if sqs_publisher is not None:
+        sqs_publisher.close()
+    if batch_sender is not None:
+        batch_sender.close()
+    for pool in (export_pool, reader_pool, db_pool):
+        if pool is not None:
+            pool.close()
+    metrics.flush()
+    emf.stop()
+    tracing.stop()
+
+
+if not APP_DEFER_INIT:
+    init_runtime()
 
 
 if __name__ == "__main__":
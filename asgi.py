@@ -0,0 +1,455 @@
+import asyncio
+import contextlib
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Optional
+from urllib.parse import parse_qsl
+
+from aiobotocore.session import get_session
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from orders import emf, metrics, tracing
+from orders.aio import (
+    AsyncMemoryOrderStore,
+    AsyncOrderBatchSender,
+    AsyncOrdersChangedListener,
+    AsyncPostgresOrderStore,
+    AsyncSqsPublisher,
+    create_async_store,
+    create_pool,
+    ingest_orders,
+    warm_pool,
+)
+from orders.api import (
+    READ_YOUR_WRITES_COOKIE,
+    new_order,
+    page_body,
+    page_status,
+    parse_page_query,
+    read_your_writes_cookie,
+)
+from orders.cache import (
+    ORDERS_CACHE_LISTEN_SECONDS,
+    ORDERS_CACHE_SECONDS,
+    ResponseCache,
+)
+from orders.db import (
+    DB_EXPORT_POOL_MAX,
+    DB_POOL_MIN,
+    DB_READER_POOL_MAX,
+    DB_READER_POOL_MIN,
+    db_config,
+    direct_config,
+    export_config,
+    reader_config,
+)
+from orders.export import (
+    EXPORT_CONCURRENCY,
+    EXPORT_FORMATS,
+    csv_header,
+    encode_batch,
+    export_headers,
+    parse_since,
+)
+from orders.ingest import body_format
+from orders.logs import configure_logging
+from orders.notify import ORDERS_LISTEN
+from orders.pages import INDEX_PAGE
+from orders.serialization import dumps_response, loads
+from orders.store import EXPORT_FETCH_SIZE
+
+# SERVING_MODE=async entry point: the routes of app.py on one event loop per
+# worker, so a request waiting on Postgres or SQS does not hold a thread
+
+configure_logging()
+logger = logging.getLogger("flexis-orders")
+
+DB_CHECK_CACHE_SECONDS = float(os.getenv("DB_CHECK_CACHE_SECONDS", "5"))
+DB_CHECK_TIMEOUT = float(os.getenv("DB_CHECK_TIMEOUT", "2"))
+_db_check_cache: dict[str, tuple[float, dict[str, Any], int]] = {}
+
+SQS_QUEUE_URL = os.getenv("SQS_QUEUE_URL")
+SQS_ENABLED = bool(SQS_QUEUE_URL)
+SQS_POLL_ENABLED = os.getenv("SQS_POLL_ENABLED", "true").lower() in ("1", "true", "yes")
+SQS_ENDPOINT_URL = os.getenv("SQS_ENDPOINT_URL")
+
+# per-process resources, created by lifespan()
+db_pool: Any = None
+reader_pool: Any = None
+export_pool: Any = None
+order_store: Any = None
+sqs_client: Any = None
+sqs_publisher: Optional[AsyncSqsPublisher] = None
+batch_sender: Optional[AsyncOrderBatchSender] = None
+orders_cache: Optional[ResponseCache] = None
+orders_listener: Optional[AsyncOrdersChangedListener] = None
+ready = asyncio.Event()
+_db_check_lock = asyncio.Lock()
+# each running export holds a reader connection
+_export_slots = asyncio.Semaphore(max(1, EXPORT_CONCURRENCY))
+
+
+class MetricsMiddleware:
+    """Records ``http_request_duration_seconds`` for every HTTP request."""
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_and_record_status(message: dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_record_status)
+        finally:
+            # the router sets "endpoint" on a match; every route is a fixed path
+            route = scope["path"] if "endpoint" in scope else "unmatched"
+            metrics.HTTP_REQUEST_SECONDS.labels(scope["method"], route, status).observe(
+                time.perf_counter() - started
+            )
+
+
+class TracingMiddleware:
+    """Runs every HTTP request in a server span, continuing an incoming ``traceparent``."""
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        traceparent = headers.get(b"traceparent")
+        span = tracing.start_span(
+            scope["method"],
+            kind=tracing.SERVER,
+            parent=tracing.parse_traceparent(traceparent.decode("latin-1") if traceparent else None),
+            attributes={"http.request.method": scope["method"], "url.path": scope["path"]},
+        )
+
+        async def send_and_record_status(message: dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                span.set_attribute("http.response.status_code", message["status"])
+                if message["status"] >= 500:
+                    span.set_error(f"HTTP {message['status']}")
+            await send(message)
+
+        token = tracing.activate(span)
+        try:
+            await self.app(scope, receive, send_and_record_status)
+        except BaseException as exc:
+            span.set_error(repr(exc))
+            raise
+        finally:
+            tracing.deactivate(token)
+            route = scope["path"] if "endpoint" in scope else "unmatched"
+            span.name = f"{scope['method']} {route}"
+            span.set_attribute("http.route", route)
+            span.end()
+
+
+class OrdersJSONResponse(JSONResponse):
+    # same bytes as Flask's jsonify so clients cannot tell the modes apart
+    def render(self, content: Any) -> bytes:
+        return dumps_response(content) + b"\n"
+
+
+def error(message: str, status: int) -> OrdersJSONResponse:
+    return OrdersJSONResponse({"status": "error", "error": message}, status_code=status)
+
+
+async def index(request: Request) -> Response:
+    coding = INDEX_PAGE.select(request.headers.get("accept-encoding"))
+    if INDEX_PAGE.not_modified(coding, request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=INDEX_PAGE.headers(coding, body=False))
+    return Response(INDEX_PAGE.bodies[coding], headers=INDEX_PAGE.headers(coding))
+
+
+async def list_orders(request: Request) -> Response:
+    try:
+        query = parse_page_query(request.query_params, request.cookies)
+    except ValueError as exc:
+        return error(str(exc), 400)
+
+    version = order_store.version
+    entry = None if query.consistent else orders_cache.get(query.cache_key, version)
+    if entry is None:
+        try:
+            orders, has_more = await order_store.page(query.limit, query.after, consistent=query.consistent)
+        except Exception as exc:
+            logger.exception("failed to list orders")
+            return error(str(exc) or type(exc).__name__, 503)
+        entry = orders_cache.put(query.cache_key, version, page_body(orders, has_more))
+
+    status, headers = page_status(entry, request.headers.get("if-none-match"))
+    if status == 304:
+        return Response(status_code=304, headers=headers)
+    return Response(entry.body, media_type="application/json", headers=headers)
+
+
+async def export_body(
+    fmt: str, first: list[dict[str, Any]], batches: AsyncIterator[list[dict[str, Any]]]
+) -> AsyncIterator[bytes]:
+    try:
+        if fmt == "csv":
+            yield csv_header()
+        if first:
+            yield encode_batch(fmt, first)
+        async for batch in batches:
+            yield encode_batch(fmt, batch)
+    finally:
+        await batches.aclose()
+        _export_slots.release()
+
+
+async def export_orders(request: Request) -> Response:
+    fmt = request.query_params.get("format", "ndjson")
+    if fmt not in EXPORT_FORMATS:
+        return error("format must be ndjson or csv", 400)
+    try:
+        since = parse_since(request.query_params.get("since"))
+    except ValueError as exc:
+        return error(str(exc), 400)
+
+    if _export_slots.locked():
+        return error("too many exports in progress", 429)
+    await _export_slots.acquire()
+    batches = order_store.export(since, EXPORT_FETCH_SIZE)
+    try:
+        first = await anext(batches, [])
+    except Exception as exc:
+        _export_slots.release()
+        logger.exception("failed to export orders")
+        return error(str(exc) or type(exc).__name__, 503)
+
+    return StreamingResponse(
+        export_body(fmt, first, batches),
+        media_type=EXPORT_FORMATS[fmt],
+        headers=export_headers(fmt),
+    )
+
+
+async def read_payload(request: Request) -> dict[str, Any]:
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    body = await request.body()
+    if content_type == "application/json" or content_type.endswith("+json"):
+        try:
+            payload = loads(body)
+        except ValueError:
+            payload = None
+        if isinstance(payload, dict) and payload:
+            return payload
+    if content_type == "application/x-www-form-urlencoded":
+        return dict(parse_qsl(body.decode("latin-1")))
+    return {}
+
+
+async def create_order(request: Request) -> OrdersJSONResponse:
+    payload = await read_payload(request)
+    order = new_order(payload)
+    try:
+        with tracing.span("orders insert", kind=tracing.CLIENT, attributes={"order.id": order["id"]}):
+            await order_store.add(order)
+    except Exception as exc:
+        logger.exception("failed to store order")
+        return error(str(exc) or type(exc).__name__, 503)
+    if sqs_publisher is not None:
+        await sqs_publisher.publish(order)
+
+    response = OrdersJSONResponse(order, status_code=201)
+    cookie = read_your_writes_cookie()
+    if cookie is not None:
+        value, max_age = cookie
+        response.set_cookie(READ_YOUR_WRITES_COOKIE, value, max_age=max_age, httponly=True, samesite="lax")
+    return response
+
+
+async def create_orders_batch(request: Request) -> OrdersJSONResponse:
+    fmt = body_format(request.headers.get("content-type"))
+    if fmt is None:
+        return error("send a JSON array or application/x-ndjson", 415)
+
+    report = await ingest_orders(request.stream(), fmt, order_store, batch_sender)
+    return OrdersJSONResponse(report.to_dict(), status_code=report.status)
+
+
+async def health(request: Request) -> OrdersJSONResponse:
+    body: dict[str, Any] = {"status": "ok"}
+    if isinstance(order_store, AsyncMemoryOrderStore):
+        body["orderBuffer"] = order_store.stats()
+    if sqs_publisher is not None:
+        body["sqsPublisher"] = sqs_publisher.stats()
+    if orders_cache is not None:
+        body["ordersCache"] = orders_cache.stats()
+    if orders_listener is not None:
+        body["ordersListener"] = orders_listener.stats()
+    return OrdersJSONResponse(body)
+
+
+async def check_db() -> tuple[dict[str, Any], int]:
+    async with _db_check_lock:
+        now = time.monotonic()
+        cached = _db_check_cache.get("result")
+        if cached and cached[0] > now:
+            return cached[1], cached[2]
+
+        try:
+            async with db_pool.acquire(timeout=DB_CHECK_TIMEOUT) as conn:
+                await conn.fetchval("SELECT 1", timeout=DB_CHECK_TIMEOUT)
+            result: tuple[dict[str, Any], int] = ({"status": "ok"}, 200)
+        except Exception as exc:
+            logger.exception("db check failed")
+            result = ({"status": "error", "error": str(exc) or type(exc).__name__}, 503)
+
+        _db_check_cache["result"] = (now + DB_CHECK_CACHE_SECONDS, *result)
+        return result
+
+
+async def db_check(request: Request) -> OrdersJSONResponse:
+    if db_pool is None:
+        return OrdersJSONResponse({"status": "skipped", "reason": "missing db env"})
+
+    body, status = await check_db()
+    return OrdersJSONResponse(body, status_code=status)
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    return Response(metrics.render(), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+
+async def ready_check(request: Request) -> OrdersJSONResponse:
+    if not ready.is_set():
+        return OrdersJSONResponse({"status": "starting"}, status_code=503)
+    return OrdersJSONResponse({"status": "ready"})
+
+
+async def warm_up() -> None:
+    delay = 0.5
+    while True:
+        try:
+            if db_pool is not None:
+                await warm_pool(db_pool, DB_POOL_MIN)
+            if reader_pool is not None:
+                await warm_pool(reader_pool, DB_READER_POOL_MIN)
+            if isinstance(order_store, AsyncPostgresOrderStore):
+                await order_store.ensure_schema()
+            if sqs_client is not None:
+                await sqs_client.get_queue_attributes(
+                    QueueUrl=SQS_QUEUE_URL,
+                    AttributeNames=["QueueArn"],
+                )
+            break
+        except Exception:
+            logger.exception("warm-up failed, retrying in %.1fs", delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 10)
+
+    ready.set()
+    logger.info("warm-up complete, ready for traffic")
+
+
+def register_pool_metrics(name: str, pool: Any) -> None:
+    # asyncpg queues waiters internally, so only occupancy is exported
+    metrics.DB_POOL_IN_USE.labels(name).set_function(lambda: pool.get_size() - pool.get_idle_size())
+    metrics.DB_POOL_SIZE.labels(name).set_function(pool.get_size)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: Starlette) -> AsyncIterator[None]:
+    """Create this worker's pools, SQS client and publisher on its own loop."""
+    global db_pool, reader_pool, export_pool, order_store, sqs_client, sqs_publisher, orders_cache, orders_listener
+    global batch_sender
+    async with contextlib.AsyncExitStack() as stack:
+        cfg = db_config()
+        if cfg and cfg.get("password"):
+            db_pool = await create_pool(cfg)
+            stack.push_async_callback(db_pool.close)
+            register_pool_metrics("writer", db_pool)
+            reader_cfg = reader_config()
+            if reader_cfg:
+                reader_pool = await create_pool(reader_cfg, maxsize=DB_READER_POOL_MAX)
+                stack.push_async_callback(reader_pool.close)
+                register_pool_metrics("reader", reader_pool)
+            export_cfg = None if reader_cfg else export_config()
+            if export_cfg:
+                export_pool = await create_pool(export_cfg, maxsize=DB_EXPORT_POOL_MAX)
+                stack.push_async_callback(export_pool.close)
+                register_pool_metrics("export", export_pool)
+        order_store = await create_async_store(db_pool, reader_pool, export_pool)
+        background: list[asyncio.Task[None]] = []
+        if isinstance(order_store, AsyncMemoryOrderStore):
+            orders_cache = ResponseCache()
+            buffer = order_store.store.buffer
+            metrics.ORDER_BUFFER_ORDERS.labels().set_function(lambda: len(buffer))
+            metrics.ORDER_BUFFER_BYTES.labels().set_function(lambda: buffer.stats()["bytes"])
+        elif ORDERS_LISTEN:
+            orders_listener = AsyncOrdersChangedListener(direct_config(), order_store.bump_version)
+            background.append(asyncio.create_task(orders_listener.run(), name="orders-listener"))
+            orders_cache = ResponseCache(ttl=ORDERS_CACHE_LISTEN_SECONDS)
+        else:
+            orders_cache = ResponseCache(ttl=ORDERS_CACHE_SECONDS)
+
+        if SQS_ENABLED:
+            sqs_client = await stack.enter_async_context(
+                get_session().create_client("sqs", endpoint_url=SQS_ENDPOINT_URL)
+            )
+            if order_store.outbox:
+                logger.warning("async mode does not run the outbox relay; run `python -m orders.relay`")
+            else:
+                sqs_publisher = AsyncSqsPublisher(sqs_client, SQS_QUEUE_URL)
+                batch_sender = AsyncOrderBatchSender(sqs_client, SQS_QUEUE_URL)
+                sqs_publisher.start()
+                # closed before the client it sends with
+                stack.push_async_callback(sqs_publisher.close)
+            if SQS_POLL_ENABLED:
+                logger.warning("async mode does not poll SQS; run `python -m orders.worker`")
+
+        background.append(asyncio.create_task(warm_up(), name="warm-up"))
+        metrics.start_writer()
+        emf.start()
+        tracing.start()
+        try:
+            yield
+        finally:
+            for task in background:
+                task.cancel()
+            await asyncio.gather(*background, return_exceptions=True)
+            metrics.flush()
+            emf.stop()
+            tracing.stop()
+
+
+routes = [
+    Route("/", index),
+    Route("/api/orders", list_orders, methods=["GET"]),
+    Route("/api/orders/export", export_orders, methods=["GET"]),
+    Route("/api/orders", create_order, methods=["POST"]),
+    Route("/api/orders/batch", create_orders_batch, methods=["POST"]),
+    Route("/health", health),
+    Route("/db-check", db_check),
+    Route("/ready", ready_check),
+    Route("/metrics", metrics_endpoint),
+]
+
+middleware = [Middleware(MetricsMiddleware)]
+if tracing.TRACE_ENABLED:
+    middleware.append(Middleware(TracingMiddleware))
+
+app = Starlette(routes=routes, lifespan=lifespan, middleware=middleware)
@@ -0,0 +1,163 @@
+# Gunicorn settings derived from the container's cgroup CPU and memory limits.
+# Every value can be overridden with the GUNICORN_* environment variables
+# that FlexiOrderApiStack sets from the `api.gunicorn` config block.
+import math
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Optional
+
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+
+
+def _read(path: Path) -> Optional[str]:
+    try:
+        return path.read_text().strip()
+    except OSError:
+        return None
+
+
+def cgroup_cpus() -> float:
+    # cgroup v2: "<quota> <period>" or "max <period>"
+    cpu_max = _read(CGROUP_ROOT / "cpu.max")
+    if cpu_max:
+        quota, _, period = cpu_max.partition(" ")
+        if quota != "max" and period:
+            return int(quota) / int(period)
+    # cgroup v1
+    quota_us = _read(CGROUP_ROOT / "cpu" / "cpu.cfs_quota_us")
+    period_us = _read(CGROUP_ROOT / "cpu" / "cpu.cfs_period_us")
+    if quota_us and period_us and int(quota_us) > 0:
+        return int(quota_us) / int(period_us)
+    return float(os.cpu_count() or 1)
+
+
+def cgroup_memory_mb() -> Optional[int]:
+    for path in (CGROUP_ROOT / "memory.max", CGROUP_ROOT / "memory" / "memory.limit_in_bytes"):
+        value = _read(path)
+        # v1 reports "no limit" as a huge number rather than "max"
+        if value and value != "max" and int(value) < 1 << 60:
+            return int(value) // (1024 * 1024)
+    return None
+
+
+def _env(name: str, default: Any) -> str:
+    return os.getenv(f"GUNICORN_{name}", str(default))
+
+
+def _flag(name: str, default: bool) -> bool:
+    return _env(name, default).lower() in ("1", "true", "yes")
+
+
+# "sync" serves app.py from gthread workers; "async" serves asgi.py from
+# uvicorn workers, one event loop per process
+SERVING_MODE = os.getenv("SERVING_MODE", "sync").lower()
+if SERVING_MODE not in ("sync", "async"):
+    raise ValueError(f"SERVING_MODE must be 'sync' or 'async', got '{SERVING_MODE}'")
+async_mode = SERVING_MODE == "async"
+
+cpus = cgroup_cpus()
+memory_mb = cgroup_memory_mb()
+# steady-state RSS of one worker with its pools, publisher and poller threads
+worker_memory_mb = int(_env("WORKER_MEMORY_MB", 160))
+
+# an event loop keeps one core busy on its own; threads spend most of their
+# time blocked, so gthread oversubscribes
+auto_workers = max(1, math.ceil(cpus * (1 if async_mode else 2)))
+if memory_mb:
+    # leave a quarter of the task for the master, page cache and spikes
+    auto_workers = max(1, min(auto_workers, int(memory_mb * 0.75) // worker_memory_mb))
+
+# a gthread request mostly waits on Postgres while holding a pooled
+# connection, so one thread per connection keeps the pool busy; more would
+# only queue in the pool for DB_POOL_TIMEOUT. uvicorn workers ignore threads.
+if async_mode:
+    auto_threads = 1
+elif os.getenv("DB_HOST"):
+    auto_threads = max(2, int(os.getenv("DB_POOL_MAX", "5")))
+else:
+    auto_threads = 4
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+wsgi_app = "asgi:app" if async_mode else "app:app"
+workers = int(_env("WORKERS", auto_workers))
+# the limits size workers and threads, not the class: asgi.py needs uvicorn,
+# and gthread is the sync class that honours keepalive behind the ALB
+worker_class = _env("WORKER_CLASS", "uvicorn.workers.UvicornWorker" if async_mode else "gthread")
+threads = int(_env("THREADS", auto_threads))
+
+# keep-alive must outlive the ALB idle timeout (60 s by default), otherwise
+# the ALB reuses connections gunicorn has already closed and returns 502s
+keepalive = int(_env("KEEPALIVE", 65))
+timeout = int(_env("TIMEOUT", 30))
+graceful_timeout = int(_env("GRACEFUL_TIMEOUT", 30))
+
+# recycle workers to bound slow leaks; jitter avoids restarting them together
+max_requests = int(_env("MAX_REQUESTS", 2000))
+max_requests_jitter = int(_env("MAX_REQUESTS_JITTER", 200))
+
+preload_app = _flag("PRELOAD", True)
+# heartbeat files on tmpfs; the container's overlay filesystem can stall them
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+accesslog = None
+errorlog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info").lower()
+
+# every worker writes a metrics snapshot here and /metrics sums them; one
+# directory per master so a restarted server never reads stale files
+os.environ.setdefault(
+    "METRICS_DIR",
+    os.path.join(worker_tmp_dir or tempfile.gettempdir(), f"flexis-metrics-{os.getpid()}"),
+)
+
+if preload_app and not async_mode:
+    # app.py skips its per-process setup at import; post_fork runs it instead
+    os.environ["APP_DEFER_INIT"] = "1"
+
+
+def on_starting(server: Any) -> None:
+    from orders import metrics
+
+    metrics.reset_dir()
+    server.log.info(
+        "gunicorn sizing: mode=%s cpus=%.2f memory_mb=%s workers=%d threads=%d class=%s preload=%s",
+        SERVING_MODE,
+        cpus,
+        memory_mb,
+        workers,
+        threads,
+        worker_class,
+        preload_app,
+    )
+
+
+def post_fork(server: Any, worker: Any) -> None:
+    # asgi.py sets itself up in its lifespan handler, on the worker's loop
+    if server.cfg.preload_app and not async_mode:
+        import app
+
+        app.init_runtime()
+
+
+def post_worker_init(worker: Any) -> None:
+    # gunicorn installs its own worker signal handlers after post_fork;
+    # this chains SIGUSR1 profiling in front of its log reopening
+    from orders import profiling
+
+    profiling.install_signal_handler()
+
+
+def worker_exit(server: Any, worker: Any) -> None:
+    import sys
+
+    app = sys.modules.get("app")
+    if app is not None:
+        app.shutdown_runtime()
+
+
+def child_exit(server: Any, worker: Any) -> None:
+    # runs in the master, so only one process ever writes the archive
+    from orders import metrics
+
+    metrics.mark_process_dead(worker.pid)
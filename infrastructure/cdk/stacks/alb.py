@@ -27,6 +27,9 @@ class FlexiAlbStack(Stack):
 
         name_prefix = config["namePrefix"]
         suffix = self.node.addr[:8]
+        health_check_path = str(config.get("api", {}).get("healthCheckPath", "/health"))
+        if not health_check_path.startswith("/"):
+            raise ValueError(f"api.healthCheckPath must start with '/', got '{health_check_path}'")
 
         vpc = ec2.Vpc.from_vpc_attributes(
             self,
@@ -94,7 +97,7 @@ class FlexiAlbStack(Stack):
             protocol=elbv2.ApplicationProtocol.HTTP,
             target_type=elbv2.TargetType.IP,
             health_check=elbv2.HealthCheck(
-                path="/health",
+                path=health_check_path,
                 healthy_http_codes="200",
             ),
         )
@@ -2,10 +2,13 @@ from pathlib import Path
 from typing import Mapping, Any
 
 from aws_cdk import (
+    Duration,
     RemovalPolicy,
     Stack,
     Fn,
     IgnoreMode,
+    aws_applicationautoscaling as appscaling,
+    aws_cloudwatch as cloudwatch,
     aws_ecs as ecs,
     aws_ec2 as ec2,
     aws_iam as iam,
@@ -18,6 +21,21 @@ from aws_cdk import (
 from constructs import Construct
 
 
+# api.gunicorn config keys -> env vars read by gunicorn.conf.py
+GUNICORN_ENV = {
+    "workers": "GUNICORN_WORKERS",
+    "threads": "GUNICORN_THREADS",
+    "workerClass": "GUNICORN_WORKER_CLASS",
+    "workerMemoryMb": "GUNICORN_WORKER_MEMORY_MB",
+    "keepalive": "GUNICORN_KEEPALIVE",
+    "timeout": "GUNICORN_TIMEOUT",
+    "gracefulTimeout": "GUNICORN_GRACEFUL_TIMEOUT",
+    "maxRequests": "GUNICORN_MAX_REQUESTS",
+    "maxRequestsJitter": "GUNICORN_MAX_REQUESTS_JITTER",
+    "preload": "GUNICORN_PRELOAD",
+}
+
+
 class FlexiOrderApiStack(Stack):
     def __init__(
         self,
@@ -62,7 +80,17 @@ class FlexiOrderApiStack(Stack):
             mutable=True,
         )
 
-        db_host = Fn.import_value(f"flexis-rds-{env_name}-endpoint")
+        db_direct_host = Fn.import_value(f"flexis-rds-{env_name}-endpoint")
+        db_reader_host = Fn.import_value(f"flexis-rds-{env_name}-reader-endpoint")
+
+        # with RDS Proxy in front of the cluster, writes go through the proxy;
+        # DB_DIRECT_HOST stays on the cluster for session-level work
+        proxy_enabled = bool((config.get("rdsProxy") or {}).get("enabled", False))
+        db_host = (
+            Fn.import_value(f"flexis-rds-{env_name}-proxy-endpoint")
+            if proxy_enabled
+            else db_direct_host
+        )
         db_port = Fn.import_value(f"flexis-rds-{env_name}-port")
         db_name = Fn.import_value(f"flexis-rds-{env_name}-dbname")
         db_secret_arn = Fn.import_value(f"flexis-rds-{env_name}-secret-arn")
@@ -80,6 +108,22 @@ class FlexiOrderApiStack(Stack):
         container_port = int(api_cfg.get("port", 8080))
         enable_exec = bool(api_cfg.get("enableExecuteCommand", False))
         enable_cb = bool(api_cfg.get("enableCircuitBreaker", True))
+        read_your_writes_seconds = float(api_cfg.get("readYourWritesSeconds", 0))
+        publish_mode = str(api_cfg.get("publishMode", "direct")).lower()
+        if publish_mode not in ("direct", "outbox"):
+            raise ValueError(f"api.publishMode must be 'direct' or 'outbox', got '{publish_mode}'")
+        serving_mode = str(api_cfg.get("servingMode", "sync")).lower()
+        if serving_mode not in ("sync", "async"):
+            raise ValueError(f"api.servingMode must be 'sync' or 'async', got '{serving_mode}'")
+        gunicorn_cfg = api_cfg.get("gunicorn") or {}
+        unknown_gunicorn = set(gunicorn_cfg) - set(GUNICORN_ENV)
+        if unknown_gunicorn:
+            raise ValueError(f"unknown api.gunicorn settings: {sorted(unknown_gunicorn)}")
+        gunicorn_env = {
+            GUNICORN_ENV[key]: str(value).lower() if isinstance(value, bool) else str(value)
+            for key, value in gunicorn_cfg.items()
+        }
+
         # Never roll back automatically; keep failed tasks around for debugging.
         cb_rollback = False
 
@@ -90,6 +134,30 @@ class FlexiOrderApiStack(Stack):
         cpu_target = int(autoscaling_cfg.get("cpuTarget", 60))
         memory_target = int(autoscaling_cfg.get("memoryTarget", 70))
 
+        worker_cfg = config.get("worker") or {}
+        worker_enabled = bool(worker_cfg.get("enabled", False))
+        worker_cpu = int(worker_cfg.get("cpu", cpu))
+        worker_memory = int(worker_cfg.get("memory", memory))
+        worker_pollers = int(worker_cfg.get("pollers", 1))
+        worker_concurrency = int(worker_cfg.get("concurrency", 4))
+
+        worker_scaling_cfg = worker_cfg.get("autoscaling", {})
+        worker_min = int(worker_scaling_cfg.get("minCapacity", 1))
+        worker_max = int(worker_scaling_cfg.get("maxCapacity", max(worker_min, 4)))
+        worker_desired = int(worker_cfg.get("desiredCount", worker_min))
+        backlog_per_task = float(worker_scaling_cfg.get("backlogPerTaskTarget", 100))
+        worker_cooldown = int(worker_scaling_cfg.get("cooldownSeconds", 60))
+
+        if worker_enabled:
+            if worker_min < 0 or worker_max < worker_min:
+                raise ValueError(
+                    f"worker.autoscaling requires 0 <= minCapacity <= maxCapacity, got {worker_min}..{worker_max}"
+                )
+            if not worker_min <= worker_desired <= worker_max:
+                raise ValueError("worker.desiredCount must be within worker.autoscaling min/max capacity")
+            if backlog_per_task <= 0:
+                raise ValueError("worker.autoscaling.backlogPerTaskTarget must be positive")
+
         queue_arn = Fn.import_value(f"flexis-orders-{env_name}-queue-arn")
         queue_url = Fn.import_value(f"flexis-orders-{env_name}-queue-url")
         queue = sqs.Queue.from_queue_attributes(
@@ -104,7 +172,8 @@ class FlexiOrderApiStack(Stack):
             "TaskRole",
             assumed_by=iam.ServicePrincipal("ecs-tasks.amazonaws.com"),
         )
-        queue.grant_consume_messages(task_role)
+        if not worker_enabled:
+            queue.grant_consume_messages(task_role)
         queue.grant_send_messages(task_role)
 
         execution_role = iam.Role(
@@ -165,10 +234,22 @@ class FlexiOrderApiStack(Stack):
             ),
             environment={
                 "DB_HOST": db_host,
+                "DB_DIRECT_HOST": db_direct_host,
+                "DB_PROXY": "true" if proxy_enabled else "false",
+                "DB_READER_HOST": db_reader_host,
                 "DB_PORT": db_port,
                 "DB_NAME": db_name,
                 "DB_USER": config.get("dbUser", "flexis_admin"),
+                "READ_YOUR_WRITES_SECONDS": f"{read_your_writes_seconds:g}",
                 "SQS_QUEUE_URL": queue_url,
+                # the worker service consumes the queue when enabled
+                "SQS_POLL_ENABLED": "false" if worker_enabled else "true",
+                "ORDER_PUBLISH_MODE": publish_mode,
+                "SERVING_MODE": serving_mode,
+                "EMF_ENABLED": "true",
+                "EMF_NAMESPACE": f"FlexiOrders/{env_name}",
+                "EMF_SERVICE": "orders-api",
+                **gunicorn_env,
             },
             secrets={
                 "DB_PASSWORD": ecs.Secret.from_secrets_manager(db_secret, field="password"),
@@ -227,6 +308,121 @@ class FlexiOrderApiStack(Stack):
             )
         )
 
+        if worker_enabled:
+            worker_role = iam.Role(
+                self,
+                "WorkerTaskRole",
+                assumed_by=iam.ServicePrincipal("ecs-tasks.amazonaws.com"),
+            )
+            queue.grant_consume_messages(worker_role)
+            if publish_mode == "outbox":
+                # the worker runs the outbox relay
+                queue.grant_send_messages(worker_role)
+
+            worker_task_definition = ecs.FargateTaskDefinition(
+                self,
+                "WorkerTaskDefinition",
+                cpu=worker_cpu,
+                memory_limit_mib=worker_memory,
+                task_role=worker_role,
+                execution_role=execution_role,
+                runtime_platform=ecs.RuntimePlatform(
+                    cpu_architecture=ecs.CpuArchitecture.ARM64,
+                    operating_system_family=ecs.OperatingSystemFamily.LINUX,
+                ),
+            )
+
+            worker_task_definition.add_container(
+                "worker",
+                image=container_image,
+                command=["python", "-m", "orders.worker"],
+                logging=ecs.LogDriver.aws_logs(
+                    stream_prefix="worker",
+                    log_group=log_group,
+                ),
+                environment={
+                    "DB_HOST": db_host,
+                    "DB_DIRECT_HOST": db_direct_host,
+                    "DB_PROXY": "true" if proxy_enabled else "false",
+                    "DB_PORT": db_port,
+                    "DB_NAME": db_name,
+                    "DB_USER": config.get("dbUser", "flexis_admin"),
+                    "SQS_QUEUE_URL": queue_url,
+                    "WORKER_POLLERS": str(worker_pollers),
+                    "WORKER_CONCURRENCY": str(worker_concurrency),
+                    "ORDER_PUBLISH_MODE": publish_mode,
+                    "EMF_ENABLED": "true",
+                    "EMF_NAMESPACE": f"FlexiOrders/{env_name}",
+                    "EMF_SERVICE": "orders-worker",
+                },
+                secrets={
+                    "DB_PASSWORD": ecs.Secret.from_secrets_manager(db_secret, field="password"),
+                },
+            )
+
+            worker_service = ecs.FargateService(
+                self,
+                "WorkerService",
+                cluster=cluster,
+                task_definition=worker_task_definition,
+                desired_count=worker_desired,
+                enable_execute_command=enable_exec,
+                security_groups=[ecs_app_sg],
+                vpc_subnets=ec2.SubnetSelection(subnets=private_subnets),
+            )
+
+            if enable_cb:
+                cfn_worker_service = worker_service.node.default_child
+                if isinstance(cfn_worker_service, ecs.CfnService):
+                    cfn_worker_service.deployment_configuration = ecs.CfnService.DeploymentConfigurationProperty(
+                        deployment_circuit_breaker=ecs.CfnService.DeploymentCircuitBreakerProperty(
+                            enable=True,
+                            rollback=cb_rollback,
+                        )
+                    )
+
+            if worker_max > worker_min:
+                # backlog per task = visible messages / running workers; RunningTaskCount
+                # comes from Container Insights, enabled on the cluster with the worker
+                backlog_metric = cloudwatch.MathExpression(
+                    expression="visible / IF(FILL(tasks, 0) > 0, FILL(tasks, 0), 1)",
+                    using_metrics={
+                        "visible": queue.metric_approximate_number_of_messages_visible(
+                            period=Duration.minutes(1),
+                            statistic="Maximum",
+                        ),
+                        "tasks": cloudwatch.Metric(
+                            namespace="ECS/ContainerInsights",
+                            metric_name="RunningTaskCount",
+                            dimensions_map={
+                                "ClusterName": cluster_name,
+                                "ServiceName": worker_service.service_name,
+                            },
+                            period=Duration.minutes(1),
+                            statistic="Average",
+                        ),
+                    },
+                    label="SQS backlog per worker task",
+                    period=Duration.minutes(1),
+                )
+
+                worker_scaling = worker_service.auto_scale_task_count(
+                    min_capacity=worker_min,
+                    max_capacity=worker_max,
+                )
+                worker_scaling.scale_on_metric(
+                    "BacklogPerTaskScaling",
+                    metric=backlog_metric,
+                    adjustment_type=appscaling.AdjustmentType.CHANGE_IN_CAPACITY,
+                    cooldown=Duration.seconds(worker_cooldown),
+                    scaling_steps=[
+                        appscaling.ScalingInterval(upper=backlog_per_task / 2, change=-1),
+                        appscaling.ScalingInterval(lower=backlog_per_task, change=+1),
+                        appscaling.ScalingInterval(lower=backlog_per_task * 2, change=+2),
+                        appscaling.ScalingInterval(lower=backlog_per_task * 4, change=+4),
+                    ],
+                )
+
         Tags.of(self).add("application", "flexicx")
         Tags.of(self).add("environment", env_name)
         Tags.of(self).add("product", "flexicx")
@@ -21,6 +21,11 @@ class FlexiEcsClusterStack(Stack):
         super().__init__(scope, construct_id, **kwargs)
 
         name_prefix = config["namePrefix"]
+        worker_cfg = config.get("worker") or {}
+        # the worker service scales on RunningTaskCount from Container Insights
+        container_insights = bool(
+            config.get("containerInsights", worker_cfg.get("enabled", False))
+        )
 
         vpc = ec2.Vpc.from_vpc_attributes(
             self,
@@ -36,6 +41,7 @@ class FlexiEcsClusterStack(Stack):
             "Cluster",
             vpc=vpc,
             cluster_name=f"{name_prefix}-cluster",
+            container_insights_v2=ecs.ContainerInsights.ENABLED if container_insights else None,
         )
 
         CfnOutput(
@@ -51,6 +51,17 @@ class FlexiPostgresStack(Stack):
         reader_class = str(readers_cfg.get("instanceClass", writer_class)).upper()
         reader_size = str(readers_cfg.get("instanceSize", writer_size)).upper()
 
+        proxy_cfg = config.get("rdsProxy") or {}
+        proxy_enabled = bool(proxy_cfg.get("enabled", False))
+        proxy_max_connections_percent = int(proxy_cfg.get("maxConnectionsPercent", 90))
+        proxy_max_idle_percent = int(proxy_cfg.get("maxIdleConnectionsPercent", 50))
+        proxy_idle_client_timeout = int(proxy_cfg.get("idleClientTimeoutSeconds", 1800))
+        proxy_borrow_timeout = int(proxy_cfg.get("borrowTimeoutSeconds", 30))
+        if proxy_enabled and not 0 < proxy_max_idle_percent <= proxy_max_connections_percent <= 100:
+            raise ValueError(
+                "rdsProxy requires 0 < maxIdleConnectionsPercent <= maxConnectionsPercent <= 100"
+            )
+
         engine_full = str(config.get("engineFullVersion", config.get("dbEngineVersion", "17.7")))
         engine_major = str(config.get("engineMajorVersion", engine_full.split(".")[0]))
 
@@ -185,12 +196,51 @@ class FlexiPostgresStack(Stack):
             monitoring_interval=monitoring_interval,
         )
 
+        if proxy_enabled:
+            if cluster.secret is None:
+                raise ValueError("rdsProxy requires generated cluster credentials")
+
+            proxy_sg = ec2.SecurityGroup.from_security_group_id(
+                self,
+                "ImportedRdsProxySg",
+                security_group_id=Fn.import_value(f"flexis-sg-{env_name}-rds-proxy-sg-id"),
+                mutable=False,
+            )
+
+            proxy = cluster.add_proxy(
+                "Proxy",
+                db_proxy_name=f"flexis-aurora-{env_name}-proxy",
+                vpc=vpc,
+                vpc_subnets=ec2.SubnetSelection(subnets=subnets),
+                security_groups=[proxy_sg],
+                secrets=[cluster.secret],
+                require_tls=True,
+                max_connections_percent=proxy_max_connections_percent,
+                max_idle_connections_percent=proxy_max_idle_percent,
+                idle_client_timeout=Duration.seconds(proxy_idle_client_timeout),
+                borrow_timeout=Duration.seconds(proxy_borrow_timeout),
+            )
+
+            CfnOutput(
+                self,
+                "DbProxyEndpoint",
+                value=proxy.endpoint,
+                export_name=f"flexis-rds-{env_name}-proxy-endpoint",
+            )
+
         CfnOutput(
             self,
             "DbEndpoint",
             value=cluster.cluster_endpoint.hostname,
             export_name=f"flexis-rds-{env_name}-endpoint",
         )
+        # load-balanced across readers; resolves to the writer when there are none
+        CfnOutput(
+            self,
+            "DbReaderEndpoint",
+            value=cluster.cluster_read_endpoint.hostname,
+            export_name=f"flexis-rds-{env_name}-reader-endpoint",
+        )
         CfnOutput(
             self,
             "DbPort",
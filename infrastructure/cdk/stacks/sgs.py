@@ -80,6 +80,31 @@ class FlexiSecurityGroupsStack(Stack):
             description="Allow Postgres from ECS",
         )
 
+        # RDS Proxy SG (only when the proxy is enabled)
+        proxy_cfg = config.get("rdsProxy") or {}
+        self.rds_proxy_sg = None
+        if proxy_cfg.get("enabled", False):
+            self.rds_proxy_sg = ec2.SecurityGroup(
+                self,
+                "RdsProxySg",
+                vpc=vpc,
+                description="Flexicx RDS Proxy",
+                allow_all_outbound=True,
+                security_group_name=f"{name_prefix}-rds-proxy-sg",
+            )
+            Tags.of(self.rds_proxy_sg).add("Name", f"{name_prefix}-rds-proxy-sg")
+
+            self.rds_proxy_sg.add_ingress_rule(
+                peer=self.ecs_app_sg,
+                connection=ec2.Port.tcp(5432),
+                description="Allow Postgres from ECS to RDS Proxy",
+            )
+            self.rds_sg.add_ingress_rule(
+                peer=self.rds_proxy_sg,
+                connection=ec2.Port.tcp(5432),
+                description="Allow Postgres from RDS Proxy",
+            )
+
         # outputs
         CfnOutput(
             self,
@@ -88,6 +113,14 @@ class FlexiSecurityGroupsStack(Stack):
             export_name=f"flexis-sg-{env_name}-rds-sg-id",
         )
 
+        if self.rds_proxy_sg is not None:
+            CfnOutput(
+                self,
+                "RdsProxySgId",
+                value=self.rds_proxy_sg.security_group_id,
+                export_name=f"flexis-sg-{env_name}-rds-proxy-sg-id",
+            )
+
         CfnOutput(
             self,
             "EcsAppSgId",
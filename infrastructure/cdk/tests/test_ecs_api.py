@@ -0,0 +1,133 @@
+import copy
+import sys
+from pathlib import Path
+from typing import Any, Optional
+
+import aws_cdk as cdk
+import pytest
+from aws_cdk.assertions import Match, Template
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from stacks.ecs_api import FlexiOrderApiStack  # noqa: E402
+
+BASE_CONFIG: dict[str, Any] = {
+    "account": "123456789012",
+    "region": "ap-southeast-2",
+    "namePrefix": "flexis-test",
+    "vpcId": "vpc-12345678",
+    "availabilityZones": ["ap-southeast-2a", "ap-southeast-2b"],
+    "privateSubnetIds": ["subnet-11111111", "subnet-22222222"],
+    # a registry image keeps synth from building the Docker asset
+    "api": {"image": "public.ecr.aws/docker/library/python:3.11-slim", "desiredCount": 1},
+    "worker": {
+        "enabled": True,
+        "autoscaling": {"minCapacity": 1, "maxCapacity": 4, "backlogPerTaskTarget": 100},
+    },
+}
+
+
+def synth(worker: Optional[dict[str, Any]] = None) -> Template:
+    config = copy.deepcopy(BASE_CONFIG)
+    if worker is not None:
+        config["worker"] = worker
+    app = cdk.App()
+    stack = FlexiOrderApiStack(
+        app,
+        "flexis-orders-test",
+        env_name="test",
+        config=config,
+        env=cdk.Environment(account=config["account"], region=config["region"]),
+    )
+    return Template.from_stack(stack)
+
+
+def container_env(name: str, value: str) -> dict[str, Any]:
+    return {"Name": name, "Value": value}
+
+
+@pytest.fixture(scope="module")
+def template() -> Template:
+    return synth()
+
+
+def test_worker_service_and_task_definition(template: Template) -> None:
+    template.resource_count_is("AWS::ECS::Service", 2)
+    template.has_resource_properties(
+        "AWS::ECS::TaskDefinition",
+        {
+            "ContainerDefinitions": [
+                Match.object_like({"Name": "worker", "Command": ["python", "-m", "orders.worker"]})
+            ],
+        },
+    )
+
+
+def test_worker_scales_on_backlog_per_task(template: Template) -> None:
+    template.has_resource_properties(
+        "AWS::ApplicationAutoScaling::ScalableTarget",
+        {"MinCapacity": 1, "MaxCapacity": 4},
+    )
+    policies = template.find_resources(
+        "AWS::ApplicationAutoScaling::ScalingPolicy",
+        {"Properties": {"PolicyType": "StepScaling"}},
+    )
+    # one policy and one alarm each for scaling out and in
+    assert len(policies) == 2
+    alarms = template.find_resources("AWS::CloudWatch::Alarm")
+    assert len(alarms) == 2
+    for alarm in alarms.values():
+        queries = alarm["Properties"]["Metrics"]
+        expressions = [q["Expression"] for q in queries if "Expression" in q]
+        assert expressions == ["visible / IF(FILL(tasks, 0) > 0, FILL(tasks, 0), 1)"]
+        metric_names = {q["MetricStat"]["Metric"]["MetricName"] for q in queries if "MetricStat" in q}
+        assert metric_names == {"ApproximateNumberOfMessagesVisible", "RunningTaskCount"}
+
+
+def test_api_stops_polling_when_worker_enabled(template: Template) -> None:
+    template.has_resource_properties(
+        "AWS::ECS::TaskDefinition",
+        {
+            "ContainerDefinitions": [
+                Match.object_like(
+                    {
+                        "Name": "api",
+                        "Environment": Match.array_with([container_env("SQS_POLL_ENABLED", "false")]),
+                    }
+                )
+            ],
+        },
+    )
+
+
+def test_api_polls_without_worker() -> None:
+    template = synth({"enabled": False})
+    template.resource_count_is("AWS::ECS::Service", 1)
+    template.resource_count_is("AWS::CloudWatch::Alarm", 0)
+    template.has_resource_properties(
+        "AWS::ECS::TaskDefinition",
+        {
+            "ContainerDefinitions": [
+                Match.object_like(
+                    {
+                        "Name": "api",
+                        "Environment": Match.array_with([container_env("SQS_POLL_ENABLED", "true")]),
+                    }
+                )
+            ],
+        },
+    )
+
+
+@pytest.mark.parametrize(
+    "worker",
+    [
+        {"enabled": True, "autoscaling": {"minCapacity": 3, "maxCapacity": 2}},
+        {"enabled": True, "autoscaling": {"minCapacity": -1, "maxCapacity": 2}},
+        {"enabled": True, "desiredCount": 5, "autoscaling": {"minCapacity": 1, "maxCapacity": 4}},
+        {"enabled": True, "autoscaling": {"backlogPerTaskTarget": 0}},
+    ],
+)
+def test_invalid_worker_config_raises(worker: dict[str, Any]) -> None:
+    with pytest.raises(ValueError):
+        synth(worker)
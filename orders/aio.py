@@ -0,0 +1,515 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Optional
+
+import asyncpg
+
+from orders import tracing
+from orders.db import (
+    DB_POOL_MAX,
+    DB_POOL_TIMEOUT,
+    DB_PROXY,
+    db_config,
+)
+from orders.ingest import BatchIngest, Chunk, IngestReport, SendJob, record_unsent, send_jobs
+from orders.notify import (
+    ORDERS_CHANNEL,
+    ORDERS_LISTEN_PING_SECONDS,
+    ORDERS_NOTIFY,
+    ORDERS_NOTIFY_SETTLE_SECONDS,
+)
+from orders.publisher import (
+    SQS_PUBLISH_MAX_ATTEMPTS,
+    SQS_PUBLISH_QUEUE_SIZE,
+    SQS_PUBLISH_SHUTDOWN_SECONDS,
+    BasePublisher,
+    BatchSend,
+    _no_count,
+    end_send_spans,
+    message_size,
+)
+from orders.serialization import dumps
+from orders.store import (
+    EXPORT_FETCH_SIZE,
+    ORDER_PUBLISH_MODE,
+    ORDER_STORE,
+    SCHEMA_LOCK_TIMEOUT,
+    SCHEMA_STEPS,
+    MemoryOrderStore,
+    PageKey,
+    _order_to_row,
+    _row_to_order,
+    warn_export_pinning,
+)
+
+logger = logging.getLogger("flexis-orders.aio")
+
+_STOP = object()
+
+
+def _connect_kwargs(cfg: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "host": cfg["host"],
+        "port": cfg["port"],
+        "database": cfg["dbname"],
+        "user": cfg["user"],
+        "password": cfg["password"],
+        "timeout": cfg["connect_timeout"],
+    }
+
+
+async def create_pool(cfg: dict[str, Any], *, maxsize: int = DB_POOL_MAX) -> asyncpg.Pool:
+    # min_size=0 keeps creation off the network; warm_pool() opens connections
+    return await asyncpg.create_pool(
+        **_connect_kwargs(cfg),
+        min_size=0,
+        max_size=maxsize,
+        # named prepared statements pin RDS Proxy client connections
+        statement_cache_size=0 if DB_PROXY else 100,
+    )
+
+
+async def warm_pool(pool: asyncpg.Pool, size: int) -> None:
+    conns = [await pool.acquire(timeout=DB_POOL_TIMEOUT) for _ in range(size)]
+    for conn in conns:
+        await pool.release(conn)
+
+
+class AsyncMemoryOrderStore:
+    """``MemoryOrderStore`` behind the async interface; it never waits on I/O."""
+
+    outbox = False
+
+    def __init__(self, store: Optional[MemoryOrderStore] = None) -> None:
+        self.store = store or MemoryOrderStore()
+
+    @property
+    def version(self) -> int:
+        return self.store.version
+
+    async def add(self, order: dict[str, Any]) -> None:
+        self.store.add(order)
+
+    async def add_many(self, orders: list[dict[str, Any]], *, publish: bool = False) -> list[str]:
+        return self.store.add_many(orders)
+
+    async def page(
+        self, limit: int, after: Optional[PageKey] = None, *, consistent: bool = False
+    ) -> tuple[list[dict[str, Any]], bool]:
+        return self.store.page(limit, after)
+
+    async def export(
+        self, since: Optional[datetime] = None, fetch_size: int = EXPORT_FETCH_SIZE
+    ) -> AsyncIterator[list[dict[str, Any]]]:
+        for batch in self.store.export(since, fetch_size):
+            yield batch
+
+    def stats(self) -> dict[str, int]:
+        return self.store.stats()
+
+
+class AsyncPostgresOrderStore:
+    """Orders in Postgres through asyncpg pools, for the async app."""
+
+    def __init__(
+        self,
+        pool: asyncpg.Pool,
+        *,
+        reader_pool: Optional[asyncpg.Pool] = None,
+        export_pool: Optional[asyncpg.Pool] = None,
+        outbox: bool = False,
+        notify: bool = ORDERS_NOTIFY,
+    ) -> None:
+        self.pool = pool
+        self.reader_pool = reader_pool or pool
+        self.export_pool = export_pool or self.reader_pool
+        if self.export_pool is pool:
+            warn_export_pinning()
+        self.outbox = outbox
+        self.notify = notify
+        # only touched from the event loop, so no lock
+        self.version = 0
+
+    def bump_version(self) -> None:
+        self.version += 1
+
+    async def ensure_schema(self) -> None:
+        async with self.pool.acquire(timeout=DB_POOL_TIMEOUT) as conn:
+            missing = [ddl for check, ddl in SCHEMA_STEPS if await conn.fetchval(check) is None]
+            if missing:
+                async with conn.transaction():
+                    await conn.execute("SELECT set_config('lock_timeout', $1, true)", SCHEMA_LOCK_TIMEOUT)
+                    for ddl in missing:
+                        await conn.execute(ddl)
+
+    async def add(self, order: dict[str, Any]) -> None:
+        async with self.pool.acquire(timeout=DB_POOL_TIMEOUT) as conn, conn.transaction():
+            status = await conn.execute(
+                "INSERT INTO orders (id, customer, notes, created_at) VALUES ($1, $2, $3, $4) "
+                "ON CONFLICT (id) DO NOTHING",
+                *_order_to_row(order),
+            )
+            if status == "INSERT 0 0":
+                return
+            if self.outbox:
+                await conn.execute(
+                    "INSERT INTO order_outbox (order_id, payload, traceparent) VALUES ($1, $2, $3)",
+                    order["id"],
+                    dumps(order).decode(),
+                    tracing.current_traceparent(),
+                )
+            if self.notify:
+                await conn.execute(f'NOTIFY "{ORDERS_CHANNEL}"')
+        self.bump_version()
+
+    async def add_many(self, orders: list[dict[str, Any]], *, publish: bool = False) -> list[str]:
+        if not orders:
+            return []
+        # one array per column keeps the statement text small behind RDS Proxy
+        columns = list(zip(*(_order_to_row(order) for order in orders)))
+        async with self.pool.acquire(timeout=DB_POOL_TIMEOUT) as conn, conn.transaction():
+            rows = await conn.fetch(
+                "INSERT INTO orders (id, customer, notes, created_at) "
+                "SELECT * FROM unnest($1::uuid[], $2::text[], $3::text[], $4::timestamptz[]) "
+                "ON CONFLICT (id) DO NOTHING RETURNING id",
+                *columns,
+            )
+            inserted = [str(row["id"]) for row in rows]
+            if publish and self.outbox and inserted:
+                new = set(inserted)
+                outbox_ids, payloads = [], []
+                for order in orders:
+                    if order["id"] in new:
+                        new.discard(order["id"])
+                        outbox_ids.append(order["id"])
+                        payloads.append(dumps(order).decode())
+                await conn.execute(
+                    "INSERT INTO order_outbox (order_id, payload, traceparent) "
+                    "SELECT *, $3::text FROM unnest($1::uuid[], $2::text[])",
+                    outbox_ids,
+                    payloads,
+                    tracing.current_traceparent(),
+                )
+            if self.notify and inserted:
+                await conn.execute(f'NOTIFY "{ORDERS_CHANNEL}"')
+        if inserted:
+            self.bump_version()
+        return inserted
+
+    async def page(
+        self, limit: int, after: Optional[PageKey] = None, *, consistent: bool = False
+    ) -> tuple[list[dict[str, Any]], bool]:
+        pool = self.pool if consistent else self.reader_pool
+        async with pool.acquire(timeout=DB_POOL_TIMEOUT) as conn:
+            if after is None:
+                rows = await conn.fetch(
+                    "SELECT id, customer, notes, created_at FROM orders "
+                    "ORDER BY created_at DESC, id DESC LIMIT $1",
+                    limit + 1,
+                )
+            else:
+                rows = await conn.fetch(
+                    "SELECT id, customer, notes, created_at FROM orders "
+                    "WHERE (created_at, id) < ($1, $2::uuid) "
+                    "ORDER BY created_at DESC, id DESC LIMIT $3",
+                    after[0],
+                    after[1],
+                    limit + 1,
+                )
+        return [_row_to_order(row) for row in rows[:limit]], len(rows) > limit
+
+    async def export(
+        self, since: Optional[datetime] = None, fetch_size: int = EXPORT_FETCH_SIZE
+    ) -> AsyncIterator[list[dict[str, Any]]]:
+        """Stream orders through a server-side cursor on the export pool, ``fetch_size`` rows per fetch."""
+        async with self.export_pool.acquire(timeout=DB_POOL_TIMEOUT) as conn, conn.transaction():
+            if since is None:
+                cursor = await conn.cursor(
+                    "SELECT id, customer, notes, created_at FROM orders "
+                    "ORDER BY created_at, id"
+                )
+            else:
+                cursor = await conn.cursor(
+                    "SELECT id, customer, notes, created_at FROM orders "
+                    "WHERE created_at >= $1 ORDER BY created_at, id",
+                    since,
+                )
+            while True:
+                rows = await cursor.fetch(fetch_size)
+                if not rows:
+                    return
+                yield [_row_to_order(row) for row in rows]
+
+
+async def create_async_store(
+    pool: Optional[asyncpg.Pool] = None,
+    reader_pool: Optional[asyncpg.Pool] = None,
+    export_pool: Optional[asyncpg.Pool] = None,
+) -> Any:
+    """The store ``ORDER_STORE`` and ``ORDER_PUBLISH_MODE`` ask for; the warm-up ensures its schema."""
+    mode = ORDER_STORE or ("postgres" if pool is not None else "memory")
+    if ORDER_PUBLISH_MODE not in ("direct", "outbox"):
+        raise ValueError(f"unknown ORDER_PUBLISH_MODE: {ORDER_PUBLISH_MODE}")
+    if ORDER_PUBLISH_MODE == "outbox" and mode != "postgres":
+        raise ValueError("ORDER_PUBLISH_MODE=outbox requires the postgres order store")
+
+    if mode == "memory":
+        logger.info("using in-memory order store")
+        return AsyncMemoryOrderStore()
+    if mode != "postgres":
+        raise ValueError(f"unknown ORDER_STORE: {mode}")
+
+    if pool is None:
+        cfg = db_config()
+        if not cfg or not cfg.get("password"):
+            raise ValueError("ORDER_STORE=postgres requires DB_HOST and DB_PASSWORD")
+        pool = await create_pool(cfg)
+
+    # the schema is ensured by the warm-up once the database answers
+    logger.info("using async postgres order store (publish mode: %s)", ORDER_PUBLISH_MODE)
+    return AsyncPostgresOrderStore(
+        pool,
+        reader_pool=reader_pool,
+        export_pool=export_pool,
+        outbox=ORDER_PUBLISH_MODE == "outbox",
+    )
+
+
+class AsyncOrdersChangedListener:
+    """Calls ``on_change`` on each orders_changed notification; reconnects with backoff."""
+
+    def __init__(
+        self,
+        cfg: dict[str, Any],
+        on_change: Callable[[], None],
+        *,
+        channel: str = ORDERS_CHANNEL,
+        settle_seconds: float = ORDERS_NOTIFY_SETTLE_SECONDS,
+        ping_seconds: float = ORDERS_LISTEN_PING_SECONDS,
+    ) -> None:
+        self.cfg = cfg
+        self.on_change = on_change
+        self.channel = channel
+        self.settle_seconds = settle_seconds
+        self.ping_seconds = ping_seconds
+        self.notifications = 0
+        self.reconnects = 0
+        self._settle: Optional[asyncio.TimerHandle] = None
+
+    def _fire(self) -> None:
+        try:
+            self.on_change()
+        except Exception:
+            logger.exception("orders_changed handler failed")
+
+    def _notified(self, conn: Any, pid: int, channel: str, payload: str) -> None:
+        self.notifications += 1
+        self._fire()
+        if self.settle_seconds > 0:
+            if self._settle is not None:
+                self._settle.cancel()
+            self._settle = asyncio.get_running_loop().call_later(self.settle_seconds, self._fire)
+
+    async def _listen(self, conn: asyncpg.Connection) -> None:
+        lost = asyncio.Event()
+        conn.add_termination_listener(lambda _: lost.set())
+        await conn.add_listener(self.channel, self._notified)
+        logger.info("listening on %s", self.channel)
+        self._fire()
+        while not lost.is_set():
+            try:
+                await asyncio.wait_for(lost.wait(), self.ping_seconds)
+            except asyncio.TimeoutError:
+                await conn.execute("SELECT 1", timeout=self.ping_seconds)
+
+    async def run(self) -> None:
+        delay = 0.5
+        while True:
+            try:
+                conn = await asyncpg.connect(**_connect_kwargs(self.cfg))
+            except (OSError, asyncio.TimeoutError, asyncpg.PostgresError):
+                logger.warning("cannot LISTEN on %s, retrying in %.1fs", self.channel, delay, exc_info=True)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+                continue
+
+            delay = 0.5
+            try:
+                await self._listen(conn)
+            except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError):
+                logger.warning("lost %s listener connection", self.channel, exc_info=True)
+            finally:
+                conn.terminate()
+            self.reconnects += 1
+
+    def stats(self) -> dict[str, int]:
+        return {"notifications": self.notifications, "reconnects": self.reconnects}
+
+
+async def send_batch(
+    client: Any,
+    queue_url: str,
+    bodies: list[bytes],
+    *,
+    traceparents: Optional[list[Optional[str]]] = None,
+    max_attempts: int = SQS_PUBLISH_MAX_ATTEMPTS,
+    count: Callable[[str, int], None] = _no_count,
+) -> list[int]:
+    """Send up to ten bodies in one ``send_message_batch`` call; returns the indexes not sent."""
+    send = BatchSend(bodies, traceparents, count)
+    for attempt in range(1, max(1, max_attempts) + 1):
+        started = time.perf_counter()
+        try:
+            response = await client.send_message_batch(QueueUrl=queue_url, Entries=send.entries())
+        except Exception:
+            send.raised(attempt)
+        else:
+            send.handle(response, started)
+        delay = send.backoff(attempt, max_attempts)
+        if delay is None:
+            break
+        await asyncio.sleep(delay)
+    return send.unsent(attempt)
+
+
+class AsyncSqsPublisher(BasePublisher):
+    """Publishes order messages from sender tasks on the event loop, through an aiobotocore client."""
+
+    def __init__(
+        self, client: Any, queue_url: str, *, max_queue: int = SQS_PUBLISH_QUEUE_SIZE, **settings: Any
+    ) -> None:
+        super().__init__(client, queue_url, **settings)
+        self._queue: asyncio.Queue[Any] = asyncio.Queue(maxsize=max_queue)
+        self._tasks: list[asyncio.Task[None]] = []
+
+    def start(self) -> None:
+        for i in range(self._senders):
+            self._tasks.append(asyncio.create_task(self._run(), name=f"sqs-publisher-{i}"))
+
+    async def publish(self, order: dict[str, Any]) -> bool:
+        item = self._message(order)
+        if item is None:
+            return False
+        try:
+            await asyncio.wait_for(self._queue.put(item), self.block_seconds)
+        except asyncio.TimeoutError:
+            self._queue_full(order, item[1])
+            return False
+        self._count("queued")
+        return True
+
+    async def _send_batch(self, batch: list[tuple[bytes, tracing.Span]]) -> None:
+        sends, bodies, options = self._start_sending(batch)
+        end_send_spans(sends, await send_batch(self.client, self.queue_url, bodies, **options))
+
+    async def _collect(self, first: Any) -> tuple[list[Any], Optional[Any], bool]:
+        batch = [first]
+        size = message_size(first[0])
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.batch_max_messages:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    item = await asyncio.wait_for(self._queue.get(), remaining)
+                else:
+                    item = self._queue.get_nowait()
+            except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                break
+            if item is _STOP:
+                self._queue.task_done()
+                return batch, None, True
+            item_size = message_size(item[0])
+            if size + item_size > self.batch_max_bytes:
+                return batch, item, False
+            batch.append(item)
+            size += item_size
+        return batch, None, False
+
+    async def _run(self) -> None:
+        carry: Optional[Any] = None
+        while True:
+            item = carry if carry is not None else await self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                return
+            batch, carry, stop = await self._collect(item)
+            try:
+                await self._send_batch(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                return
+
+    async def close(self, timeout: float = SQS_PUBLISH_SHUTDOWN_SECONDS) -> None:
+        if self._closed:
+            return
+        self._closed = True
+
+        deadline = time.monotonic() + timeout
+        for _ in self._tasks:
+            try:
+                await asyncio.wait_for(self._queue.put(_STOP), max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                break
+        if self._tasks:
+            _, running = await asyncio.wait(self._tasks, timeout=max(deadline - time.monotonic(), 0))
+            for task in running:
+                task.cancel()
+
+        pending = sum(1 for item in self._queue._queue if item is not _STOP)  # type: ignore[attr-defined]
+        self._unsent_at_close(pending)
+
+
+class AsyncOrderBatchSender:
+    """Publishes a chunk of orders as concurrent ``send_message_batch`` calls and waits for the outcome."""
+
+    def __init__(self, client: Any, queue_url: str) -> None:
+        self.client = client
+        self.queue_url = queue_url
+
+    async def _send(self, job: SendJob) -> list[str]:
+        ids, bodies, traceparent = job
+        failed = await send_batch(self.client, self.queue_url, bodies, traceparents=[traceparent] * len(bodies))
+        return [ids[i] for i in failed]
+
+    async def send(self, orders: list[dict[str, Any]]) -> set[str]:
+        """Ids of the orders that were not sent."""
+        with tracing.span("orders publish batch", kind=tracing.PRODUCER) as span:
+            jobs = send_jobs(orders, span.traceparent())
+            return record_unsent(span, jobs, await asyncio.gather(*map(self._send, jobs)))
+
+
+async def _write_chunk(
+    report: IngestReport, store: Any, chunk: Chunk, sender: Optional[AsyncOrderBatchSender]
+) -> None:
+    orders = [order for _, order in chunk]
+    try:
+        inserted = await store.add_many(orders, publish=True)
+    except Exception as exc:
+        logger.exception("failed to store %d ingested orders", len(orders))
+        report.failed(chunk, str(exc) or type(exc).__name__)
+        return
+    new = set(inserted)
+    unsent = await sender.send([order for order in orders if order["id"] in new]) if sender and new else set()
+    report.stored(chunk, inserted, unsent)
+
+
+async def ingest_orders(
+    chunks: AsyncIterator[bytes],
+    fmt: str,
+    store: Any,
+    sender: Optional[AsyncOrderBatchSender] = None,
+) -> IngestReport:
+    """Stream request body ``chunks`` into ``store`` and publish what was new."""
+    ingest = BatchIngest(fmt)
+    async for data in chunks:
+        for chunk in ingest.feed(data):
+            await _write_chunk(ingest.report, store, chunk, sender)
+        if ingest.done:
+            return ingest.report
+    for chunk in ingest.close():
+        await _write_chunk(ingest.report, store, chunk, sender)
+    return ingest.report
@@ -0,0 +1,72 @@
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Mapping, NamedTuple, Optional
+
+from orders.cache import CachedResponse, etag_matches
+from orders.serialization import dumps_response
+from orders.store import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, PageKey, decode_cursor, encode_cursor
+
+# after a POST, the client's reads go to the writer this long
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "0"))
+READ_YOUR_WRITES_COOKIE = "orders_rw_until"
+
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def new_order(payload: Mapping[str, Any]) -> dict[str, Any]:
+    return {
+        "id": str(uuid.uuid4()),
+        "customer": payload.get("customer", "anonymous"),
+        "notes": payload.get("notes", ""),
+        "createdAt": now_iso(),
+    }
+
+
+def read_your_writes_cookie() -> Optional[tuple[str, int]]:
+    """Value and max-age of the cookie that pins a client to the writer, or None when disabled."""
+    if READ_YOUR_WRITES_SECONDS <= 0:
+        return None
+    return f"{time.time() + READ_YOUR_WRITES_SECONDS:.3f}", int(READ_YOUR_WRITES_SECONDS) + 1
+
+
+class PageQuery(NamedTuple):
+    limit: int
+    after: Optional[PageKey]
+    # pinned clients read the writer and must not get another client's cached page
+    consistent: bool
+    cache_key: tuple[int, str]
+
+
+def parse_page_query(args: Mapping[str, str], cookies: Mapping[str, str]) -> PageQuery:
+    """``GET /api/orders`` parameters; a ValueError carries the message for the 400."""
+    try:
+        limit = int(args.get("limit", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError("limit must be an integer") from None
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+    after = args.get("after")
+    # InvalidCursor is a ValueError
+    after_key = decode_cursor(after) if after else None
+
+    try:
+        pinned_until = float(cookies.get(READ_YOUR_WRITES_COOKIE, "0"))
+    except ValueError:
+        pinned_until = 0.0
+    return PageQuery(limit, after_key, pinned_until > time.time(), (limit, after or ""))
+
+
+def page_body(orders: list[dict[str, Any]], has_more: bool) -> bytes:
+    next_cursor = encode_cursor(orders[-1]) if has_more and orders else None
+    return dumps_response({"orders": orders, "nextCursor": next_cursor}) + b"\n"
+
+
+def page_status(entry: CachedResponse, if_none_match: Optional[str]) -> tuple[int, dict[str, str]]:
+    """Status (200 or 304) and headers for a cached page."""
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    return (304 if etag_matches(if_none_match, entry.etag) else 200), headers
@@ -0,0 +1,157 @@
+import os
+import sys
+import threading
+from datetime import datetime
+from typing import Any, Optional
+
+ORDER_BUFFER_MAX_ORDERS = int(os.getenv("ORDER_BUFFER_MAX_ORDERS", "10000"))
+ORDER_BUFFER_MAX_BYTES = int(os.getenv("ORDER_BUFFER_MAX_BYTES", str(16 * 1024 * 1024)))
+
+
+class OrderRecord:
+    __slots__ = ("id", "customer", "notes", "created", "nbytes")
+
+    def __init__(self, order_id: str, customer: str, notes: str, created: datetime) -> None:
+        self.id = order_id
+        self.customer = customer
+        self.notes = notes
+        self.created = created
+        self.nbytes = (
+            sys.getsizeof(self)
+            + sys.getsizeof(order_id)
+            + sys.getsizeof(customer)
+            + sys.getsizeof(notes)
+            + sys.getsizeof(created)
+        )
+
+    @classmethod
+    def from_order(cls, order: dict[str, Any]) -> "OrderRecord":
+        return cls(
+            order["id"],
+            order["customer"],
+            order["notes"],
+            datetime.fromisoformat(order["createdAt"]),
+        )
+
+    @property
+    def key(self) -> tuple[datetime, str]:
+        return self.created, self.id
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "customer": self.customer,
+            "notes": self.notes,
+            "createdAt": self.created.isoformat(),
+        }
+
+
+class OrderBuffer:
+    """Fixed-capacity ring of the most recent orders, oldest first.
+
+    The oldest records are evicted once either ``max_orders`` or the
+    approximate ``max_bytes`` budget is exceeded. Ids are unique among the
+    retained records, as they are in the orders table.
+    """
+
+    def __init__(
+        self,
+        max_orders: int = ORDER_BUFFER_MAX_ORDERS,
+        max_bytes: int = ORDER_BUFFER_MAX_BYTES,
+    ) -> None:
+        if max_orders < 1 or max_bytes < 1:
+            raise ValueError(f"invalid buffer size: orders={max_orders} bytes={max_bytes}")
+
+        self.max_orders = max_orders
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._ring: list[Optional[OrderRecord]] = [None] * max_orders
+        self._ids: set[str] = set()
+        self._head = 0
+        self._len = 0
+        self._bytes = 0
+        self._evictions = 0
+        self._evicted_bytes = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def _at(self, i: int) -> OrderRecord:
+        record = self._ring[(self._head + i) % self.max_orders]
+        assert record is not None
+        return record
+
+    def _evict_oldest(self) -> None:
+        record = self._at(0)
+        self._ring[self._head] = None
+        self._ids.discard(record.id)
+        self._head = (self._head + 1) % self.max_orders
+        self._len -= 1
+        self._bytes -= record.nbytes
+        self._evictions += 1
+        self._evicted_bytes += record.nbytes
+
+    def _bisect_left(self, key: tuple[datetime, str]) -> int:
+        lo, hi = 0, self._len
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._at(mid).key < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def append(self, record: OrderRecord) -> bool:
+        """Insert in key order; False when a record with the same id is retained."""
+        with self._lock:
+            if record.id in self._ids:
+                return False
+            idx = self._len
+            if self._len and record.key < self._at(self._len - 1).key:
+                idx = self._bisect_left(record.key)
+
+            if self._len == self.max_orders:
+                if idx == 0:
+                    # older than everything retained; it would be evicted immediately
+                    self._evictions += 1
+                    self._evicted_bytes += record.nbytes
+                    return True
+                self._evict_oldest()
+                idx -= 1
+
+            cap = self.max_orders
+            for i in range(self._len, idx, -1):
+                self._ring[(self._head + i) % cap] = self._ring[(self._head + i - 1) % cap]
+            self._ring[(self._head + idx) % cap] = record
+            self._ids.add(record.id)
+            self._len += 1
+            self._bytes += record.nbytes
+
+            while self._bytes > self.max_bytes and self._len > 1:
+                self._evict_oldest()
+            return True
+
+    def page(
+        self, limit: int, after: Optional[tuple[datetime, str]] = None
+    ) -> tuple[list[OrderRecord], bool]:
+        with self._lock:
+            end = self._len if after is None else self._bisect_left(after)
+            start = max(end - limit, 0)
+            return [self._at(i) for i in range(end - 1, start - 1, -1)], start > 0
+
+    def since(self, created: Optional[datetime] = None) -> list[OrderRecord]:
+        """Snapshot of the records created at or after ``created``, oldest first."""
+        with self._lock:
+            start = 0 if created is None else self._bisect_left((created, ""))
+            return [self._at(i) for i in range(start, self._len)]
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "size": self._len,
+                "bytes": self._bytes,
+                "maxOrders": self.max_orders,
+                "maxBytes": self.max_bytes,
+                "evictions": self._evictions,
+                "evictedBytes": self._evicted_bytes,
+            }
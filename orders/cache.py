@@ -0,0 +1,98 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+ORDERS_CACHE_MAX_ENTRIES = int(os.getenv("ORDERS_CACHE_MAX_ENTRIES", "256"))
+# writes from other processes do not bump this process's store version, so
+# Postgres-backed entries also expire after this long (0 disables the cache)
+ORDERS_CACHE_SECONDS = float(os.getenv("ORDERS_CACHE_SECONDS", "1"))
+# with an orders_changed listener every write invalidates; this is a backstop
+ORDERS_CACHE_LISTEN_SECONDS = float(os.getenv("ORDERS_CACHE_LISTEN_SECONDS", "60"))
+
+
+def etag_for(body: bytes) -> str:
+    return f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        # If-None-Match uses the weak comparison
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+class CachedResponse:
+    __slots__ = ("version", "expires", "body", "etag")
+
+    def __init__(self, version: int, expires: float, body: bytes) -> None:
+        self.version = version
+        self.expires = expires
+        self.body = body
+        self.etag = etag_for(body)
+
+
+class ResponseCache:
+    """Serialized responses keyed by request, valid for one store version.
+
+    An entry is served only while the store's ``version`` equals the one it
+    was built at and, when ``ttl`` is set, for at most ``ttl`` seconds. The
+    whole cache is dropped the first time a newer version is seen.
+    """
+
+    def __init__(self, max_entries: int = ORDERS_CACHE_MAX_ENTRIES, ttl: Optional[float] = None) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Hashable, CachedResponse] = OrderedDict()
+        self._version = 0
+        self._counters = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and (self.ttl is None or self.ttl > 0)
+
+    def _observe(self, version: int) -> None:
+        if version > self._version:
+            if self._entries:
+                self._counters["invalidations"] += 1
+            self._entries.clear()
+            self._version = version
+
+    def get(self, key: Hashable, version: int) -> Optional[CachedResponse]:
+        with self._lock:
+            self._observe(version)
+            entry = self._entries.get(key)
+            if entry is None or entry.version != version or entry.expires < time.monotonic():
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return entry
+
+    def put(self, key: Hashable, version: int, body: bytes) -> CachedResponse:
+        """Cache ``body``, built from data read at ``version`` (read it before querying)."""
+        expires = time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+        entry = CachedResponse(version, expires, body)
+        if not self.enabled:
+            return entry
+        with self._lock:
+            self._observe(version)
+            # a write landed while this body was being built
+            if version < self._version:
+                return entry
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {**self._counters, "entries": len(self._entries), "version": self._version}
@@ -0,0 +1,285 @@
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Optional
+
+from orders import tracing
+from orders.ingest import order_from_record
+from orders.metrics import (
+    CONSUMER_BATCH_SIZE,
+    CONSUMER_LAG_SECONDS,
+    SQS_REQUEST_ERRORS,
+    observe_sqs,
+)
+from orders.publisher import PERSISTED_ATTRIBUTE
+from orders.serialization import loads
+
+logger = logging.getLogger("flexis-orders.consumer")
+
+SQS_POLL_SECONDS = int(os.getenv("SQS_POLL_SECONDS", "10"))
+SQS_VISIBILITY_TIMEOUT = int(os.getenv("SQS_VISIBILITY_TIMEOUT", "30"))
+SQS_RETRY_VISIBILITY_SECONDS = int(os.getenv("SQS_RETRY_VISIBILITY_SECONDS", "5"))
+SQS_HANDLER_THREADS = int(os.getenv("SQS_HANDLER_THREADS", "4"))
+# share of received message bodies logged at INFO; bodies carry customer data
+SQS_LOG_BODY_SAMPLE_RATE = float(os.getenv("SQS_LOG_BODY_SAMPLE_RATE", "0.01"))
+
+Message = dict[str, Any]
+# returns the messages that failed; raising fails the whole batch
+BatchHandler = Callable[[list[Message]], list[Message]]
+
+
+def observe_lag(created_at: Any) -> None:
+    try:
+        created = datetime.fromisoformat(created_at)
+    except (TypeError, ValueError):
+        return
+    if created.tzinfo is not None:
+        CONSUMER_LAG_SECONDS.observe((datetime.now(timezone.utc) - created).total_seconds())
+
+
+def log_order_message(message: Message) -> None:
+    if SQS_LOG_BODY_SAMPLE_RATE > 0 and random.random() < SQS_LOG_BODY_SAMPLE_RATE:
+        logger.info(
+            "received order message: %s",
+            message.get("Body"),
+            extra={"messageId": message.get("MessageId"), "sampleRate": SQS_LOG_BODY_SAMPLE_RATE},
+        )
+    else:
+        logger.debug("received order message %s", message.get("MessageId"))
+    try:
+        order = loads(message.get("Body", ""))
+    except ValueError:
+        return
+    if isinstance(order, dict):
+        observe_lag(order.get("createdAt"))
+
+
+def persist_orders(store: Any) -> BatchHandler:
+    """Batch handler that writes every valid order in a receive batch in one insert.
+
+    Messages marked ``ordersPersisted`` were committed by this service
+    before it sent them, so they are only acknowledged; the insert is for
+    orders from other producers. Malformed messages are returned as failed,
+    so only they are redelivered and eventually dead-lettered.
+    """
+
+    def handle(messages: list[Message]) -> list[Message]:
+        orders, failed = [], []
+        persisted = 0
+        for message in messages:
+            try:
+                record = loads(message["Body"])
+                if not isinstance(record, dict) or not {"id", "customer", "createdAt"} <= record.keys():
+                    raise ValueError("missing order fields")
+                # the same checks as the batch API, so one bad message cannot fail the insert
+                order = order_from_record(record)
+            except (KeyError, ValueError) as exc:
+                logger.warning("skipping malformed order message %s: %s", message.get("MessageId"), exc)
+                failed.append(message)
+                continue
+            observe_lag(order["createdAt"])
+            if PERSISTED_ATTRIBUTE in (message.get("MessageAttributes") or {}):
+                persisted += 1
+            else:
+                orders.append(order)
+
+        if orders:
+            # commit before returning so the caller only deletes persisted messages
+            inserted = store.add_many(orders)
+            logger.info("persisted %d of %d orders", len(inserted), len(orders))
+        if persisted:
+            logger.debug("acknowledged %d orders already persisted by the producer", persisted)
+        return failed
+
+    return handle
+
+
+class SqsConsumer:
+    """Long-polls SQS and fans each received batch out to handler threads.
+
+    Successful messages are deleted with ``delete_message_batch``; failed
+    ones have their visibility reset in bulk to ``retry_visibility`` seconds
+    so they are redelivered soon instead of after the full timeout.
+
+    Each message's processing span runs until its ack or nack, under the
+    trace context the producer put in its message attributes.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        queue_url: str,
+        handler: Callable[[Message], None] = log_order_message,
+        *,
+        batch_handler: Optional[BatchHandler] = None,
+        concurrency: int = SQS_HANDLER_THREADS,
+        wait_seconds: int = SQS_POLL_SECONDS,
+        visibility_timeout: int = SQS_VISIBILITY_TIMEOUT,
+        retry_visibility: int = SQS_RETRY_VISIBILITY_SECONDS,
+    ) -> None:
+        self.client = client
+        self.queue_url = queue_url
+        self.handler = handler
+        self.batch_handler = batch_handler
+        self.concurrency = max(1, concurrency)
+        self.wait_seconds = wait_seconds
+        self.visibility_timeout = visibility_timeout
+        self.retry_visibility = retry_visibility
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.concurrency,
+            thread_name_prefix="sqs-handler",
+        )
+        # one in-flight receive batch per handler thread keeps the poller from
+        # pulling messages whose visibility would expire while queued locally
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self._stop = threading.Event()
+
+    def _handle(self, message: Message, span: Optional[tracing.Span] = None) -> bool:
+        token = tracing.activate(span) if span is not None else None
+        try:
+            self.handler(message)
+            return True
+        except Exception:
+            logger.exception("failed to handle message %s", message.get("MessageId"))
+            return False
+        finally:
+            if token is not None:
+                tracing.deactivate(token)
+
+    def _ack(self, messages: list[Message]) -> None:
+        if not messages:
+            return
+        started = time.perf_counter()
+        try:
+            response = self.client.delete_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[
+                    {"Id": str(i), "ReceiptHandle": m["ReceiptHandle"]}
+                    for i, m in enumerate(messages)
+                ],
+            )
+        except Exception:
+            SQS_REQUEST_ERRORS.labels("delete_message_batch").inc()
+            raise
+        observe_sqs("delete_message_batch", started, len(response.get("Failed", [])))
+        for failure in response.get("Failed", []):
+            logger.warning("failed to delete message: %s %s", failure.get("Code"), failure.get("Message"))
+
+    def _nack(self, messages: list[Message], visibility: Optional[int] = None) -> None:
+        if not messages:
+            return
+        if visibility is None:
+            visibility = self.retry_visibility
+        started = time.perf_counter()
+        try:
+            response = self.client.change_message_visibility_batch(
+                QueueUrl=self.queue_url,
+                Entries=[
+                    {
+                        "Id": str(i),
+                        "ReceiptHandle": m["ReceiptHandle"],
+                        "VisibilityTimeout": visibility,
+                    }
+                    for i, m in enumerate(messages)
+                ],
+            )
+        except Exception:
+            SQS_REQUEST_ERRORS.labels("change_message_visibility_batch").inc()
+            raise
+        observe_sqs("change_message_visibility_batch", started, len(response.get("Failed", [])))
+        for failure in response.get("Failed", []):
+            logger.warning("failed to reset visibility: %s %s", failure.get("Code"), failure.get("Message"))
+
+    def process_batch(self, messages: list[Message], received_ns: Optional[int] = None) -> None:
+        spans = [tracing.consume_span(m, received_ns or time.time_ns()) for m in messages]
+        try:
+            results = self._process(messages, spans)
+            self._ack([m for m, ok in results if ok])
+            self._nack([m for m, ok in results if not ok])
+        except BaseException as exc:
+            for span in spans:
+                span.set_error(repr(exc))
+            raise
+        finally:
+            for span in spans:
+                span.end()
+
+    def _process(self, messages: list[Message], spans: list[tracing.Span]) -> list[tuple[Message, bool]]:
+        if self.batch_handler is not None:
+            try:
+                failed = self.batch_handler(messages)
+            except Exception:
+                logger.exception("failed to handle batch of %d messages", len(messages))
+                failed = messages
+            failed_ids = {m["MessageId"] for m in failed}
+            results = [(m, m["MessageId"] not in failed_ids) for m in messages]
+        else:
+            results = list(zip(messages, map(self._handle, messages, spans)))
+        for span, (_, ok) in zip(spans, results):
+            if not ok:
+                span.set_error("handler failed")
+        return results
+
+    def _process_and_release(self, messages: list[Message], received_ns: int) -> None:
+        try:
+            self.process_batch(messages, received_ns)
+        except Exception:
+            logger.exception("failed to acknowledge SQS batch")
+        finally:
+            self._slots.release()
+
+    def poll_once(self) -> int:
+        self._slots.acquire()
+        started = time.perf_counter()
+        try:
+            response = self.client.receive_message(
+                QueueUrl=self.queue_url,
+                MaxNumberOfMessages=10,
+                WaitTimeSeconds=self.wait_seconds,
+                VisibilityTimeout=self.visibility_timeout,
+                MessageAttributeNames=[*tracing.MESSAGE_ATTRIBUTE_NAMES, PERSISTED_ATTRIBUTE],
+            )
+        except BaseException:
+            SQS_REQUEST_ERRORS.labels("receive_message").inc()
+            self._slots.release()
+            raise
+
+        messages = response.get("Messages", [])
+        # an empty receive is mostly the long-poll wait
+        if not messages:
+            self._slots.release()
+            return 0
+        observe_sqs("receive_message", started)
+        CONSUMER_BATCH_SIZE.observe(len(messages))
+        if self._stop.is_set():
+            # received during shutdown; hand straight back to the queue
+            try:
+                self._nack(messages, visibility=0)
+            finally:
+                self._slots.release()
+            return 0
+        self._executor.submit(self._process_and_release, messages, time.time_ns())
+        return len(messages)
+
+    def run(self) -> None:
+        logger.info("starting SQS consumer with %d handler threads", self.concurrency)
+        while not self._stop.is_set():
+            try:
+                self.poll_once()
+            except Exception:
+                logger.exception("error while polling SQS")
+                self._stop.wait(5)
+
+    def stop(self, timeout: float = 30) -> None:
+        self._stop.set()
+        deadline = time.monotonic() + timeout
+        # wait for in-flight batches so their acks are not lost
+        for _ in range(self.concurrency):
+            if not self._slots.acquire(timeout=max(deadline - time.monotonic(), 0)):
+                logger.warning("stopping SQS consumer with batches still in flight")
+                break
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,244 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+import psycopg2
+import psycopg2.extensions
+
+from orders.metrics import DB_POOL_IN_USE, DB_POOL_SIZE, DB_POOL_WAIT_SECONDS
+
+logger = logging.getLogger("flexis-orders.db")
+
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "5"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))
+DB_READER_POOL_MIN = int(os.getenv("DB_READER_POOL_MIN", str(DB_POOL_MIN)))
+DB_READER_POOL_MAX = int(os.getenv("DB_READER_POOL_MAX", str(DB_POOL_MAX)))
+DB_EXPORT_POOL_MAX = int(os.getenv("DB_EXPORT_POOL_MAX", "2"))
+
+# RDS Proxy pins a client connection to one backend when it sees session
+# state (SET, LISTEN, advisory locks, temp tables, ...) or a statement over
+# 16 KB. Pooled work therefore stays transaction-scoped and bulk statements
+# are split; session-level work uses direct_config() instead.
+DB_PROXY = os.getenv("DB_PROXY", "false").lower() in ("1", "true", "yes")
+PROXY_MAX_ROWS_PER_STATEMENT = int(os.getenv("PROXY_MAX_ROWS_PER_STATEMENT", "50"))
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+def db_config() -> Optional[dict[str, Any]]:
+    host = os.getenv("DB_HOST")
+    if not host:
+        return None
+
+    return {
+        "host": host,
+        "port": int(os.getenv("DB_PORT", "5432")),
+        "dbname": os.getenv("DB_NAME", "orders"),
+        "user": os.getenv("DB_USER", "postgres"),
+        "password": os.getenv("DB_PASSWORD"),
+        "connect_timeout": 5,
+    }
+
+
+def direct_config() -> Optional[dict[str, Any]]:
+    cfg = db_config()
+    host = os.getenv("DB_DIRECT_HOST")
+    if not cfg or not host:
+        return cfg
+    return {**cfg, "host": host}
+
+
+def max_rows_per_statement(rows: int) -> int:
+    return min(rows, PROXY_MAX_ROWS_PER_STATEMENT) if DB_PROXY else rows
+
+
+def reader_config() -> Optional[dict[str, Any]]:
+    cfg = db_config()
+    host = os.getenv("DB_READER_HOST")
+    if not cfg or not host:
+        return None
+    return {**cfg, "host": host}
+
+
+def export_config() -> Optional[dict[str, Any]]:
+    """Where exports without a reader endpoint go: the cluster, behind RDS Proxy.
+
+    The export's named cursor (DECLARE) would pin a proxy connection for
+    the whole stream. None when exports can share the writer pool.
+    """
+    if not DB_PROXY or not os.getenv("DB_DIRECT_HOST"):
+        return None
+    return direct_config()
+
+
+class ConnectionPool:
+    """Bounded, thread-safe psycopg2 pool.
+
+    Callers block for up to ``timeout`` seconds when ``maxsize`` connections
+    are checked out. Connections older than ``max_lifetime`` are closed and
+    replaced on their next checkout so Aurora failovers and credential
+    rotations are picked up without restarting the task.
+    """
+
+    def __init__(
+        self,
+        cfg: dict[str, Any],
+        *,
+        minsize: int = DB_POOL_MIN,
+        maxsize: int = DB_POOL_MAX,
+        timeout: float = DB_POOL_TIMEOUT,
+        max_lifetime: float = DB_POOL_MAX_LIFETIME,
+        name: str = "writer",
+    ) -> None:
+        if maxsize < 1 or minsize < 0 or minsize > maxsize:
+            raise ValueError(f"invalid pool size: min={minsize} max={maxsize}")
+
+        self.cfg = dict(cfg)
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.name = name
+
+        self._cond = threading.Condition()
+        self._idle: deque[psycopg2.extensions.connection] = deque()
+        self._born: dict[int, float] = {}
+        self._size = 0
+        self._closed = False
+        self._wait = DB_POOL_WAIT_SECONDS.labels(name)
+        DB_POOL_IN_USE.labels(name).set_function(lambda: self.stats()["inUse"])
+        DB_POOL_SIZE.labels(name).set_function(lambda: self.stats()["size"])
+
+    def _connect(self) -> psycopg2.extensions.connection:
+        conn = psycopg2.connect(**self.cfg)
+        self._born[id(conn)] = time.monotonic()
+        return conn
+
+    def _expired(self, conn: psycopg2.extensions.connection) -> bool:
+        if conn.closed:
+            return True
+        born = self._born.get(id(conn), 0.0)
+        return self.max_lifetime > 0 and time.monotonic() - born > self.max_lifetime
+
+    def _discard(self, conn: psycopg2.extensions.connection) -> None:
+        self._born.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            logger.debug("error closing pooled connection", exc_info=True)
+
+    def warm(self) -> None:
+        with self._cond:
+            missing = self.minsize - self._size
+            self._size += max(missing, 0)
+        opened = []
+        try:
+            for _ in range(max(missing, 0)):
+                opened.append(self._connect())
+        finally:
+            with self._cond:
+                self._size -= max(missing, 0) - len(opened)
+                for conn in opened:
+                    self._idle.append(conn)
+                self._cond.notify_all()
+
+    def getconn(self, timeout: Optional[float] = None) -> psycopg2.extensions.connection:
+        started = time.perf_counter()
+        try:
+            return self._getconn(timeout)
+        finally:
+            self._wait.observe(time.perf_counter() - started)
+
+    def _getconn(self, timeout: Optional[float]) -> psycopg2.extensions.connection:
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("connection pool is closed")
+                while self._idle:
+                    conn = self._idle.pop()
+                    if not self._expired(conn):
+                        return conn
+                    self._size -= 1
+                    self._discard(conn)
+                if self._size < self.maxsize:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(
+                        f"timed out waiting for a connection ({self.maxsize} in use)"
+                    )
+                self._cond.wait(remaining)
+
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def putconn(self, conn: psycopg2.extensions.connection, discard: bool = False) -> None:
+        # roll back rather than conn.reset(): its RESET ALL would pin the
+        # connection when running behind RDS Proxy
+        if not discard and not conn.closed:
+            status = conn.info.transaction_status
+            if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except Exception:
+                    discard = True
+
+        with self._cond:
+            if discard or self._closed or self._expired(conn):
+                self._size -= 1
+                self._discard(conn)
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None) -> Iterator[psycopg2.extensions.connection]:
+        conn = self.getconn(timeout)
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            broken = bool(conn.closed)
+            if not broken:
+                try:
+                    conn.rollback()
+                except Exception:
+                    broken = True
+            raise
+        finally:
+            self.putconn(conn, discard=broken)
+
+    def stats(self) -> dict[str, int]:
+        with self._cond:
+            idle = len(self._idle)
+            return {
+                "size": self._size,
+                "idle": idle,
+                "inUse": self._size - idle,
+                "max": self.maxsize,
+            }
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn = self._idle.pop()
+                self._size -= 1
+                self._discard(conn)
+            self._cond.notify_all()
@@ -0,0 +1,228 @@
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Optional
+
+from orders import metrics
+
+logger = logging.getLogger("flexis-orders.emf")
+# EMF documents are data, not chatter; LOG_LEVEL must not filter them out
+logger.setLevel(logging.INFO)
+
+EMF_ENABLED = os.getenv("EMF_ENABLED", "false").lower() in ("1", "true", "yes")
+EMF_NAMESPACE = os.getenv("EMF_NAMESPACE", "FlexiOrders")
+EMF_SERVICE = os.getenv("EMF_SERVICE", "orders-api")
+EMF_FLUSH_SECONDS = float(os.getenv("EMF_FLUSH_SECONDS", "60"))
+# CloudWatch accepts at most 100 values per metric in one document
+EMF_MAX_VALUES = min(int(os.getenv("EMF_MAX_VALUES", "100")), 100)
+
+
+class _Series:
+    """Observations of one metric for one set of dimension values.
+
+    Keeps a uniform sample of at most ``max_values`` observations plus the
+    exact count and sum, so a busy route costs the same as a quiet one.
+    """
+
+    __slots__ = ("_lock", "max_values", "values", "count", "total")
+
+    def __init__(self, max_values: int) -> None:
+        self._lock = threading.Lock()
+        self.max_values = max_values
+        self.values: list[float] = []
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.total += value
+            if len(self.values) < self.max_values:
+                self.values.append(value)
+            else:
+                i = random.randrange(self.count)
+                if i < self.max_values:
+                    self.values[i] = value
+
+    def drain(self) -> tuple[list[float], int, float]:
+        with self._lock:
+            drained = self.values, self.count, self.total
+            self.values, self.count, self.total = [], 0, 0.0
+        return drained
+
+
+class _Watch:
+    __slots__ = ("name", "unit", "labels", "dimensions", "scale", "count_name", "summed")
+
+    def __init__(
+        self,
+        metric: metrics.Metric,
+        name: str,
+        unit: str,
+        dimensions: dict[str, str],
+        scale: float,
+        count_name: Optional[str],
+    ) -> None:
+        self.name = name
+        self.unit = unit
+        # positions of the exported labels in the metric's label values
+        self.labels = [metric.labelnames.index(label) for label in dimensions]
+        self.dimensions = list(dimensions.values())
+        self.scale = scale
+        self.count_name = count_name
+        self.summed = metric.kind == "counter"
+
+
+class EmfEmitter:
+    """Logs watched metrics in CloudWatch Embedded Metric Format.
+
+    Observations are aggregated per dimension set and written every
+    ``interval`` seconds as one EMF document each, so CloudWatch derives
+    the metrics from the log stream without any PutMetricData calls.
+    """
+
+    def __init__(
+        self,
+        namespace: str = EMF_NAMESPACE,
+        service: str = EMF_SERVICE,
+        *,
+        interval: float = EMF_FLUSH_SECONDS,
+        max_values: int = EMF_MAX_VALUES,
+    ) -> None:
+        self.namespace = namespace
+        self.service = service
+        self.interval = interval
+        self.max_values = max(1, max_values)
+        self._series: dict[tuple[_Watch, tuple[str, ...]], _Series] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def watch(
+        self,
+        metric: metrics.Metric,
+        name: str,
+        unit: str,
+        dimensions: Optional[dict[str, str]] = None,
+        *,
+        scale: float = 1.0,
+        count_name: Optional[str] = None,
+    ) -> None:
+        """Export ``metric`` as ``name``; ``dimensions`` maps label names to dimension names."""
+        spec = _Watch(metric, name, unit, dimensions or {}, scale, count_name)
+
+        def record(key: metrics.LabelValues, value: float) -> None:
+            series_key = (spec, tuple(key[i] for i in spec.labels))
+            series = self._series.get(series_key)
+            if series is None:
+                with self._lock:
+                    series = self._series.setdefault(series_key, _Series(self.max_values))
+            series.add(value)
+
+        metric.add_sink(record)
+
+    def documents(self) -> list[dict[str, Any]]:
+        with self._lock:
+            series = list(self._series.items())
+        timestamp = int(time.time() * 1000)
+        docs = []
+        for (spec, values), state in series:
+            samples, count, total = state.drain()
+            if not count:
+                continue
+            doc: dict[str, Any] = {
+                "_aws": {
+                    "Timestamp": timestamp,
+                    "CloudWatchMetrics": [
+                        {
+                            "Namespace": self.namespace,
+                            "Dimensions": [["Service", *spec.dimensions]],
+                            "Metrics": [{"Name": spec.name, "Unit": spec.unit}],
+                        }
+                    ],
+                },
+                "Service": self.service,
+                # not a dimension; lets Logs Insights split by process
+                "pid": os.getpid(),
+                **dict(zip(spec.dimensions, values)),
+            }
+            if spec.summed:
+                doc[spec.name] = total * spec.scale
+            else:
+                doc[spec.name] = [round(sample * spec.scale, 3) for sample in samples]
+            if spec.count_name:
+                doc["_aws"]["CloudWatchMetrics"][0]["Metrics"].append({"Name": spec.count_name, "Unit": "Count"})
+                doc[spec.count_name] = count
+            docs.append(doc)
+        return docs
+
+    def flush(self) -> None:
+        for doc in self.documents():
+            logger.info("embedded metrics", extra={"emf": doc})
+
+    def run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("failed to emit embedded metrics")
+
+    def stop(self) -> None:
+        self._stop.set()
+        self.flush()
+
+
+def default_emitter() -> EmfEmitter:
+    emitter = EmfEmitter()
+    ms = 1000.0
+    emitter.watch(
+        metrics.HTTP_REQUEST_SECONDS,
+        "Latency",
+        "Milliseconds",
+        {"route": "Route", "status": "Status"},
+        scale=ms,
+        count_name="Requests",
+    )
+    emitter.watch(
+        metrics.SQS_REQUEST_SECONDS,
+        "SqsLatency",
+        "Milliseconds",
+        {"operation": "Operation"},
+        scale=ms,
+        count_name="SqsRequests",
+    )
+    emitter.watch(metrics.SQS_REQUEST_ERRORS, "SqsErrors", "Count", {"operation": "Operation"})
+    emitter.watch(metrics.SQS_FAILED_ENTRIES, "SqsFailedEntries", "Count", {"operation": "Operation"})
+    emitter.watch(
+        metrics.CONSUMER_LAG_SECONDS,
+        "ConsumerLag",
+        "Milliseconds",
+        scale=ms,
+        count_name="OrdersConsumed",
+    )
+    emitter.watch(metrics.CONSUMER_BATCH_SIZE, "ReceiveBatchSize", "Count", count_name="Receives")
+    emitter.watch(metrics.DB_POOL_WAIT_SECONDS, "PoolWait", "Milliseconds", {"pool": "Pool"}, scale=ms)
+    return emitter
+
+
+_emitter: Optional[EmfEmitter] = None
+_emitter_pid: Optional[int] = None
+
+
+def start() -> Optional[EmfEmitter]:
+    """Start this process's emitter thread when EMF_ENABLED; idempotent."""
+    global _emitter, _emitter_pid
+    if not EMF_ENABLED or _emitter_pid == os.getpid():
+        return _emitter
+    if _emitter is None:
+        # sinks stay attached across fork; only the thread is per process
+        _emitter = default_emitter()
+    _emitter_pid = os.getpid()
+    threading.Thread(target=_emitter.run, name="emf-emitter", daemon=True).start()
+    return _emitter
+
+
+def stop() -> None:
+    if _emitter is not None and _emitter_pid == os.getpid():
+        _emitter.stop()
@@ -0,0 +1,447 @@
+import logging
+import os
+import re
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Iterable, Optional
+
+from orders import tracing
+from orders.publisher import send_batch, split_batches
+from orders.serialization import dumps, loads
+
+logger = logging.getLogger("flexis-orders.ingest")
+
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "500"))
+INGEST_MAX_RECORDS = int(os.getenv("INGEST_MAX_RECORDS", "10000"))
+INGEST_MAX_RECORD_BYTES = int(os.getenv("INGEST_MAX_RECORD_BYTES", str(64 * 1024)))
+INGEST_READ_BYTES = int(os.getenv("INGEST_READ_BYTES", str(64 * 1024)))
+INGEST_SQS_THREADS = int(os.getenv("INGEST_SQS_THREADS", "4"))
+
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl", "application/x-jsonlines")
+
+# outside a string only these bytes change the array framing state
+_ARRAY_TOKEN = re.compile(rb'["{}\[\],]')
+_STRING_TOKEN = re.compile(rb'["\\]')
+_WHITESPACE = b" \t\r\n"
+
+# (position in the request body, order)
+Chunk = list[tuple[int, dict[str, Any]]]
+
+
+class IngestError(ValueError):
+    """The body cannot be read any further; records before it still count."""
+
+    status = 400
+
+
+class TooManyRecords(IngestError):
+    status = 413
+
+
+def body_format(content_type: Optional[str]) -> Optional[str]:
+    mimetype = (content_type or "").split(";")[0].strip().lower()
+    if mimetype in NDJSON_TYPES:
+        return "ndjson"
+    if mimetype == "application/json" or mimetype.endswith("+json"):
+        return "json"
+    return None
+
+
+class RecordSplitter:
+    """Push parser that cuts a JSON array or NDJSON body into raw records.
+
+    Only the bytes of the record being read are kept, so memory is bounded
+    by ``max_record_bytes`` however long the body is. Records are returned
+    undecoded; a malformed record is the caller's per-record error, while
+    a broken array structure or an oversized record stops the parse.
+    """
+
+    def __init__(self, fmt: str, *, max_record_bytes: int = INGEST_MAX_RECORD_BYTES) -> None:
+        if fmt not in ("json", "ndjson"):
+            raise ValueError(f"unknown ingest format: {fmt}")
+        self.fmt = fmt
+        self.max_record_bytes = max_record_bytes
+        self._buf = bytearray()
+        self._pos = 0
+        # json only: start, first, next, sep, value, end
+        self._state = "start"
+        self._start = 0
+        self._depth = 0
+        self._in_string = False
+
+    def feed(self, data: bytes) -> list[bytes]:
+        self._buf += data
+        if self.fmt == "ndjson":
+            return self._split_lines()
+        return self._split_array()
+
+    def close(self) -> list[bytes]:
+        if self.fmt == "ndjson":
+            records = self._split_lines()
+            tail = bytes(self._buf).strip()
+            self._buf.clear()
+            return records + [tail] if tail else records
+        records = self._split_array()
+        if self._state == "start":
+            raise IngestError("expected a JSON array")
+        if self._state != "end":
+            raise IngestError("truncated JSON array")
+        return records
+
+    def _split_lines(self) -> list[bytes]:
+        buf = self._buf
+        records = []
+        start = 0
+        while True:
+            end = buf.find(b"\n", start)
+            if end < 0:
+                break
+            line = bytes(buf[start:end]).strip()
+            if line:
+                records.append(line)
+            start = end + 1
+        del buf[:start]
+        if len(buf) > self.max_record_bytes:
+            raise IngestError(f"record exceeds {self.max_record_bytes} bytes")
+        return records
+
+    def _split_array(self) -> list[bytes]:
+        buf = self._buf
+        records = []
+        while self._pos < len(buf):
+            if self._state == "value":
+                end = self._scan_value()
+                if end is None:
+                    break
+                records.append(bytes(buf[self._start:end]).strip())
+                self._state = "sep"
+                self._pos = end
+                continue
+
+            char = buf[self._pos]
+            if char in _WHITESPACE:
+                self._pos += 1
+            elif self._state == "start":
+                if char != ord("["):
+                    raise IngestError("expected a JSON array")
+                self._state = "first"
+                self._pos += 1
+            elif self._state == "sep":
+                if char == ord(","):
+                    self._state = "next"
+                elif char == ord("]"):
+                    self._state = "end"
+                else:
+                    raise IngestError("expected ',' or ']' between records")
+                self._pos += 1
+            elif self._state == "end":
+                raise IngestError("unexpected data after the JSON array")
+            elif char == ord("]") and self._state == "first":
+                self._state = "end"
+                self._pos += 1
+            else:
+                self._state = "value"
+                self._start = self._pos
+                self._depth = 0
+                self._in_string = False
+
+        # drop everything before the record in progress
+        keep = self._start if self._state == "value" else self._pos
+        del buf[:keep]
+        self._pos -= keep
+        self._start = 0
+        if self._state == "value" and len(buf) > self.max_record_bytes:
+            raise IngestError(f"record exceeds {self.max_record_bytes} bytes")
+        return records
+
+    def _scan_value(self) -> Optional[int]:
+        """End offset of the record at ``_start``, or None until more bytes arrive."""
+        buf = self._buf
+        while True:
+            if self._in_string:
+                match = _STRING_TOKEN.search(buf, self._pos)
+                if match is None:
+                    self._pos = len(buf)
+                    return None
+                if match.group() == b"\\":
+                    if match.end() >= len(buf):
+                        # the escaped byte is in the next chunk
+                        self._pos = match.start()
+                        return None
+                    self._pos = match.end() + 1
+                    continue
+                self._in_string = False
+                self._pos = match.end()
+                if self._depth == 0:
+                    return self._pos
+                continue
+
+            match = _ARRAY_TOKEN.search(buf, self._pos)
+            if match is None:
+                self._pos = len(buf)
+                return None
+            token = match.group()
+            self._pos = match.end()
+            if token == b'"':
+                self._in_string = True
+            elif token in (b"{", b"["):
+                self._depth += 1
+            elif self._depth == 0:
+                # a bare scalar ends at the separator after it
+                return match.start()
+            elif token != b",":
+                self._depth -= 1
+                if self._depth == 0:
+                    return self._pos
+
+
+def order_from_record(record: Any) -> dict[str, Any]:
+    """Validate one ingested record into an order; raises ValueError."""
+    if not isinstance(record, dict):
+        raise ValueError("record must be a JSON object")
+
+    customer = record.get("customer", "anonymous")
+    notes = record.get("notes", "")
+    if not isinstance(customer, str) or not isinstance(notes, str):
+        raise ValueError("customer and notes must be strings")
+
+    # backfills may carry their own id, making a retried batch a no-op
+    order_id = record.get("id")
+    if order_id is None:
+        order_id = str(uuid.uuid4())
+    else:
+        try:
+            order_id = str(uuid.UUID(order_id))
+        except (AttributeError, TypeError, ValueError):
+            raise ValueError("id must be a UUID") from None
+
+    created_at = record.get("createdAt")
+    if created_at is None:
+        created = datetime.now(timezone.utc)
+    else:
+        try:
+            created = datetime.fromisoformat(created_at)
+        except (TypeError, ValueError):
+            raise ValueError("createdAt must be an ISO 8601 timestamp") from None
+        if created.tzinfo is None:
+            raise ValueError("createdAt must include a UTC offset")
+
+    return {
+        "id": order_id,
+        "customer": customer,
+        "notes": notes,
+        "createdAt": created.astimezone(timezone.utc).isoformat(),
+    }
+
+
+class IngestReport:
+    """Per-record results of one batch request, in body order."""
+
+    def __init__(self) -> None:
+        self.results: list[dict[str, Any]] = []
+        self.counts = {"created": 0, "duplicate": 0, "invalid": 0, "failed": 0, "unpublished": 0}
+        self.error: Optional[IngestError] = None
+
+    def _add(self, index: int, status: str, **fields: Any) -> dict[str, Any]:
+        result = {"index": index, "status": status, **fields}
+        self.results.append(result)
+        self.counts[status] += 1
+        return result
+
+    def invalid(self, index: int, error: str) -> None:
+        self._add(index, "invalid", error=error)
+
+    def stored(self, chunk: Chunk, inserted: list[str], unsent: Iterable[str] = ()) -> None:
+        new = set(inserted)
+        unsent = set(unsent)
+        for index, order in chunk:
+            if order["id"] not in new:
+                self._add(index, "duplicate", id=order["id"])
+                continue
+            new.discard(order["id"])
+            result = self._add(index, "created", id=order["id"])
+            if order["id"] in unsent:
+                result["published"] = False
+                self.counts["unpublished"] += 1
+
+    def failed(self, chunk: Chunk, error: str) -> None:
+        for index, order in chunk:
+            self._add(index, "failed", id=order["id"], error=error)
+
+    @property
+    def status(self) -> int:
+        if self.error is not None:
+            return self.error.status
+        if self.counts["failed"] and not (self.counts["created"] or self.counts["duplicate"]):
+            return 503
+        return 200
+
+    def to_dict(self) -> dict[str, Any]:
+        self.results.sort(key=lambda result: result["index"])
+        body: dict[str, Any] = {**self.counts, "results": self.results}
+        if self.error is not None:
+            body["error"] = str(self.error)
+        return body
+
+
+class BatchIngest:
+    """Turns body chunks into validated order chunks ready to write.
+
+    ``feed`` and ``close`` never raise for bad input: a fatal body error is
+    recorded on the report, ``done`` is set and whatever was already
+    validated is returned for writing.
+    """
+
+    def __init__(
+        self,
+        fmt: str,
+        *,
+        chunk_size: int = INGEST_CHUNK_SIZE,
+        max_records: int = INGEST_MAX_RECORDS,
+    ) -> None:
+        self.splitter = RecordSplitter(fmt)
+        self.chunk_size = max(1, chunk_size)
+        self.max_records = max_records
+        self.report = IngestReport()
+        self.records = 0
+        self.done = False
+        self._pending: Chunk = []
+        self._ready: list[Chunk] = []
+
+    def _take(self, raw_records: list[bytes]) -> None:
+        for raw in raw_records:
+            if self.records >= self.max_records:
+                raise TooManyRecords(f"batch exceeds {self.max_records} records; the rest was not read")
+            index = self.records
+            self.records += 1
+            try:
+                record = loads(raw)
+            except ValueError:
+                self.report.invalid(index, "invalid JSON")
+                continue
+            try:
+                order = order_from_record(record)
+            except ValueError as exc:
+                self.report.invalid(index, str(exc))
+                continue
+            self._pending.append((index, order))
+            if len(self._pending) >= self.chunk_size:
+                self._flush()
+
+    def _flush(self) -> None:
+        if self._pending:
+            self._ready.append(self._pending)
+            self._pending = []
+
+    def _drain(self) -> list[Chunk]:
+        ready, self._ready = self._ready, []
+        return ready
+
+    def feed(self, data: bytes) -> list[Chunk]:
+        try:
+            self._take(self.splitter.feed(data))
+        except IngestError as exc:
+            self.report.error = exc
+            self.done = True
+            self._flush()
+        return self._drain()
+
+    def close(self) -> list[Chunk]:
+        self.done = True
+        try:
+            self._take(self.splitter.close())
+        except IngestError as exc:
+            self.report.error = exc
+        self._flush()
+        return self._drain()
+
+
+# (order ids, message bodies, traceparent) for one send_message_batch call
+SendJob = tuple[list[str], list[bytes], Optional[str]]
+
+
+def send_jobs(orders: list[dict[str, Any]], traceparent: Optional[str]) -> list[SendJob]:
+    """Orders deduplicated by id and cut into ``send_message_batch``-sized jobs."""
+    unique: dict[str, dict[str, Any]] = {}
+    for order in orders:
+        unique.setdefault(order["id"], order)
+    ids = list(unique)
+    jobs = []
+    start = 0
+    for batch in split_batches([dumps(order) for order in unique.values()]):
+        jobs.append((ids[start:start + len(batch)], batch, traceparent))
+        start += len(batch)
+    return jobs
+
+
+def record_unsent(span: tracing.Span, jobs: list[SendJob], results: Iterable[list[str]]) -> set[str]:
+    """Ids of the orders that were not sent, given each job's unsent ids; noted on ``span``."""
+    unsent = {order_id for failed in results for order_id in failed}
+    span.set_attribute("messaging.batch.message_count", sum(len(job[0]) for job in jobs))
+    if unsent:
+        span.set_error(f"{len(unsent)} orders not sent")
+    return unsent
+
+
+class OrderBatchSender:
+    """Publishes a chunk of orders and waits for the outcome.
+
+    A chunk is cut into ``send_message_batch`` calls that run on a small
+    thread pool, so the caller learns which orders did not make it to SQS.
+    """
+
+    def __init__(self, client: Any, queue_url: str, *, threads: int = INGEST_SQS_THREADS) -> None:
+        self.client = client
+        self.queue_url = queue_url
+        self._executor = ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix="ingest-sqs")
+
+    def _send(self, job: SendJob) -> list[str]:
+        ids, bodies, traceparent = job
+        failed = send_batch(self.client, self.queue_url, bodies, traceparents=[traceparent] * len(bodies))
+        return [ids[i] for i in failed]
+
+    def send(self, orders: list[dict[str, Any]]) -> set[str]:
+        """Ids of the orders that were not sent."""
+        with tracing.span("orders publish batch", kind=tracing.PRODUCER) as span:
+            # the pool threads do not see the request's span, so it travels with each job
+            jobs = send_jobs(orders, span.traceparent())
+            return record_unsent(span, jobs, self._executor.map(self._send, jobs))
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+def write_chunk(report: IngestReport, store: Any, chunk: Chunk, sender: Optional[OrderBatchSender]) -> None:
+    orders = [order for _, order in chunk]
+    try:
+        inserted = store.add_many(orders, publish=True)
+    except Exception as exc:
+        logger.exception("failed to store %d ingested orders", len(orders))
+        report.failed(chunk, str(exc) or type(exc).__name__)
+        return
+    new = set(inserted)
+    unsent = sender.send([order for order in orders if order["id"] in new]) if sender and new else set()
+    report.stored(chunk, inserted, unsent)
+
+
+def ingest_orders(
+    chunks: Iterable[bytes],
+    fmt: str,
+    store: Any,
+    sender: Optional[OrderBatchSender] = None,
+) -> IngestReport:
+    """Stream ``chunks`` into ``store`` in multi-row inserts and publish what was new.
+
+    Stops reading at the first fatal body error; everything validated
+    before it is still written.
+    """
+    ingest = BatchIngest(fmt)
+    for data in chunks:
+        for chunk in ingest.feed(data):
+            write_chunk(ingest.report, store, chunk, sender)
+        if ingest.done:
+            return ingest.report
+    for chunk in ingest.close():
+        write_chunk(ingest.report, store, chunk, sender)
+    return ingest.report
@@ -0,0 +1,140 @@
+import atexit
+import copy
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+from orders.metrics import LOG_RECORDS_DROPPED
+from orders.serialization import dumps
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# json: one object per line for CloudWatch Logs Insights; text: for local runs
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+# records waiting for the writer thread; beyond this they are dropped, not waited for
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s %(message)s"
+
+# LogRecord attributes that are not user-supplied ``extra`` fields
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One compact JSON object per record, with ``extra`` fields inlined.
+
+    A record carrying an ``emf`` dict is written as that document alone,
+    since CloudWatch only extracts Embedded Metric Format from a log
+    event that is the EMF object itself.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        emf = getattr(record, "emf", None)
+        if emf is not None:
+            return dumps(emf).decode()
+
+        entry: dict[str, Any] = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and key not in entry:
+                entry[key] = value if isinstance(value, (str, int, float, bool, type(None))) else str(value)
+        return dumps(entry).decode()
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the writer thread; drops them when its queue is full."""
+
+    def __init__(self, maxsize: int = LOG_QUEUE_SIZE) -> None:
+        super().__init__(queue.Queue(maxsize))
+        self.maxsize = maxsize
+        self._dropped = LOG_RECORDS_DROPPED.labels()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # resolve args and tracebacks now: both may change or be freed by
+        # the time the writer thread formats the record
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # no EMF sink on this counter: its documents would be log records too
+            self._dropped.inc()
+
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # the base class uses put_nowait, which raises when the queue is full
+        # at exit; wait for the writer to make room instead
+        self.queue.put(self._sentinel)
+
+
+_lock = threading.Lock()
+_handler: Optional[NonBlockingQueueHandler] = None
+_output: Optional[logging.Handler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _start_listener() -> None:
+    global _listener
+    _listener = _Listener(_handler.queue, _output, respect_handler_level=True)
+    _listener.start()
+
+
+def _after_fork() -> None:
+    # the writer thread does not survive fork; give the child its own queue
+    # so it never inherits records the parent had not written yet
+    if _handler is not None:
+        _handler.queue = queue.Queue(_handler.maxsize)
+        _start_listener()
+
+
+def stop_logging() -> None:
+    """Write out queued records; runs at exit."""
+    global _listener
+    if _listener is not None:
+        listener, _listener = _listener, None
+        listener.stop()
+
+
+def configure_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT) -> None:
+    """Route the root logger through a queue to a stdout writer thread, once per process tree."""
+    global _handler, _output
+    with _lock:
+        if _handler is not None:
+            return
+        _output = logging.StreamHandler(sys.stdout)
+        _output.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+        _handler = NonBlockingQueueHandler()
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_handler)
+        root.setLevel(level)
+
+        _start_listener()
+        atexit.register(stop_logging)
+        os.register_at_fork(after_in_child=_after_fork)
+
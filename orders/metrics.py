@@ -0,0 +1,469 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Iterable, Optional
+
+logger = logging.getLogger("flexis-orders.metrics")
+
+# gunicorn.conf.py points this at a per-master directory; each process
+# writes its snapshot there and /metrics merges them all
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+BATCH_BUCKETS = (1, 2, 3, 4, 5, 6, 7, 8, 9, 10)
+
+_ARCHIVE = "archive.json"
+
+LabelValues = tuple[str, ...]
+# called with (label values, amount or observation) on every update
+Sink = Callable[[LabelValues, float], None]
+
+
+class _Value:
+    """One labelled series; updates take only this series' lock."""
+
+    __slots__ = ("_lock", "value", "function", "key", "sinks")
+
+    def __init__(self, key: LabelValues = (), sinks: Optional[list[Sink]] = None) -> None:
+        self._lock = threading.Lock()
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+        self.key = key
+        self.sinks = sinks if sinks is not None else []
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+        for sink in self.sinks:
+            sink(self.key, amount)
+
+    def dec(self, amount: float = 1) -> None:
+        self.inc(-amount)
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Read the gauge from ``function`` whenever metrics are collected."""
+        self.function = function
+
+    def read(self) -> float:
+        if self.function is None:
+            return self.value
+        try:
+            return float(self.function())
+        except Exception:
+            logger.debug("gauge callback failed", exc_info=True)
+            return 0.0
+
+
+class _Histogram:
+    __slots__ = ("_lock", "upper_bounds", "counts", "sum", "key", "sinks")
+
+    def __init__(
+        self,
+        upper_bounds: tuple[float, ...],
+        key: LabelValues = (),
+        sinks: Optional[list[Sink]] = None,
+    ) -> None:
+        self._lock = threading.Lock()
+        self.upper_bounds = upper_bounds
+        # the last slot is +Inf
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+        self.key = key
+        self.sinks = sinks if sinks is not None else []
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self.upper_bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+        for sink in self.sinks:
+            sink(self.key, value)
+
+    def time(self) -> "_Timer":
+        return _Timer(self)
+
+    def read(self) -> dict[str, Any]:
+        with self._lock:
+            return {"counts": list(self.counts), "sum": self.sum}
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: _Histogram) -> None:
+        self.histogram = histogram
+
+    def __enter__(self) -> "_Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Metric:
+    def __init__(
+        self,
+        kind: str,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> None:
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._children: dict[LabelValues, Any] = {}
+        self._lock = threading.Lock()
+        # shared with every child, so sinks added later still see updates
+        self.sinks: list[Sink] = []
+
+    def labels(self, *values: Any) -> Any:
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is not None:
+            return child
+        if len(key) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {key}")
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                if self.kind == "histogram":
+                    child = _Histogram(self.buckets, key, self.sinks)
+                else:
+                    child = _Value(key, self.sinks)
+                self._children[key] = child
+            return child
+
+    def add_sink(self, sink: Sink) -> None:
+        """Also pass every counter increment or histogram observation to ``sink``."""
+        self.sinks.append(sink)
+
+    # unlabelled shortcuts
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def time(self) -> _Timer:
+        return self.labels().time()
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            children = list(self._children.items())
+        return {
+            "type": self.kind,
+            "help": self.documentation,
+            "labels": list(self.labelnames),
+            "buckets": list(self.buckets) if self.kind == "histogram" else None,
+            "samples": [[list(key), child.read()] for key, child in children],
+        }
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: Metric) -> Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Metric:
+        return self._register(Metric("counter", name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Metric:
+        return self._register(Metric("gauge", name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> Metric:
+        return self._register(Metric("histogram", name, documentation, labelnames, buckets))
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds",
+    "Time to produce a response, by route template.",
+    ("method", "route", "status"),
+)
+SQS_REQUEST_SECONDS = REGISTRY.histogram(
+    "sqs_request_duration_seconds",
+    "Latency of SQS API calls.",
+    ("operation",),
+)
+SQS_REQUEST_ERRORS = REGISTRY.counter(
+    "sqs_request_errors_total",
+    "SQS API calls that raised.",
+    ("operation",),
+)
+SQS_FAILED_ENTRIES = REGISTRY.counter(
+    "sqs_failed_entries_total",
+    "Entries SQS reported as failed inside a successful batch call.",
+    ("operation",),
+)
+CONSUMER_BATCH_SIZE = REGISTRY.histogram(
+    "consumer_batch_size",
+    "Messages per non-empty receive.",
+    buckets=BATCH_BUCKETS,
+)
+CONSUMER_LAG_SECONDS = REGISTRY.histogram(
+    "consumer_lag_seconds",
+    "Time from an order's createdAt to the consumer finishing with it.",
+    buckets=LAG_BUCKETS,
+)
+DB_POOL_WAIT_SECONDS = REGISTRY.histogram(
+    "db_pool_wait_seconds",
+    "Time spent waiting for a pooled connection, including connecting.",
+    ("pool",),
+)
+DB_POOL_IN_USE = REGISTRY.gauge(
+    "db_pool_in_use_connections",
+    "Connections checked out of the pool.",
+    ("pool",),
+)
+DB_POOL_SIZE = REGISTRY.gauge(
+    "db_pool_size_connections",
+    "Open connections, idle or in use.",
+    ("pool",),
+)
+ORDER_BUFFER_ORDERS = REGISTRY.gauge(
+    "order_buffer_orders",
+    "Orders held by the in-memory order store.",
+)
+ORDER_BUFFER_BYTES = REGISTRY.gauge(
+    "order_buffer_bytes",
+    "Approximate bytes held by the in-memory order store.",
+)
+LOG_RECORDS_DROPPED = REGISTRY.counter(
+    "log_records_dropped_total",
+    "Log records dropped because the log queue was full.",
+)
+
+
+def observe_sqs(operation: str, started: float, failed_entries: int = 0) -> None:
+    SQS_REQUEST_SECONDS.labels(operation).observe(time.perf_counter() - started)
+    if failed_entries:
+        SQS_FAILED_ENTRIES.labels(operation).inc(failed_entries)
+
+
+def _merge(into: dict[str, Any], snapshot: dict[str, Any], *, gauges: bool = True) -> None:
+    for name, metric in snapshot.items():
+        if metric["type"] == "gauge" and not gauges:
+            continue
+        target = into.setdefault(name, {**metric, "samples": {}})
+        samples = target["samples"]
+        for labels, value in metric["samples"]:
+            key = tuple(labels)
+            if metric["type"] != "histogram":
+                samples[key] = samples.get(key, 0.0) + value
+                continue
+            current = samples.get(key)
+            if current is None or len(current["counts"]) != len(value["counts"]):
+                samples[key] = {"counts": list(value["counts"]), "sum": value["sum"]}
+            else:
+                current["counts"] = [a + b for a, b in zip(current["counts"], value["counts"])]
+                current["sum"] += value["sum"]
+
+
+def _unmerge(merged: dict[str, Any]) -> dict[str, Any]:
+    """Back to snapshot form, for the archive file."""
+    return {
+        name: {**metric, "samples": [[list(key), value] for key, value in metric["samples"].items()]}
+        for name, metric in merged.items()
+    }
+
+
+def _read_snapshot(path: str) -> Optional[dict[str, Any]]:
+    try:
+        with open(path, "rb") as f:
+            return json.loads(f.read())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        logger.warning("unreadable metrics snapshot %s", path, exc_info=True)
+        return None
+
+
+def _write_snapshot(path: str, snapshot: dict[str, Any]) -> None:
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(snapshot, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def _snapshot_path(pid: int) -> str:
+    return os.path.join(METRICS_DIR or "", f"{pid}.json")
+
+
+def flush() -> None:
+    """Write this process's snapshot where the other workers can read it."""
+    if METRICS_DIR:
+        try:
+            _write_snapshot(_snapshot_path(os.getpid()), REGISTRY.snapshot())
+        except OSError:
+            logger.warning("cannot write metrics snapshot", exc_info=True)
+
+
+def collect() -> dict[str, Any]:
+    """This process's live values merged with every other process's snapshot.
+
+    Counters and histograms are summed across processes, including ones
+    that have exited; gauges are summed across live processes only.
+    """
+    merged: dict[str, Any] = {}
+    _merge(merged, REGISTRY.snapshot())
+    if METRICS_DIR:
+        own = f"{os.getpid()}.json"
+        try:
+            names = sorted(os.listdir(METRICS_DIR))
+        except OSError:
+            names = []
+        for name in names:
+            if name == own or not name.endswith(".json"):
+                continue
+            snapshot = _read_snapshot(os.path.join(METRICS_DIR, name))
+            if snapshot:
+                _merge(merged, snapshot, gauges=name != _ARCHIVE)
+    return merged
+
+
+def mark_process_dead(pid: int) -> None:
+    """Fold an exited process's counters into the archive (gunicorn master only)."""
+    if not METRICS_DIR:
+        return
+    path = _snapshot_path(pid)
+    snapshot = _read_snapshot(path)
+    if snapshot is None:
+        return
+    archive_path = os.path.join(METRICS_DIR, _ARCHIVE)
+    merged: dict[str, Any] = {}
+    _merge(merged, _read_snapshot(archive_path) or {})
+    _merge(merged, snapshot, gauges=False)
+    _write_snapshot(archive_path, _unmerge(merged))
+    os.unlink(path)
+
+
+def reset_dir() -> None:
+    """Clear snapshots left by an earlier run (gunicorn master, before forking)."""
+    if not METRICS_DIR:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    for name in os.listdir(METRICS_DIR):
+        if name.endswith((".json", ".tmp")):
+            os.unlink(os.path.join(METRICS_DIR, name))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def render(merged: Optional[dict[str, Any]] = None) -> bytes:
+    """Prometheus text exposition of ``collect()``."""
+    merged = collect() if merged is None else merged
+    lines = []
+    for name in sorted(merged):
+        metric = merged[name]
+        names = metric["labels"]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for key in sorted(metric["samples"]):
+            value = metric["samples"][key]
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{_labels(names, key)} {_number(value)}")
+                continue
+            cumulative = 0
+            bounds = [_number(bound) for bound in metric["buckets"]] + ["+Inf"]
+            for bound, count in zip(bounds, value["counts"]):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{name}_bucket{_labels(names, key, le)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(names, key)} {_number(value['sum'])}")
+            lines.append(f"{name}_count{_labels(names, key)} {cumulative}")
+    return ("\n".join(lines) + "\n").encode()
+
+
+_writer_pid: Optional[int] = None
+
+
+def start_writer(interval: float = METRICS_FLUSH_SECONDS) -> None:
+    """Flush this process's snapshot every ``interval`` seconds, once per process."""
+    global _writer_pid
+    if not METRICS_DIR or _writer_pid == os.getpid():
+        return
+    _writer_pid = os.getpid()
+
+    def run() -> None:
+        while True:
+            time.sleep(interval)
+            flush()
+
+    threading.Thread(target=run, name="metrics-writer", daemon=True).start()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def serve(port: int) -> ThreadingHTTPServer:
+    """Expose /metrics on ``port`` from a daemon thread, for processes without a web app."""
+    server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -0,0 +1,126 @@
+import logging
+import os
+import select
+import threading
+import time
+from typing import Any, Callable, Optional
+
+import psycopg2
+import psycopg2.extensions
+
+logger = logging.getLogger("flexis-orders.notify")
+
+ORDERS_CHANNEL = "orders_changed"
+# writers NOTIFY in their transaction; the notification is delivered on commit
+ORDERS_NOTIFY = os.getenv("ORDERS_NOTIFY", "true").lower() in ("1", "true", "yes")
+# web processes LISTEN and invalidate their caches
+ORDERS_LISTEN = os.getenv("ORDERS_LISTEN", "true").lower() in ("1", "true", "yes")
+# a notification can beat the write to the reader replicas, so caches are
+# invalidated once more this long after the last one (0 disables)
+ORDERS_NOTIFY_SETTLE_SECONDS = float(os.getenv("ORDERS_NOTIFY_SETTLE_SECONDS", "1"))
+# idle listener connections are pinged this often so a dead one is noticed
+ORDERS_LISTEN_PING_SECONDS = float(os.getenv("ORDERS_LISTEN_PING_SECONDS", "30"))
+
+
+class OrdersChangedListener:
+    """LISTENs on ``orders_changed`` over a dedicated connection.
+
+    ``on_change`` runs on the listener thread for each batch of
+    notifications, again ``settle_seconds`` after the last one, and after
+    every (re)connect, since anything sent while disconnected is lost.
+    Pass ``orders.db.direct_config()``: LISTEN would pin an RDS Proxy
+    connection for its whole life.
+    """
+
+    def __init__(
+        self,
+        cfg: dict[str, Any],
+        on_change: Callable[[], None],
+        *,
+        channel: str = ORDERS_CHANNEL,
+        settle_seconds: float = ORDERS_NOTIFY_SETTLE_SECONDS,
+        ping_seconds: float = ORDERS_LISTEN_PING_SECONDS,
+    ) -> None:
+        self.cfg = cfg
+        self.on_change = on_change
+        self.channel = channel
+        self.settle_seconds = settle_seconds
+        self.ping_seconds = ping_seconds
+        self.notifications = 0
+        self.reconnects = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _fire(self) -> None:
+        try:
+            self.on_change()
+        except Exception:
+            logger.exception("orders_changed handler failed")
+
+    def _connect(self) -> psycopg2.extensions.connection:
+        conn = psycopg2.connect(**self.cfg)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f'LISTEN "{self.channel}"')
+        return conn
+
+    def _listen(self, conn: psycopg2.extensions.connection) -> None:
+        settle_at: Optional[float] = None
+        ping_at = time.monotonic() + self.ping_seconds
+        while not self._stop.is_set():
+            now = time.monotonic()
+            wake_at = min(ping_at, settle_at or ping_at, now + 1)
+            readable, _, _ = select.select([conn], [], [], max(wake_at - now, 0))
+
+            now = time.monotonic()
+            if readable:
+                conn.poll()
+            elif now >= ping_at:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+            if readable or now >= ping_at:
+                ping_at = now + self.ping_seconds
+
+            if conn.notifies:
+                self.notifications += len(conn.notifies)
+                conn.notifies.clear()
+                self._fire()
+                if self.settle_seconds > 0:
+                    settle_at = now + self.settle_seconds
+            elif settle_at is not None and now >= settle_at:
+                settle_at = None
+                self._fire()
+
+    def run(self) -> None:
+        delay = 0.5
+        while not self._stop.is_set():
+            try:
+                conn = self._connect()
+            except Exception:
+                logger.warning("cannot LISTEN on %s, retrying in %.1fs", self.channel, delay, exc_info=True)
+                self._stop.wait(delay)
+                delay = min(delay * 2, 30)
+                continue
+
+            delay = 0.5
+            logger.info("listening on %s", self.channel)
+            self._fire()
+            try:
+                self._listen(conn)
+            except Exception:
+                self.reconnects += 1
+                logger.warning("lost %s listener connection", self.channel, exc_info=True)
+            finally:
+                conn.close()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.run, name="orders-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 2) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self) -> dict[str, int]:
+        return {"notifications": self.notifications, "reconnects": self.reconnects}
@@ -0,0 +1,159 @@
+import gzip
+import hashlib
+import os
+from typing import Optional
+
+from orders.cache import etag_matches
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 0 makes browsers revalidate on every visit; the ETag turns that into a 304
+INDEX_CACHE_SECONDS = int(os.getenv("INDEX_CACHE_SECONDS", "0"))
+
+INDEX_HTML = """
+<!doctype html>
+<html lang="en">
+  <head>
+    <meta charset="utf-8" />
+    <meta name="viewport" content="width=device-width, initial-scale=1" />
+    <title>Flexicx Order Processing</title>
+    <style>
+      body { font-family: Arial, sans-serif; margin: 32px; }
+      h1 { margin-bottom: 8px; }
+      .card { border: 1px solid #ddd; padding: 16px; border-radius: 8px; max-width: 720px; }
+      label { display: block; margin-top: 12px; }
+      input, textarea { width: 100%; padding: 8px; margin-top: 4px; }
+      button { margin-top: 12px; padding: 10px 16px; }
+      .orders { margin-top: 24px; }
+      .order { padding: 8px 0; border-bottom: 1px solid #eee; }
+      .muted { color: #666; font-size: 12px; }
+    </style>
+  </head>
+  <body>
+    <div class="card">
+      <h1>Flexicx Order Processing</h1>
+      <p class="muted">This is a simple demo app that submits orders and pushes them to SQS.</p>
+      <form id="order-form">
+        <label>Customer Name
+          <input name="customer" required />
+        </label>
+        <label>Order Notes
+          <textarea name="notes" rows="3"></textarea>
+        </label>
+        <button type="submit">Submit Order</button>
+      </form>
+      <div class="orders">
+        <h3>Recent Orders</h3>
+        <div id="orders"></div>
+      </div>
+    </div>
+    <script>
+      async function loadOrders() {
+        const res = await fetch('/api/orders');
+        const data = await res.json();
+        const container = document.getElementById('orders');
+        container.innerHTML = '';
+        (data.orders || []).forEach(order => {
+          const div = document.createElement('div');
+          div.className = 'order';
+          div.innerHTML = `<strong>${order.customer}</strong> - ${order.id}<div class="muted">${order.createdAt}</div>`;
+          container.appendChild(div);
+        });
+      }
+
+      document.getElementById('order-form').addEventListener('submit', async (event) => {
+        event.preventDefault();
+        const form = event.target;
+        const payload = {
+          customer: form.customer.value,
+          notes: form.notes.value
+        };
+        await fetch('/api/orders', {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify(payload)
+        });
+        form.reset();
+        await loadOrders();
+      });
+
+      loadOrders();
+    </script>
+  </body>
+</html>
+"""
+
+
+class StaticPage:
+    """A fixed body compressed once per content-coding, each with a strong ETag."""
+
+    # preferred first when a client accepts several codings equally
+    CODINGS = ("br", "gzip", "identity")
+
+    def __init__(self, body: str, content_type: str, max_age: int = INDEX_CACHE_SECONDS) -> None:
+        raw = body.encode()
+        self.content_type = content_type
+        self.cache_control = f"public, max-age={max_age}" if max_age > 0 else "public, no-cache"
+        encoded = {"identity": raw, "gzip": gzip.compress(raw, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            encoded["br"] = brotli.compress(raw, quality=11)
+        self.bodies = {
+            coding: data for coding, data in encoded.items() if coding == "identity" or len(data) < len(raw)
+        }
+        # different bytes per coding, so each representation gets its own tag
+        digest = hashlib.sha256(raw).hexdigest()[:20]
+        self.etags = {
+            coding: f'"{digest}"' if coding == "identity" else f'"{digest}-{coding}"' for coding in self.bodies
+        }
+
+    def select(self, accept_encoding: Optional[str]) -> str:
+        weights: dict[str, float] = {}
+        for part in (accept_encoding or "").split(","):
+            coding, _, params = part.partition(";")
+            coding = coding.strip().lower()
+            if not coding:
+                continue
+            weight = 1.0
+            for param in params.split(";"):
+                name, _, value = param.partition("=")
+                if name.strip().lower() == "q":
+                    try:
+                        weight = float(value)
+                    except ValueError:
+                        weight = 0.0
+            weights[coding] = weight
+
+        best, best_weight = "identity", 0.0
+        for coding in self.CODINGS:
+            if coding not in self.bodies:
+                continue
+            if coding == "identity":
+                # acceptable unless refused, but never preferred over a listed coding
+                weight = weights.get("identity", 0.0 if weights.get("*", 1.0) == 0 else 0.001)
+            else:
+                weight = weights.get(coding, weights.get("*", 0.0))
+            if weight > best_weight:
+                best, best_weight = coding, weight
+        return best
+
+    def not_modified(self, coding: str, if_none_match: Optional[str]) -> bool:
+        return etag_matches(if_none_match, self.etags[coding])
+
+    def headers(self, coding: str, *, body: bool = True) -> dict[str, str]:
+        headers = {
+            "ETag": self.etags[coding],
+            "Cache-Control": self.cache_control,
+            "Vary": "Accept-Encoding",
+        }
+        # a 304 carries only the validators and caching headers
+        if body:
+            headers["Content-Type"] = self.content_type
+            if coding != "identity":
+                headers["Content-Encoding"] = coding
+        return headers
+
+
+INDEX_PAGE = StaticPage(INDEX_HTML, "text/html; charset=utf-8")
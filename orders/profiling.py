@@ -0,0 +1,306 @@
+import cProfile
+import hashlib
+import hmac
+import logging
+import marshal
+import os
+import random
+import re
+import signal
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Iterable, Optional
+
+from orders.serialization import dumps
+
+logger = logging.getLogger("flexis-orders.profiling")
+
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "false").lower() in ("1", "true", "yes")
+# share of requests profiled without being asked to
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# HMAC key for the X-Profile header; the header is ignored when unset
+PROFILE_SECRET = os.getenv("PROFILE_SECRET", "")
+# pstats: deterministic cProfile of the request thread; speedscope: stack sampling
+PROFILE_FORMAT = os.getenv("PROFILE_FORMAT", "pstats").lower()
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "flexis-profiles"))
+# oldest profiles are deleted to stay under this
+PROFILE_MAX_BYTES = int(os.getenv("PROFILE_MAX_BYTES", str(200 * 1024 * 1024)))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+# length of the whole-process window SIGUSR1 starts
+PROFILE_SIGNAL_SECONDS = float(os.getenv("PROFILE_SIGNAL_SECONDS", "30"))
+
+PROFILE_HEADER = "X-Profile"
+
+_LABEL = re.compile(r"[^A-Za-z0-9]+")
+
+
+def sign(secret: str, ttl: float = 300) -> str:
+    """An ``X-Profile`` header value valid for ``ttl`` seconds."""
+    expires = str(int(time.time() + ttl))
+    digest = hmac.new(secret.encode(), expires.encode(), hashlib.sha256).hexdigest()
+    return f"{expires}.{digest}"
+
+
+def verify(value: Optional[str], secret: str = PROFILE_SECRET) -> bool:
+    if not value or not secret:
+        return False
+    expires, _, digest = value.partition(".")
+    if not expires.isascii():
+        return False
+    expected = hmac.new(secret.encode(), expires.encode(), hashlib.sha256).hexdigest()
+    # bytes, because compare_digest raises TypeError on non-ASCII str
+    if not hmac.compare_digest(digest.encode("utf-8", "surrogateescape"), expected.encode()):
+        return False
+    try:
+        return float(expires) >= time.time()
+    except ValueError:
+        return False
+
+
+def _make_room(directory: str, size: int, limit: int) -> bool:
+    """Delete the oldest profiles until ``size`` more bytes fit under ``limit``."""
+    if size > limit:
+        return False
+    files = []
+    for entry in os.scandir(directory):
+        if entry.is_file():
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+    files.sort()
+    total = sum(f[1] for f in files)
+    for _, file_size, path in files:
+        if total + size <= limit:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= file_size
+    return total + size <= limit
+
+
+def write_profile(
+    label: str,
+    ext: str,
+    data: bytes,
+    *,
+    directory: str = PROFILE_DIR,
+    limit: int = PROFILE_MAX_BYTES,
+) -> Optional[str]:
+    """Write one profile file under the disk cap; returns its path, or None when skipped."""
+    name = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{_LABEL.sub('-', label).strip('-')}.{ext}"
+    path = os.path.join(directory, name)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        if not _make_room(directory, len(data), limit):
+            logger.warning("profile %s (%d bytes) does not fit in PROFILE_MAX_BYTES", name, len(data))
+            return None
+        # written aside and renamed, so a reader never sees half a file
+        tmp = os.path.join(directory, f".{name}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except OSError:
+        logger.warning("failed to write profile %s", name, exc_info=True)
+        return None
+    logger.info("wrote profile %s", path)
+    return path
+
+
+class StackSampler:
+    """Samples thread stacks from a background thread into a speedscope document.
+
+    ``threads`` limits sampling to those thread idents; by default every
+    thread but the sampler itself is recorded, one speedscope profile each.
+    """
+
+    def __init__(self, threads: Optional[set[int]] = None, *, interval_ms: float = PROFILE_INTERVAL_MS) -> None:
+        self.threads = threads
+        self.interval = max(interval_ms, 0.1) / 1000
+        self._frames: dict[tuple[str, str, int], int] = {}
+        # thread ident -> (samples, weights in ms)
+        self._samples: dict[int, tuple[list[list[int]], list[float]]] = {}
+        self._names: dict[int, str] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.started = 0.0
+        self.ended = 0.0
+
+    def _frame(self, frame: Any) -> int:
+        code = frame.f_code
+        key = (code.co_qualname, code.co_filename, code.co_firstlineno)
+        index = self._frames.get(key)
+        if index is None:
+            index = self._frames[key] = len(self._frames)
+        return index
+
+    def _sample(self, weight: float) -> None:
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own or (self.threads is not None and ident not in self.threads):
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._frame(frame))
+                frame = frame.f_back
+            stack.reverse()
+            samples, weights = self._samples.setdefault(ident, ([], []))
+            samples.append(stack)
+            weights.append(weight)
+
+    def run(self) -> None:
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            self._sample((now - last) * 1000)
+            last = now
+
+    def start(self) -> None:
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self.run, name="profile-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.ended = time.perf_counter()
+        self._names = {t.ident: t.name for t in threading.enumerate() if t.ident is not None}
+
+    def speedscope(self, name: str) -> bytes:
+        frames = [{"name": qualname, "file": file, "line": line} for qualname, file, line in self._frames]
+        duration = (self.ended - self.started) * 1000
+        profiles = [
+            {
+                "type": "sampled",
+                "name": self._names.get(ident, str(ident)),
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": duration,
+                "samples": samples,
+                "weights": weights,
+            }
+            for ident, (samples, weights) in self._samples.items()
+        ]
+        return dumps(
+            {
+                "$schema": "https://www.speedscope.app/file-format-schema.json",
+                "name": name,
+                "exporter": "flexis-orders",
+                "shared": {"frames": frames},
+                "profiles": profiles,
+            }
+        )
+
+
+class ProfilingMiddleware:
+    """WSGI middleware that profiles sampled or signed requests.
+
+    A request is profiled when it wins the ``sample_rate`` draw or carries
+    a valid ``X-Profile`` header (see ``sign``). At most one request per
+    process is profiled at a time, so the overhead stays bounded. The
+    profile covers the request thread until the view has returned; a
+    streamed body is not included. Files are written before the response
+    is sent, and their path is logged.
+    """
+
+    def __init__(
+        self,
+        app: Callable[..., Iterable[bytes]],
+        *,
+        sample_rate: float = PROFILE_SAMPLE_RATE,
+        secret: str = PROFILE_SECRET,
+        fmt: str = PROFILE_FORMAT,
+    ) -> None:
+        self.app = app
+        self.sample_rate = sample_rate
+        self.secret = secret
+        self.fmt = fmt
+        self._slot = threading.Lock()
+
+    def _wanted(self, environ: dict[str, Any]) -> bool:
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return True
+        return verify(environ.get("HTTP_X_PROFILE"), self.secret)
+
+    def __call__(self, environ: dict[str, Any], start_response: Callable[..., Any]) -> Iterable[bytes]:
+        if not self._wanted(environ) or not self._slot.acquire(blocking=False):
+            return self.app(environ, start_response)
+
+        label = f"{environ.get('REQUEST_METHOD', '')} {environ.get('PATH_INFO', '')}"
+        try:
+            if self.fmt == "speedscope":
+                sampler = StackSampler({threading.get_ident()})
+                sampler.start()
+                try:
+                    return self.app(environ, start_response)
+                finally:
+                    sampler.stop()
+                    write_profile(label, "speedscope.json", sampler.speedscope(label))
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                return self.app(environ, start_response)
+            finally:
+                profiler.disable()
+                profiler.create_stats()
+                write_profile(label, "pstats", marshal.dumps(profiler.stats))  # type: ignore[attr-defined]
+        finally:
+            self._slot.release()
+
+
+_window_lock = threading.Lock()
+_previous_handler: Any = None
+
+
+def profile_window(seconds: float = PROFILE_SIGNAL_SECONDS) -> Optional[threading.Thread]:
+    """Sample every thread for ``seconds`` and write one speedscope file; one window at a time."""
+    if not _window_lock.acquire(blocking=False):
+        logger.info("profile window already running")
+        return None
+
+    def run() -> None:
+        try:
+            sampler = StackSampler()
+            sampler.start()
+            time.sleep(seconds)
+            sampler.stop()
+            write_profile("process", "speedscope.json", sampler.speedscope(f"pid {os.getpid()}"))
+        except Exception:
+            logger.exception("profile window failed")
+        finally:
+            _window_lock.release()
+
+    thread = threading.Thread(target=run, name="profile-window", daemon=True)
+    thread.start()
+    return thread
+
+
+def _on_signal(signum: int, frame: Any) -> None:
+    # runs on the main thread between bytecodes; only start the window thread
+    profile_window()
+    if callable(_previous_handler):
+        # gunicorn workers reopen their log files on SIGUSR1
+        _previous_handler(signum, frame)
+
+
+def install_signal_handler() -> bool:
+    """Start a profile window on SIGUSR1, keeping any existing handler; main thread only."""
+    global _previous_handler
+    if not PROFILE_ENABLED or threading.current_thread() is not threading.main_thread():
+        return False
+    current = signal.getsignal(signal.SIGUSR1)
+    if current is _on_signal:
+        return True
+    _previous_handler = current
+    signal.signal(signal.SIGUSR1, _on_signal)
+    return True
+
+
+if __name__ == "__main__":
+    # prints an X-Profile header value for PROFILE_SECRET
+    if not PROFILE_SECRET:
+        sys.exit("PROFILE_SECRET is not set")
+    print(f"{PROFILE_HEADER}: {sign(PROFILE_SECRET, float(sys.argv[1]) if len(sys.argv) > 1 else 300)}")
@@ -0,0 +1,365 @@
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from orders import tracing
+from orders.metrics import SQS_REQUEST_ERRORS, observe_sqs
+from orders.serialization import dumps
+
+logger = logging.getLogger("flexis-orders.publisher")
+
+SQS_PUBLISH_QUEUE_SIZE = int(os.getenv("SQS_PUBLISH_QUEUE_SIZE", "1000"))
+SQS_PUBLISH_THREADS = int(os.getenv("SQS_PUBLISH_THREADS", "2"))
+SQS_PUBLISH_BLOCK_SECONDS = float(os.getenv("SQS_PUBLISH_BLOCK_SECONDS", "1"))
+SQS_PUBLISH_MAX_ATTEMPTS = int(os.getenv("SQS_PUBLISH_MAX_ATTEMPTS", "5"))
+SQS_PUBLISH_SHUTDOWN_SECONDS = float(os.getenv("SQS_PUBLISH_SHUTDOWN_SECONDS", "10"))
+SQS_BATCH_MAX_MESSAGES = int(os.getenv("SQS_BATCH_MAX_MESSAGES", "10"))
+SQS_BATCH_MAX_BYTES = int(os.getenv("SQS_BATCH_MAX_BYTES", str(256 * 1024)))
+SQS_BATCH_LINGER_MS = float(os.getenv("SQS_BATCH_LINGER_MS", "5"))
+
+# set on every message this service sends: each order is committed before it is published
+PERSISTED_ATTRIBUTE = "ordersPersisted"
+_PERSISTED = {"DataType": "String", "StringValue": "true"}
+
+# SQS counts message attributes against the size limits too; ours (ordersPersisted,
+# plus traceparent and sentAt when tracing) fit well within this per message
+MESSAGE_ATTRIBUTE_BYTES = 256
+
+_STOP = object()
+
+
+def _no_count(name: str, n: int = 1) -> None:
+    pass
+
+
+def message_size(body: bytes) -> int:
+    """Bytes a message with ``body`` counts for against ``SQS_BATCH_MAX_BYTES``."""
+    return len(body) + MESSAGE_ATTRIBUTE_BYTES
+
+
+def split_batches(
+    bodies: list[bytes],
+    max_messages: int = SQS_BATCH_MAX_MESSAGES,
+    max_bytes: int = SQS_BATCH_MAX_BYTES,
+) -> list[list[bytes]]:
+    """Group bodies, in order, into ``send_message_batch``-sized lists."""
+    max_messages = min(max(1, max_messages), 10)
+    max_bytes = min(max(1, max_bytes), 256 * 1024)
+    batches: list[list[bytes]] = []
+    size = 0
+    for body in bodies:
+        body_size = message_size(body)
+        if not batches or len(batches[-1]) == max_messages or size + body_size > max_bytes:
+            batches.append([])
+            size = 0
+        batches[-1].append(body)
+        size += body_size
+    return batches
+
+
+def batch_entries(
+    pending: dict[str, bytes], traceparents: Optional[list[Optional[str]]] = None
+) -> list[dict[str, Any]]:
+    entries = []
+    for entry_id, body in pending.items():
+        entry: dict[str, Any] = {"Id": entry_id, "MessageBody": body.decode()}
+        attributes = tracing.message_attributes(traceparents[int(entry_id)] if traceparents else None)
+        attributes[PERSISTED_ATTRIBUTE] = _PERSISTED
+        entry["MessageAttributes"] = attributes
+        entries.append(entry)
+    return entries
+
+
+class BatchSend:
+    """Entries and retry state of one ``send_message_batch`` of up to ten bodies.
+
+    It does no I/O: ``send_batch`` here and in ``orders.aio`` make the calls
+    and wait out the backoff. Entries SQS failed on its side are retried;
+    entries it rejected as the sender's fault are not.
+    """
+
+    def __init__(
+        self,
+        bodies: list[bytes],
+        traceparents: Optional[list[Optional[str]]] = None,
+        count: Callable[[str, int], None] = _no_count,
+    ) -> None:
+        self.pending = {str(i): body for i, body in enumerate(bodies)}
+        self.rejected: list[int] = []
+        self.traceparents = traceparents
+        self.count = count
+
+    def entries(self) -> list[dict[str, Any]]:
+        return batch_entries(self.pending, self.traceparents)
+
+    def raised(self, attempt: int) -> None:
+        """Record a call that raised; call from the ``except`` block."""
+        SQS_REQUEST_ERRORS.labels("send_message_batch").inc()
+        logger.warning("SQS batch send failed (attempt %d)", attempt, exc_info=True)
+
+    def handle(self, response: dict[str, Any], started: float) -> None:
+        observe_sqs("send_message_batch", started, len(response.get("Failed", [])))
+        self.count("batches", 1)
+        self.count("sent", len(response.get("Successful", [])))
+        retry = {}
+        for failure in response.get("Failed", []):
+            entry_id = failure["Id"]
+            if failure.get("SenderFault"):
+                self.count("failed", 1)
+                self.rejected.append(int(entry_id))
+                logger.error(
+                    "SQS rejected order message: %s %s",
+                    failure.get("Code"),
+                    failure.get("Message"),
+                )
+            else:
+                retry[entry_id] = self.pending[entry_id]
+        self.pending = retry
+
+    def backoff(self, attempt: int, max_attempts: int) -> Optional[float]:
+        """Seconds to wait before the next attempt, or None when there is none."""
+        if not self.pending or attempt >= max_attempts:
+            return None
+        self.count("retried", len(self.pending))
+        return min(0.1 * 2 ** (attempt - 1), 2.0)
+
+    def unsent(self, attempts: int) -> list[int]:
+        """Indexes of the bodies that were not sent."""
+        if self.pending:
+            self.count("failed", len(self.pending))
+            logger.error("failed to send %d order messages to SQS after %d attempts", len(self.pending), attempts)
+        return self.rejected + [int(k) for k in self.pending]
+
+
+def send_batch(
+    client: Any,
+    queue_url: str,
+    bodies: list[bytes],
+    *,
+    traceparents: Optional[list[Optional[str]]] = None,
+    max_attempts: int = SQS_PUBLISH_MAX_ATTEMPTS,
+    count: Callable[[str, int], None] = _no_count,
+) -> list[int]:
+    """Send up to ten bodies with one ``send_message_batch`` call, retrying as ``BatchSend`` decides.
+
+    ``traceparents``, one per body, travel as message attributes. Returns
+    the indexes of the bodies that were not sent.
+    """
+    send = BatchSend(bodies, traceparents, count)
+    for attempt in range(1, max(1, max_attempts) + 1):
+        started = time.perf_counter()
+        try:
+            response = client.send_message_batch(QueueUrl=queue_url, Entries=send.entries())
+        except Exception:
+            send.raised(attempt)
+        else:
+            send.handle(response, started)
+        delay = send.backoff(attempt, max_attempts)
+        if delay is None:
+            break
+        time.sleep(delay)
+    return send.unsent(attempt)
+
+
+def start_send_spans(producers: list[tracing.Span]) -> list[tuple[tracing.Span, tracing.Span]]:
+    """One client span per message under its producer span, for a batch about to be sent."""
+    if not tracing.TRACE_ENABLED:
+        return [(producer, tracing.NOOP_SPAN) for producer in producers]
+    attributes = {"messaging.batch.message_count": len(producers)}
+    sends = []
+    for producer in producers:
+        send = tracing.start_span("SQS SendMessageBatch", kind=tracing.CLIENT, parent=producer, attributes=attributes)
+        sends.append((producer, send))
+    return sends
+
+
+def end_send_spans(sends: list[tuple[tracing.Span, tracing.Span]], failed: list[int]) -> None:
+    for i in failed:
+        sends[i][0].set_error("not sent")
+    for producer, send in sends:
+        send.end()
+        producer.end()
+
+
+class BasePublisher:
+    """Settings, counters and message spans of a batching SQS publisher.
+
+    ``publish`` only enqueues. When the queue is full it waits for up to
+    ``block_seconds`` before giving up and counting the message as dropped.
+    Senders group messages into ``send_message_batch`` calls of up to
+    ``batch_max_messages`` / ``batch_max_bytes``, waiting at most
+    ``linger_ms`` for a batch to fill, and retry only the entries SQS
+    reports as failed. A message may be delivered more than once but is
+    never silently lost while the process is alive.
+
+    Each message gets a producer span, started under the caller's span and
+    ended once SQS has taken or refused it, so its wait in the queue shows
+    up in the trace. Subclasses own the queue and the senders.
+    """
+
+    _queue: Any
+
+    def __init__(
+        self,
+        client: Any,
+        queue_url: str,
+        *,
+        senders: int = SQS_PUBLISH_THREADS,
+        block_seconds: float = SQS_PUBLISH_BLOCK_SECONDS,
+        max_attempts: int = SQS_PUBLISH_MAX_ATTEMPTS,
+        batch_max_messages: int = SQS_BATCH_MAX_MESSAGES,
+        batch_max_bytes: int = SQS_BATCH_MAX_BYTES,
+        linger_ms: float = SQS_BATCH_LINGER_MS,
+    ) -> None:
+        self.client = client
+        self.queue_url = queue_url
+        self.block_seconds = block_seconds
+        self.max_attempts = max(1, max_attempts)
+        self.batch_max_messages = min(max(1, batch_max_messages), 10)
+        self.batch_max_bytes = min(max(1, batch_max_bytes), 256 * 1024)
+        self.linger = max(linger_ms, 0) / 1000
+        self._senders = max(1, senders)
+        self._closed = False
+        self._lock = threading.Lock()
+        self._counters = {"queued": 0, "sent": 0, "failed": 0, "dropped": 0, "retried": 0, "batches": 0}
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += n
+
+    def _message(self, order: dict[str, Any]) -> Optional[tuple[bytes, tracing.Span]]:
+        """The queue item for ``order``, or None once the publisher is closed."""
+        if self._closed:
+            self._count("dropped")
+            logger.warning("publisher closed, dropping order %s", order.get("id"))
+            return None
+        span = tracing.start_span("orders publish", kind=tracing.PRODUCER, attributes={"order.id": order.get("id")})
+        return dumps(order), span
+
+    def _queue_full(self, order: dict[str, Any], span: tracing.Span) -> None:
+        self._count("dropped")
+        logger.warning("publish queue full, dropping order %s", order.get("id"))
+        span.set_error("publish queue full")
+        span.end()
+
+    def _start_sending(
+        self, batch: list[tuple[bytes, tracing.Span]]
+    ) -> tuple[list[tuple[tracing.Span, tracing.Span]], list[bytes], dict[str, Any]]:
+        """Send spans, bodies and ``send_batch`` options for ``batch``."""
+        options = {
+            "traceparents": [span.traceparent() for _, span in batch] if tracing.TRACE_ENABLED else None,
+            "max_attempts": self.max_attempts,
+            "count": self._count,
+        }
+        return start_send_spans([span for _, span in batch]), [body for body, _ in batch], options
+
+    def _unsent_at_close(self, pending: int) -> None:
+        if pending:
+            self._count("dropped", pending)
+            logger.warning("publisher shut down with %d unsent orders", pending)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {**self._counters, "depth": self._queue.qsize()}
+
+
+class SqsPublisher(BasePublisher):
+    """Publishes order messages from background sender threads."""
+
+    def __init__(
+        self, client: Any, queue_url: str, *, max_queue: int = SQS_PUBLISH_QUEUE_SIZE, **settings: Any
+    ) -> None:
+        super().__init__(client, queue_url, **settings)
+        self._queue: queue.Queue[Any] = queue.Queue(maxsize=max_queue)
+        self._threads: list[threading.Thread] = []
+
+    def start(self) -> None:
+        for i in range(self._senders):
+            thread = threading.Thread(
+                target=self._run,
+                name=f"sqs-publisher-{i}",
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def publish(self, order: dict[str, Any]) -> bool:
+        item = self._message(order)
+        if item is None:
+            return False
+        try:
+            self._queue.put(item, timeout=self.block_seconds)
+        except queue.Full:
+            self._queue_full(order, item[1])
+            return False
+        self._count("queued")
+        return True
+
+    def _send_batch(self, batch: list[tuple[bytes, tracing.Span]]) -> None:
+        sends, bodies, options = self._start_sending(batch)
+        end_send_spans(sends, send_batch(self.client, self.queue_url, bodies, **options))
+
+    def _collect(self, first: Any) -> tuple[list[Any], Optional[Any], bool]:
+        batch = [first]
+        size = message_size(first[0])
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.batch_max_messages:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self._queue.task_done()
+                return batch, None, True
+            item_size = message_size(item[0])
+            if size + item_size > self.batch_max_bytes:
+                # starts the next batch instead
+                return batch, item, False
+            batch.append(item)
+            size += item_size
+        return batch, None, False
+
+    def _run(self) -> None:
+        carry: Optional[Any] = None
+        while True:
+            item = carry if carry is not None else self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                return
+            batch, carry, stop = self._collect(item)
+            try:
+                self._send_batch(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def close(self, timeout: float = SQS_PUBLISH_SHUTDOWN_SECONDS) -> None:
+        if self._closed:
+            return
+        self._closed = True
+
+        deadline = time.monotonic() + timeout
+        for _ in self._threads:
+            try:
+                self._queue.put(_STOP, timeout=max(deadline - time.monotonic(), 0))
+            except queue.Full:
+                break
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+
+        with self._queue.mutex:
+            pending = sum(1 for item in self._queue.queue if item is not _STOP)
+        self._unsent_at_close(pending)
+
+
+def create_publisher(client: Optional[Any], queue_url: Optional[str]) -> Optional[SqsPublisher]:
+    if client is None or not queue_url:
+        return None
+    publisher = SqsPublisher(client, queue_url)
+    publisher.start()
+    return publisher
@@ -0,0 +1,207 @@
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Any, Optional
+
+import boto3
+
+from orders import tracing
+from orders.db import ConnectionPool, db_config
+from orders.logs import configure_logging
+from orders.metrics import SQS_REQUEST_ERRORS, observe_sqs
+from orders.publisher import batch_entries, end_send_spans, start_send_spans
+
+logger = logging.getLogger("flexis-orders.relay")
+
+OUTBOX_RELAY_BATCH = int(os.getenv("OUTBOX_RELAY_BATCH", "100"))
+OUTBOX_RELAY_IDLE_SECONDS = float(os.getenv("OUTBOX_RELAY_IDLE_SECONDS", "0.5"))
+OUTBOX_RELAY_THREADS = int(os.getenv("OUTBOX_RELAY_THREADS", "1"))
+# rejected sends before a row is dead-lettered (dead_at set)
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10"))
+
+
+class OutboxRelay:
+    """Drains order_outbox into SQS.
+
+    Rows are claimed with ``FOR UPDATE SKIP LOCKED`` so any number of relays
+    can run side by side; a row is deleted in the same transaction once SQS
+    has accepted it. Rows SQS rejected are retried on a later pass until
+    ``max_attempts`` sends have failed, or at once for a SenderFault, when
+    they are dead-lettered: ``dead_at`` is set and relays skip them.
+
+    Each row's producer span continues the trace stored with it and starts
+    at the row's ``created_at``, so time spent in the outbox is visible.
+    """
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        client: Any,
+        queue_url: str,
+        *,
+        batch_size: int = OUTBOX_RELAY_BATCH,
+        idle_seconds: float = OUTBOX_RELAY_IDLE_SECONDS,
+        max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+    ) -> None:
+        self.pool = pool
+        self.client = client
+        self.queue_url = queue_url
+        self.batch_size = max(1, batch_size)
+        self.idle_seconds = idle_seconds
+        self.max_attempts = max(1, max_attempts)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _publish(
+        self, rows: list[tuple[int, str, Optional[str], datetime]]
+    ) -> tuple[list[int], dict[int, bool], Optional[Exception]]:
+        """Send rows in chunks of ten.
+
+        Returns the ids SQS accepted, the ids it rejected mapped to whether
+        the rejection was a SenderFault, and the error that ended the pass
+        early. Chunks accepted before the error are still returned, so their
+        rows are deleted instead of being sent again.
+        """
+        sent: list[int] = []
+        failed: dict[int, bool] = {}
+        for start in range(0, len(rows), 10):
+            chunk = rows[start:start + 10]
+            producers = [
+                tracing.start_span(
+                    "orders publish",
+                    kind=tracing.PRODUCER,
+                    parent=tracing.parse_traceparent(traceparent),
+                    attributes={"outbox.id": row_id},
+                    start_ns=int(created_at.timestamp() * 1e9),
+                )
+                for row_id, _, traceparent, created_at in chunk
+            ]
+            sends = start_send_spans(producers)
+            started = time.perf_counter()
+            try:
+                # entry ids are positions in the chunk, as batch_entries expects
+                response = self.client.send_message_batch(
+                    QueueUrl=self.queue_url,
+                    Entries=batch_entries(
+                        {str(i): row[1].encode() for i, row in enumerate(chunk)},
+                        [span.traceparent() for span in producers],
+                    ),
+                )
+            except Exception as exc:
+                SQS_REQUEST_ERRORS.labels("send_message_batch").inc()
+                end_send_spans(sends, list(range(len(chunk))))
+                return sent, failed, exc
+            observe_sqs("send_message_batch", started, len(response.get("Failed", [])))
+            sent.extend(chunk[int(entry["Id"])][0] for entry in response.get("Successful", []))
+            end_send_spans(sends, [int(failure["Id"]) for failure in response.get("Failed", [])])
+            for failure in response.get("Failed", []):
+                row_id = chunk[int(failure["Id"])][0]
+                failed[row_id] = bool(failure.get("SenderFault"))
+                logger.warning(
+                    "SQS rejected outbox row %s: %s %s",
+                    row_id,
+                    failure.get("Code"),
+                    failure.get("Message"),
+                )
+        return sent, failed, None
+
+    def _record_failures(self, cur: Any, failed: dict[int, bool]) -> None:
+        # a SenderFault will fail the same way again, so those rows are
+        # dead-lettered at once; the rest after OUTBOX_MAX_ATTEMPTS tries
+        rejected = [row_id for row_id, sender_fault in failed.items() if sender_fault]
+        cur.execute(
+            "UPDATE order_outbox SET attempts = attempts + 1, "
+            "dead_at = CASE WHEN id = ANY(%s) OR attempts + 1 >= %s THEN now() END "
+            "WHERE id = ANY(%s) RETURNING id, dead_at IS NOT NULL",
+            (rejected, self.max_attempts, list(failed)),
+        )
+        dead = [row_id for row_id, is_dead in cur.fetchall() if is_dead]
+        if dead:
+            logger.error("dead-lettered outbox rows %s; they stay in order_outbox with dead_at set", dead)
+
+    def relay_once(self) -> int:
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "SELECT id, payload, traceparent, created_at FROM order_outbox "
+                "WHERE dead_at IS NULL ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED",
+                (self.batch_size,),
+            )
+            rows = cur.fetchall()
+            if not rows:
+                return 0
+            sent, failed, error = self._publish(rows)
+            if sent:
+                cur.execute("DELETE FROM order_outbox WHERE id = ANY(%s)", (sent,))
+            if failed:
+                self._record_failures(cur, failed)
+        # raised only after the deletes commit
+        if error is not None:
+            raise error
+        return len(sent)
+
+    def run(self) -> None:
+        logger.info("starting outbox relay")
+        while not self._stop.is_set():
+            try:
+                if self.relay_once() < self.batch_size:
+                    self._stop.wait(self.idle_seconds)
+            except Exception:
+                logger.exception("error while relaying outbox")
+                self._stop.wait(5)
+
+    def start(self, name: str = "outbox-relay") -> None:
+        self._thread = threading.Thread(target=self.run, name=name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            # let an in-flight pass commit its deletes
+            self._thread.join(timeout)
+
+
+def start_relays(
+    pool: ConnectionPool,
+    client: Any,
+    queue_url: str,
+    count: int = OUTBOX_RELAY_THREADS,
+) -> list[OutboxRelay]:
+    relays = []
+    for i in range(max(1, count)):
+        relay = OutboxRelay(pool, client, queue_url)
+        relay.start(f"outbox-relay-{i}")
+        relays.append(relay)
+    return relays
+
+
+def main() -> int:
+    configure_logging()
+
+    queue_url = os.getenv("SQS_QUEUE_URL")
+    cfg = db_config()
+    if not queue_url or not cfg or not cfg.get("password"):
+        logger.error("outbox relay needs SQS_QUEUE_URL, DB_HOST and DB_PASSWORD")
+        return 1
+
+    pool = ConnectionPool(cfg, maxsize=max(1, OUTBOX_RELAY_THREADS))
+    client = boto3.client("sqs", endpoint_url=os.getenv("SQS_ENDPOINT_URL"))
+    relays = start_relays(pool, client, queue_url)
+    tracing.start()
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    stop.wait()
+
+    for relay in relays:
+        relay.stop()
+    tracing.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
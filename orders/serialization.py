@@ -0,0 +1,203 @@
+import json
+import logging
+import os
+import re
+from itertools import chain
+from typing import Any, Callable, Optional, Union
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger("flexis-orders.serialization")
+
+# auto: orjson when importable and it passes the self-check, else stdlib
+JSON_SERIALIZER = os.getenv("JSON_SERIALIZER", "auto").lower()
+
+Buffer = Union[str, bytes, bytearray, memoryview]
+
+# what ensure_ascii escapes beyond orjson's own escaping: DEL and non-ASCII
+_NEEDS_ESCAPE = re.compile(r"[^\x00-\x7e]")
+
+
+def _escape_char(match: "re.Match[str]") -> str:
+    code = ord(match.group())
+    if code > 0xFFFF:
+        code -= 0x10000
+        return "\\u{:04x}\\u{:04x}".format(0xD800 | (code >> 10), 0xDC00 | (code & 0x3FF))
+    return "\\u{:04x}".format(code)
+
+
+def _stdlib_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def _stdlib_dumps_response(obj: Any, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+    return json.dumps(obj, default=default, sort_keys=True, separators=(",", ":")).encode()
+
+
+def _orjson_dumps(obj: Any) -> bytes:
+    try:
+        return orjson.dumps(obj)
+    except TypeError:
+        # lone surrogates, non-str keys, ints beyond 64 bits
+        return _stdlib_dumps(obj)
+
+
+_LEAF_TYPES = {str, int, bool, type(None)}
+
+
+def _has_float(obj: Any) -> bool:
+    """Whether ``obj`` holds a float anywhere, checked one nesting level at a time.
+
+    orjson spells floats differently from ``repr`` (``1e16``, ``0.00001``,
+    ``null`` for NaN). Levels of only dicts or only lists are flattened
+    without a Python-level loop, so an order page costs a few set builds.
+    """
+    level = [obj]
+    while level:
+        types = set(map(type, level))
+        if types <= _LEAF_TYPES:
+            return False
+        if float in types:
+            return True
+        if types == {dict}:
+            level = list(chain.from_iterable(map(dict.values, level)))
+        elif types == {list}:
+            level = list(chain.from_iterable(level))
+        else:
+            children: list[Any] = []
+            for item in level:
+                if isinstance(item, dict):
+                    children.extend(item.values())
+                elif isinstance(item, (list, tuple)):
+                    children.extend(item)
+                elif isinstance(item, float):
+                    return True
+            level = children
+    return False
+
+
+def _orjson_dumps_response(obj: Any, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+    if _has_float(obj):
+        return _stdlib_dumps_response(obj, default)
+    try:
+        body = orjson.dumps(
+            obj,
+            default=default,
+            # leave these to ``default`` so the output matches Flask's provider
+            option=orjson.OPT_SORT_KEYS
+            | orjson.OPT_PASSTHROUGH_DATETIME
+            | orjson.OPT_PASSTHROUGH_DATACLASS
+            | orjson.OPT_PASSTHROUGH_SUBCLASS,
+        )
+    except TypeError:
+        return _stdlib_dumps_response(obj, default)
+    if body.isascii() and b"\x7f" not in body:
+        return body
+    # these only occur inside strings; escape them like ensure_ascii does
+    return _NEEDS_ESCAPE.sub(_escape_char, body.decode()).encode()
+
+
+def _loads(data: Buffer) -> Any:
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+# order-shaped samples the orjson backend must encode exactly like stdlib
+_SELF_CHECK_SAMPLES: list[Any] = [
+    {
+        "id": "0b7a4b8e-3c0f-4b8e-9d7c-6c1d2f3e4a5b",
+        "customer": "Zoë \"Q\" O'Brien \\ <b>&</b>   \U0001f355",
+        "notes": "line one\nline two\ttab \x00\x1f\x7f /slash \u2028\u2029 \x85 \u65e5\u672c",
+        "createdAt": "2026-01-02T03:04:05.678901+00:00",
+    },
+    {
+        "orders": [{"id": "a", "customer": "", "notes": "", "createdAt": "2026-01-02T03:04:05+00:00"}],
+        "nextCursor": None,
+    },
+    {
+        "status": "ok",
+        "orderBuffer": {"size": 1, "bytes": 2**40, "evictions": 0},
+        "sqsPublisher": {"depth": -1},
+        "ratio": 0.25,
+    },
+]
+
+
+def _orjson_matches_stdlib() -> bool:
+    for sample in _SELF_CHECK_SAMPLES:
+        if _orjson_dumps(sample) != _stdlib_dumps(sample):
+            return False
+        if _orjson_dumps_response(sample) != _stdlib_dumps_response(sample):
+            return False
+        if orjson.loads(_orjson_dumps(sample)) != sample:
+            return False
+    return True
+
+
+def _select_backend() -> str:
+    if JSON_SERIALIZER not in ("auto", "orjson", "stdlib"):
+        raise ValueError(f"unknown JSON_SERIALIZER: {JSON_SERIALIZER}")
+    if JSON_SERIALIZER == "stdlib":
+        return "stdlib"
+    if orjson is None:
+        if JSON_SERIALIZER == "orjson":
+            raise ValueError("JSON_SERIALIZER=orjson but orjson is not installed")
+        return "stdlib"
+    if not _orjson_matches_stdlib():
+        logger.warning("orjson output differs from the stdlib encoder; using stdlib")
+        return "stdlib"
+    return "orjson"
+
+
+BACKEND = _select_backend()
+
+_dumps = _orjson_dumps if BACKEND == "orjson" else _stdlib_dumps
+_dumps_response = _orjson_dumps_response if BACKEND == "orjson" else _stdlib_dumps_response
+_loads_impl: Callable[[Buffer], Any] = orjson.loads if BACKEND == "orjson" else _loads
+
+
+def dumps(obj: Any) -> bytes:
+    """Compact UTF-8 JSON in insertion order, for SQS bodies and outbox rows.
+
+    It decodes to what stdlib ``json.dumps`` output decodes to, though with
+    orjson finite floats may be spelled differently and NaN and infinities
+    become ``null``.
+    """
+    return _dumps(obj)
+
+
+def dumps_response(obj: Any, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+    """The body Flask's ``jsonify`` produces (sorted, ASCII-escaped), minus its newline."""
+    return _dumps_response(obj, default)
+
+
+def loads(data: Buffer) -> Any:
+    """Parse str or bytes-like input; orjson reads bytes without decoding to str first."""
+    return _loads_impl(data)
+
+
+class OrdersJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that renders responses with ``dumps_response``.
+
+    Debug-mode indentation and non-default ``sort_keys``/``ensure_ascii``
+    fall back to the stdlib provider.
+    """
+
+    def response(self, *args: Any, **kwargs: Any) -> Any:
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        if not (self.sort_keys and self.ensure_ascii):
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_response(obj, self.default) + b"\n", mimetype=self.mimetype)
+
+    def loads(self, s: Union[str, bytes], **kwargs: Any) -> Any:
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return loads(s)
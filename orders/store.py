@@ -0,0 +1,400 @@
+import base64
+import binascii
+import json
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Iterator, Optional, Protocol
+
+from psycopg2.extras import execute_values
+
+from orders import tracing
+from orders.buffer import OrderBuffer, OrderRecord
+from orders.db import DB_PROXY, ConnectionPool, db_config, max_rows_per_statement
+from orders.notify import ORDERS_CHANNEL, ORDERS_NOTIFY
+from orders.serialization import dumps
+
+logger = logging.getLogger("flexis-orders.store")
+
+ORDER_STORE = os.getenv("ORDER_STORE", "").lower()
+# "outbox" writes an order_outbox row in the order's transaction instead of
+# publishing from the request; see orders.relay
+ORDER_PUBLISH_MODE = os.getenv("ORDER_PUBLISH_MODE", "direct").lower()
+
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", "1000"))
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = int(os.getenv("ORDERS_MAX_PAGE_SIZE", "100"))
+
+# Every process checks the catalog at start and issues only the DDL for
+# objects that are missing: even a no-op CREATE INDEX IF NOT EXISTS or
+# ALTER TABLE takes a table lock, which queues behind the relay's open
+# transactions and blocks inserts until they finish.
+SCHEMA_LOCK_TIMEOUT = os.getenv("SCHEMA_LOCK_TIMEOUT", "5s")
+
+# (existence check, DDL); the check returns NULL or no row when the object is missing
+SCHEMA_STEPS = [
+    (
+        "SELECT to_regclass('orders')",
+        """
+    CREATE TABLE IF NOT EXISTS orders (
+        id uuid PRIMARY KEY,
+        customer text NOT NULL,
+        notes text NOT NULL DEFAULT '',
+        created_at timestamptz NOT NULL
+    )
+    """,
+    ),
+    # keyset pagination walks this index backwards; never OFFSET
+    (
+        "SELECT to_regclass('orders_created_at_id_idx')",
+        """
+    CREATE INDEX IF NOT EXISTS orders_created_at_id_idx
+        ON orders (created_at DESC, id DESC)
+    """,
+    ),
+    (
+        "SELECT to_regclass('order_outbox')",
+        """
+    CREATE TABLE IF NOT EXISTS order_outbox (
+        id bigserial PRIMARY KEY,
+        order_id uuid NOT NULL,
+        payload text NOT NULL,
+        traceparent text,
+        created_at timestamptz NOT NULL DEFAULT now(),
+        attempts integer NOT NULL DEFAULT 0,
+        dead_at timestamptz
+    )
+    """,
+    ),
+    # the request's trace context, so the relay's publish joins its trace;
+    # for outbox tables created before the column existed
+    (
+        "SELECT 1 FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = 'order_outbox' AND column_name = 'traceparent'",
+        "ALTER TABLE order_outbox ADD COLUMN IF NOT EXISTS traceparent text",
+    ),
+    # failed sends; rows SQS keeps rejecting are dead-lettered in place
+    (
+        "SELECT 1 FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = 'order_outbox' AND column_name = 'dead_at'",
+        "ALTER TABLE order_outbox "
+        "ADD COLUMN IF NOT EXISTS attempts integer NOT NULL DEFAULT 0, "
+        "ADD COLUMN IF NOT EXISTS dead_at timestamptz",
+    ),
+    # relays scan pending rows in id order without wading through dead ones
+    (
+        "SELECT to_regclass('order_outbox_pending_idx')",
+        "CREATE INDEX IF NOT EXISTS order_outbox_pending_idx ON order_outbox (id) WHERE dead_at IS NULL",
+    ),
+]
+
+# (createdAt, id) of the last order on the previous page
+PageKey = tuple[datetime, str]
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(order: dict[str, Any]) -> str:
+    raw = json.dumps([order["createdAt"], order["id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> PageKey:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        created_at, order_id = json.loads(raw)
+        if not isinstance(order_id, str):
+            raise TypeError("cursor id is not a string")
+        # a malformed id would otherwise fail the ::uuid cast and answer 500
+        key = (datetime.fromisoformat(created_at), str(uuid.UUID(order_id)))
+    except (binascii.Error, ValueError, TypeError) as exc:
+        raise InvalidCursor("invalid cursor") from exc
+    if key[0].tzinfo is None:
+        raise InvalidCursor("invalid cursor")
+    return key
+
+
+class OrderStore(Protocol):
+    # bumped after every write this process makes; never decreases
+    version: int
+
+    def add(self, order: dict[str, Any]) -> None:
+        """Insert one order; an id that already exists is a no-op and bumps nothing."""
+        ...
+
+    def add_many(self, orders: list[dict[str, Any]], *, publish: bool = False) -> list[str]:
+        """Idempotent bulk insert; orders whose id already exists are skipped.
+
+        Returns the ids actually inserted. ``publish`` also queues the
+        inserted orders in the outbox when the store is in outbox mode.
+        """
+        ...
+
+    def page(
+        self, limit: int, after: Optional[PageKey] = None, *, consistent: bool = False
+    ) -> tuple[list[dict[str, Any]], bool]:
+        """Newest-first orders strictly older than ``after``, plus a has-more flag.
+
+        ``consistent`` reads from the writer instead of a replica.
+        """
+        ...
+
+    def export(
+        self, since: Optional[datetime] = None, fetch_size: int = EXPORT_FETCH_SIZE
+    ) -> Iterator[list[dict[str, Any]]]:
+        """Oldest-first batches of up to ``fetch_size`` orders created at or after ``since``."""
+        ...
+
+
+def _order_to_row(order: dict[str, Any]) -> tuple[Any, ...]:
+    return (
+        order["id"],
+        order["customer"],
+        order["notes"],
+        datetime.fromisoformat(order["createdAt"]),
+    )
+
+
+def _row_to_order(row: tuple[Any, ...]) -> dict[str, Any]:
+    order_id, customer, notes, created_at = row
+    return {
+        "id": str(order_id),
+        "customer": customer,
+        "notes": notes,
+        "createdAt": created_at.astimezone(timezone.utc).isoformat(),
+    }
+
+
+class VersionCounter:
+    def __init__(self) -> None:
+        self.version = 0
+        self._version_lock = threading.Lock()
+
+    def bump_version(self) -> None:
+        with self._version_lock:
+            self.version += 1
+
+
+class MemoryOrderStore(VersionCounter):
+    def __init__(self, buffer: Optional[OrderBuffer] = None) -> None:
+        super().__init__()
+        # an empty buffer is falsy
+        self.buffer = buffer if buffer is not None else OrderBuffer()
+
+    def add(self, order: dict[str, Any]) -> None:
+        if self.buffer.append(OrderRecord.from_order(order)):
+            self.bump_version()
+
+    def add_many(self, orders: list[dict[str, Any]], *, publish: bool = False) -> list[str]:
+        inserted = [order["id"] for order in orders if self.buffer.append(OrderRecord.from_order(order))]
+        if inserted:
+            self.bump_version()
+        return inserted
+
+    def page(
+        self, limit: int, after: Optional[PageKey] = None, *, consistent: bool = False
+    ) -> tuple[list[dict[str, Any]], bool]:
+        records, has_more = self.buffer.page(limit, after)
+        return [record.to_dict() for record in records], has_more
+
+    def export(
+        self, since: Optional[datetime] = None, fetch_size: int = EXPORT_FETCH_SIZE
+    ) -> Iterator[list[dict[str, Any]]]:
+        records = self.buffer.since(since)
+        for start in range(0, len(records), fetch_size):
+            yield [record.to_dict() for record in records[start:start + fetch_size]]
+
+    def stats(self) -> dict[str, int]:
+        return self.buffer.stats()
+
+
+class PostgresOrderStore(VersionCounter):
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        *,
+        reader_pool: Optional[ConnectionPool] = None,
+        export_pool: Optional[ConnectionPool] = None,
+        outbox: bool = False,
+        notify: bool = ORDERS_NOTIFY,
+    ) -> None:
+        super().__init__()
+        self.pool = pool
+        self.reader_pool = reader_pool or pool
+        self.export_pool = export_pool or self.reader_pool
+        if self.export_pool is pool:
+            warn_export_pinning()
+        self.outbox = outbox
+        self.notify = notify
+
+    def ensure_schema(self) -> None:
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            missing = []
+            for check, ddl in SCHEMA_STEPS:
+                cur.execute(check)
+                row = cur.fetchone()
+                if row is None or row[0] is None:
+                    missing.append(ddl)
+            if missing:
+                # fail the start-up rather than stall writes behind a long lock wait
+                cur.execute("SELECT set_config('lock_timeout', %s, true)", (SCHEMA_LOCK_TIMEOUT,))
+                for ddl in missing:
+                    cur.execute(ddl)
+
+    def add(self, order: dict[str, Any]) -> None:
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO orders (id, customer, notes, created_at) VALUES (%s, %s, %s, %s) "
+                "ON CONFLICT (id) DO NOTHING",
+                _order_to_row(order),
+            )
+            if cur.rowcount == 0:
+                # already stored; nothing changed, so nothing to publish or invalidate
+                return
+            if self.outbox:
+                cur.execute(
+                    "INSERT INTO order_outbox (order_id, payload, traceparent) VALUES (%s, %s, %s)",
+                    (order["id"], dumps(order).decode(), tracing.current_traceparent()),
+                )
+            if self.notify:
+                cur.execute(f'NOTIFY "{ORDERS_CHANNEL}"')
+        # after commit, so a reader that sees the new version sees the row
+        self.bump_version()
+
+    def add_many(self, orders: list[dict[str, Any]], *, publish: bool = False) -> list[str]:
+        if not orders:
+            return []
+        rows = [_order_to_row(order) for order in orders]
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            inserted = [
+                str(row[0])
+                for row in execute_values(
+                    cur,
+                    "INSERT INTO orders (id, customer, notes, created_at) VALUES %s "
+                    "ON CONFLICT (id) DO NOTHING RETURNING id",
+                    rows,
+                    page_size=max_rows_per_statement(len(rows)),
+                    fetch=True,
+                )
+            ]
+            if publish and self.outbox and inserted:
+                new = set(inserted)
+                outbox_rows = []
+                traceparent = tracing.current_traceparent()
+                for order in orders:
+                    if order["id"] in new:
+                        new.discard(order["id"])
+                        outbox_rows.append((order["id"], dumps(order).decode(), traceparent))
+                execute_values(
+                    cur,
+                    "INSERT INTO order_outbox (order_id, payload, traceparent) VALUES %s",
+                    outbox_rows,
+                    page_size=max_rows_per_statement(len(outbox_rows)),
+                )
+            # ON CONFLICT no-ops (redelivered or re-consumed orders) must not
+            # invalidate every task's page cache
+            if self.notify and inserted:
+                cur.execute(f'NOTIFY "{ORDERS_CHANNEL}"')
+        if inserted:
+            self.bump_version()
+        return inserted
+
+    def page(
+        self, limit: int, after: Optional[PageKey] = None, *, consistent: bool = False
+    ) -> tuple[list[dict[str, Any]], bool]:
+        pool = self.pool if consistent else self.reader_pool
+        with pool.connection() as conn, conn.cursor() as cur:
+            if after is None:
+                cur.execute(
+                    "SELECT id, customer, notes, created_at FROM orders "
+                    "ORDER BY created_at DESC, id DESC LIMIT %s",
+                    (limit + 1,),
+                )
+            else:
+                cur.execute(
+                    "SELECT id, customer, notes, created_at FROM orders "
+                    "WHERE (created_at, id) < (%s, %s::uuid) "
+                    "ORDER BY created_at DESC, id DESC LIMIT %s",
+                    (after[0], after[1], limit + 1),
+                )
+            rows = cur.fetchall()
+        return [_row_to_order(row) for row in rows[:limit]], len(rows) > limit
+
+    def export(
+        self, since: Optional[datetime] = None, fetch_size: int = EXPORT_FETCH_SIZE
+    ) -> Iterator[list[dict[str, Any]]]:
+        """Stream orders through a named (server-side) cursor on the export pool.
+
+        Postgres keeps the result set; each batch is one FETCH, so memory
+        stays flat however many rows match. The connection is held until
+        the generator is exhausted or closed. The export pool is the reader
+        pool, else a direct pool behind RDS Proxy (see ``export_config``),
+        else the writer pool.
+        """
+        with self.export_pool.connection() as conn, conn.cursor(name="orders_export") as cur:
+            if since is None:
+                cur.execute(
+                    "SELECT id, customer, notes, created_at FROM orders "
+                    "ORDER BY created_at, id"
+                )
+            else:
+                cur.execute(
+                    "SELECT id, customer, notes, created_at FROM orders "
+                    "WHERE created_at >= %s ORDER BY created_at, id",
+                    (since,),
+                )
+            while True:
+                rows = cur.fetchmany(fetch_size)
+                if not rows:
+                    return
+                yield [_row_to_order(row) for row in rows]
+
+
+def warn_export_pinning() -> None:
+    if DB_PROXY:
+        logger.warning(
+            "exports share the RDS Proxy pool; each one pins a proxy connection while it streams. "
+            "Set DB_READER_HOST or DB_DIRECT_HOST to move them off the proxy"
+        )
+
+
+def create_store(
+    pool: Optional[ConnectionPool] = None,
+    reader_pool: Optional[ConnectionPool] = None,
+    export_pool: Optional[ConnectionPool] = None,
+) -> OrderStore:
+    mode = ORDER_STORE or ("postgres" if pool is not None else "memory")
+    if ORDER_PUBLISH_MODE not in ("direct", "outbox"):
+        raise ValueError(f"unknown ORDER_PUBLISH_MODE: {ORDER_PUBLISH_MODE}")
+    if ORDER_PUBLISH_MODE == "outbox" and mode != "postgres":
+        raise ValueError("ORDER_PUBLISH_MODE=outbox requires the postgres order store")
+
+    if mode == "memory":
+        logger.info("using in-memory order store")
+        return MemoryOrderStore()
+    if mode != "postgres":
+        raise ValueError(f"unknown ORDER_STORE: {mode}")
+
+    if pool is None:
+        cfg = db_config()
+        if not cfg or not cfg.get("password"):
+            raise ValueError("ORDER_STORE=postgres requires DB_HOST and DB_PASSWORD")
+        pool = ConnectionPool(cfg)
+
+    store = PostgresOrderStore(
+        pool,
+        reader_pool=reader_pool,
+        export_pool=export_pool,
+        outbox=ORDER_PUBLISH_MODE == "outbox",
+    )
+    try:
+        store.ensure_schema()
+    except Exception:
+        logger.exception("failed to ensure orders schema")
+    logger.info("using postgres order store (publish mode: %s)", ORDER_PUBLISH_MODE)
+    return store
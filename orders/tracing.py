@@ -0,0 +1,392 @@
+import contextlib
+import contextvars
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from typing import Any, ContextManager, Iterator, NamedTuple, Optional
+
+from orders.serialization import dumps
+
+logger = logging.getLogger("flexis-orders.tracing")
+
+# "otlp" posts OTLP/JSON to a collector, "file" appends it to TRACE_DIR; unset disables tracing
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "").lower()
+TRACE_ENABLED = TRACE_EXPORTER in ("otlp", "file")
+# share of new traces recorded; a sampled traceparent from upstream is always honoured
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+TRACE_SERVICE = os.getenv("OTEL_SERVICE_NAME") or os.getenv("EMF_SERVICE", "orders-api")
+OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4318").rstrip("/")
+TRACE_DIR = os.getenv("TRACE_DIR", "traces")
+# finished spans waiting for the exporter thread; beyond this they are dropped
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "10000"))
+TRACE_BATCH_SIZE = int(os.getenv("TRACE_BATCH_SIZE", "512"))
+TRACE_FLUSH_SECONDS = float(os.getenv("TRACE_FLUSH_SECONDS", "2"))
+
+# OTLP span kinds
+INTERNAL, SERVER, CLIENT, PRODUCER, CONSUMER = 1, 2, 3, 4, 5
+
+# SQS message attributes carrying the producer's context and the send time (epoch ms)
+TRACEPARENT_ATTRIBUTE = "traceparent"
+SENT_AT_ATTRIBUTE = "sentAt"
+MESSAGE_ATTRIBUTE_NAMES = [TRACEPARENT_ATTRIBUTE, SENT_AT_ATTRIBUTE]
+
+
+class SpanContext(NamedTuple):
+    trace_id: int
+    span_id: int
+    sampled: bool
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id:032x}-{self.span_id:016x}-{'01' if self.sampled else '00'}"
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[SpanContext]:
+    """W3C ``traceparent`` header value to a context; None when malformed."""
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) < 4 or parts[0] == "ff" or [len(p) for p in parts[:4]] != [2, 32, 16, 2]:
+        return None
+    try:
+        trace_id, span_id, flags = int(parts[1], 16), int(parts[2], 16), int(parts[3], 16)
+    except ValueError:
+        return None
+    if not trace_id or not span_id:
+        return None
+    return SpanContext(trace_id, span_id, bool(flags & 1))
+
+
+class Span:
+    """One timed operation; exported when ended if its trace is sampled."""
+
+    __slots__ = ("name", "kind", "context", "parent_id", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(
+        self,
+        name: str,
+        kind: int,
+        context: SpanContext,
+        parent_id: int,
+        start_ns: int,
+        attributes: dict[str, Any],
+    ) -> None:
+        self.name = name
+        self.kind = kind
+        self.context = context
+        self.parent_id = parent_id
+        self.start_ns = start_ns
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    def traceparent(self) -> str:
+        return self.context.traceparent()
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_error(self, message: str) -> None:
+        self.error = message
+
+    def end(self, end_ns: Optional[int] = None) -> None:
+        if self.end_ns is not None:
+            return
+        self.end_ns = end_ns or time.time_ns()
+        if self.context.sampled and _exporter is not None and _exporter_pid == os.getpid():
+            _exporter.export(self)
+
+
+class _NoopSpan(Span):
+    """The span handed out while tracing is off: one shared instance that records nothing."""
+
+    __slots__ = ()
+
+    def __init__(self) -> None:
+        super().__init__("", INTERNAL, SpanContext(0, 0, False), 0, 0, {})
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_error(self, message: str) -> None:
+        pass
+
+    def end(self, end_ns: Optional[int] = None) -> None:
+        pass
+
+    def __enter__(self) -> Span:
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        pass
+
+
+NOOP_SPAN: Span = _NoopSpan()
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("flexis_span", default=None)
+_CURRENT: Any = object()
+
+
+def start_span(
+    name: str,
+    *,
+    kind: int = INTERNAL,
+    parent: Any = _CURRENT,
+    attributes: Optional[dict[str, Any]] = None,
+    start_ns: Optional[int] = None,
+) -> Span:
+    """Start a span under ``parent``: the current span by default, a Span,
+    a SpanContext, or None for a new trace. Returns ``NOOP_SPAN`` while
+    tracing is off."""
+    if not TRACE_ENABLED:
+        return NOOP_SPAN
+    if parent is _CURRENT:
+        parent = _current.get()
+    if isinstance(parent, Span):
+        parent = parent.context
+    if parent is not None:
+        context = SpanContext(parent.trace_id, random.getrandbits(64) or 1, parent.sampled)
+        parent_id = parent.span_id
+    else:
+        sampled = TRACE_ENABLED and random.random() < TRACE_SAMPLE_RATE
+        context = SpanContext(random.getrandbits(128) or 1, random.getrandbits(64) or 1, sampled)
+        parent_id = 0
+    return Span(name, kind, context, parent_id, start_ns or time.time_ns(), dict(attributes or {}))
+
+
+def activate(span: Span) -> contextvars.Token:
+    return _current.set(span)
+
+
+def deactivate(token: contextvars.Token) -> None:
+    _current.reset(token)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def current_traceparent() -> Optional[str]:
+    span = _current.get()
+    return span.traceparent() if span is not None and TRACE_ENABLED else None
+
+
+def span(name: str, **kwargs: Any) -> ContextManager[Span]:
+    """Run the block as the current span, marking it failed if the block raises."""
+    if not TRACE_ENABLED:
+        return NOOP_SPAN
+    return _span(name, **kwargs)
+
+
+@contextlib.contextmanager
+def _span(name: str, **kwargs: Any) -> Iterator[Span]:
+    current = start_span(name, **kwargs)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as exc:
+        current.set_error(repr(exc))
+        raise
+    finally:
+        _current.reset(token)
+        current.end()
+
+
+def message_attributes(traceparent: Optional[str]) -> dict[str, Any]:
+    """SQS ``MessageAttributes`` for one entry, stamped with the send time."""
+    if not TRACE_ENABLED:
+        return {}
+    attributes = {SENT_AT_ATTRIBUTE: {"DataType": "Number", "StringValue": str(time.time_ns() // 1_000_000)}}
+    if traceparent:
+        attributes[TRACEPARENT_ATTRIBUTE] = {"DataType": "String", "StringValue": traceparent}
+    return attributes
+
+
+def consume_span(message: dict[str, Any], received_ns: int) -> Span:
+    """Record the message's time in the queue and start its processing span.
+
+    The queue span runs from the producer's ``sentAt`` to ``received_ns``;
+    the returned span starts now, so the gap between the two is the wait
+    for a handler thread.
+    """
+    if not TRACE_ENABLED:
+        return NOOP_SPAN
+    attributes = message.get("MessageAttributes") or {}
+    parent = parse_traceparent(attributes.get(TRACEPARENT_ATTRIBUTE, {}).get("StringValue"))
+    try:
+        sent_ns: Optional[int] = int(attributes[SENT_AT_ATTRIBUTE]["StringValue"]) * 1_000_000
+    except (KeyError, TypeError, ValueError):
+        sent_ns = None
+    message_id = message.get("MessageId")
+    if sent_ns is not None and sent_ns < received_ns:
+        dwell = start_span(
+            "orders queue",
+            kind=CONSUMER,
+            parent=parent,
+            attributes={"messaging.system": "aws_sqs", "messaging.message.id": message_id},
+            start_ns=sent_ns,
+        )
+        dwell.end(received_ns)
+        parent = dwell
+    processing = start_span(
+        "orders process",
+        kind=CONSUMER,
+        parent=parent,
+        attributes={"messaging.system": "aws_sqs", "messaging.message.id": message_id},
+    )
+    if sent_ns is not None:
+        processing.set_attribute("messaging.queue_ms", max(received_ns - sent_ns, 0) / 1e6)
+    return processing
+
+
+def _attribute(key: str, value: Any) -> dict[str, Any]:
+    if isinstance(value, bool):
+        encoded: dict[str, Any] = {"boolValue": value}
+    elif isinstance(value, int):
+        encoded = {"intValue": str(value)}
+    elif isinstance(value, float):
+        encoded = {"doubleValue": value}
+    else:
+        encoded = {"stringValue": str(value)}
+    return {"key": key, "value": encoded}
+
+
+def encode_spans(spans: list[Span], service: str = TRACE_SERVICE) -> bytes:
+    """An OTLP/JSON ``ExportTraceServiceRequest``."""
+    encoded = []
+    for s in spans:
+        item: dict[str, Any] = {
+            "traceId": f"{s.context.trace_id:032x}",
+            "spanId": f"{s.context.span_id:016x}",
+            "name": s.name,
+            "kind": s.kind,
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.end_ns),
+            "attributes": [_attribute(k, v) for k, v in s.attributes.items() if v is not None],
+            "status": {"code": 2, "message": s.error} if s.error is not None else {},
+        }
+        if s.parent_id:
+            item["parentSpanId"] = f"{s.parent_id:016x}"
+        encoded.append(item)
+    return dumps(
+        {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [_attribute("service.name", service), _attribute("process.pid", os.getpid())]
+                    },
+                    "scopeSpans": [{"scope": {"name": "flexis-orders"}, "spans": encoded}],
+                }
+            ]
+        }
+    )
+
+
+class SpanExporter:
+    """Ships finished spans from a background thread as OTLP/JSON.
+
+    ``export`` never blocks: when the queue is full the span is dropped and
+    counted. ``otlp`` posts each batch to ``{endpoint}/v1/traces``;
+    ``file`` appends it as one line to a per-process file, the layout the
+    collector's ``otlpjsonfile`` receiver reads back.
+    """
+
+    def __init__(
+        self,
+        kind: str = TRACE_EXPORTER,
+        *,
+        endpoint: str = OTLP_ENDPOINT,
+        directory: str = TRACE_DIR,
+        max_queue: int = TRACE_QUEUE_SIZE,
+        batch_size: int = TRACE_BATCH_SIZE,
+        interval: float = TRACE_FLUSH_SECONDS,
+    ) -> None:
+        self.kind = kind
+        self.url = f"{endpoint}/v1/traces"
+        self.path = os.path.join(directory, f"traces-{os.getpid()}.jsonl")
+        self.batch_size = max(1, batch_size)
+        self.interval = interval
+        self.dropped = 0
+        self._queue: queue.Queue[Span] = queue.Queue(max_queue)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        if kind == "file":
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, span: Span) -> None:
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write(self, spans: list[Span]) -> None:
+        body = encode_spans(spans)
+        try:
+            if self.kind == "file":
+                with open(self.path, "ab") as f:
+                    f.write(body + b"\n")
+            else:
+                request = urllib.request.Request(
+                    self.url, data=body, headers={"Content-Type": "application/json"}, method="POST"
+                )
+                with urllib.request.urlopen(request, timeout=5) as response:
+                    response.read()
+        except Exception:
+            logger.warning("failed to export %d spans", len(spans), exc_info=True)
+
+    def _collect(self) -> list[Span]:
+        batch: list[Span] = []
+        deadline = time.monotonic() + self.interval
+        while len(batch) < self.batch_size and not self._stop.is_set():
+            try:
+                batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self) -> None:
+        while not self._stop.is_set():
+            batch = self._collect()
+            if batch:
+                self._write(batch)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        batch: list[Span] = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        for start in range(0, len(batch), self.batch_size):
+            self._write(batch[start:start + self.batch_size])
+
+
+_exporter: Optional[SpanExporter] = None
+_exporter_pid: Optional[int] = None
+
+
+def start() -> Optional[SpanExporter]:
+    """Start this process's exporter thread when TRACE_EXPORTER is set; idempotent."""
+    global _exporter, _exporter_pid
+    if not TRACE_ENABLED or _exporter_pid == os.getpid():
+        return _exporter
+    # a forked child gets its own queue and file rather than the parent's
+    _exporter = SpanExporter()
+    _exporter_pid = os.getpid()
+    _exporter.start()
+    return _exporter
+
+
+def stop() -> None:
+    if _exporter is not None and _exporter_pid == os.getpid():
+        _exporter.stop()
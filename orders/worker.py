@@ -0,0 +1,93 @@
+import logging
+import os
+import signal
+import sys
+import threading
+from typing import Any
+
+import boto3
+
+from orders import emf, metrics, profiling, tracing
+from orders.consumer import SQS_HANDLER_THREADS, SqsConsumer, persist_orders
+from orders.db import ConnectionPool, db_config
+from orders.logs import configure_logging
+from orders.relay import OUTBOX_RELAY_THREADS, OutboxRelay, start_relays
+from orders.store import PostgresOrderStore, create_store
+
+logger = logging.getLogger("flexis-orders.worker")
+
+SQS_QUEUE_URL = os.getenv("SQS_QUEUE_URL")
+SQS_ENDPOINT_URL = os.getenv("SQS_ENDPOINT_URL")
+WORKER_POLLERS = int(os.getenv("WORKER_POLLERS", "1"))
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", str(SQS_HANDLER_THREADS)))
+WORKER_SHUTDOWN_SECONDS = float(os.getenv("WORKER_SHUTDOWN_SECONDS", "30"))
+# serves /metrics when set; the worker has no web app of its own
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "0"))
+
+
+def main() -> int:
+    configure_logging()
+
+    if not SQS_QUEUE_URL:
+        logger.error("SQS_QUEUE_URL is not set; nothing to consume")
+        return 1
+
+    cfg = db_config()
+    store = None
+    if cfg and cfg.get("password"):
+        # one connection per handler and relay thread; nothing waits on the pool
+        pool = ConnectionPool(cfg, maxsize=max(1, WORKER_CONCURRENCY) + OUTBOX_RELAY_THREADS)
+        store = create_store(pool)
+    else:
+        logger.warning("no database configured; received orders will only be logged")
+
+    client = boto3.client("sqs", endpoint_url=SQS_ENDPOINT_URL)
+    consumer = SqsConsumer(
+        client,
+        SQS_QUEUE_URL,
+        concurrency=WORKER_CONCURRENCY,
+        batch_handler=persist_orders(store) if isinstance(store, PostgresOrderStore) else None,
+    )
+
+    relays: list[OutboxRelay] = []
+    if isinstance(store, PostgresOrderStore) and store.outbox:
+        relays = start_relays(store.pool, client, SQS_QUEUE_URL)
+
+    if WORKER_METRICS_PORT:
+        metrics.serve(WORKER_METRICS_PORT)
+    emf.start()
+    tracing.start()
+
+    stop = threading.Event()
+
+    def request_stop(signum: int, _frame: Any) -> None:
+        logger.info("received signal %d, shutting down", signum)
+        stop.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    profiling.install_signal_handler()
+
+    pollers = [
+        threading.Thread(target=consumer.run, name=f"sqs-poller-{i}", daemon=True)
+        for i in range(max(1, WORKER_POLLERS))
+    ]
+    for thread in pollers:
+        thread.start()
+    logger.info(
+        "order worker started with %d pollers and %d handler threads",
+        len(pollers),
+        WORKER_CONCURRENCY,
+    )
+
+    stop.wait()
+    for relay in relays:
+        relay.stop()
+    consumer.stop(WORKER_SHUTDOWN_SECONDS)
+    emf.stop()
+    tracing.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""Closed-loop load test for comparing SERVING_MODE=sync and async.
+
+Each target is ``URL`` or ``URL@PID``. With a PID (the gunicorn master), the
+CPU time used by that process and its workers is read from /proc so the
+result can be reported as requests per CPU-second.
+
+    SERVING_MODE=sync  PORT=8080 gunicorn -c gunicorn.conf.py &
+    SERVING_MODE=async PORT=8081 gunicorn -c gunicorn.conf.py &
+    python scripts/bench_serving.py http://localhost:8080@<pid> http://localhost:8081@<pid> \\
+        --concurrency 256 --duration 30 --write-ratio 0.2
+
+Run both servers with the same GUNICORN_WORKERS (or the same CPU limit)
+against the same Postgres and SQS; with the in-memory store nothing waits
+on I/O and the two modes look alike.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlsplit
+
+
+def process_tree_cpu_seconds(pid: int) -> float:
+    ticks = os.sysconf("SC_CLK_TCK")
+    total = 0.0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            stat = Path(f"/proc/{current}/stat").read_text()
+        except OSError:
+            continue
+        # fields after the parenthesised command name: utime, stime, cutime and
+        # cstime (14-17); the c* pair covers workers that have already exited
+        fields = stat.rsplit(")", 1)[1].split()
+        total += sum(int(value) for value in fields[11:15]) / ticks
+        for task in Path(f"/proc/{current}/task").glob("*/children"):
+            pending.extend(int(child) for child in task.read_text().split())
+    return total
+
+
+async def request(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    host: str,
+    method: str,
+    path: str,
+    body: bytes = b"",
+) -> int:
+    head = f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nConnection: keep-alive\r\n"
+    if body:
+        head += f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+    writer.write(head.encode() + b"\r\n" + body)
+    await writer.drain()
+
+    status_line = await reader.readuntil(b"\r\n")
+    status = int(status_line.split()[1])
+    length = 0
+    while True:
+        line = await reader.readuntil(b"\r\n")
+        if line == b"\r\n":
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+async def client(
+    url: str,
+    deadline: float,
+    write_ratio: float,
+    latencies: list[float],
+    errors: list[str],
+) -> None:
+    parts = urlsplit(url)
+    host = parts.hostname or "localhost"
+    port = parts.port or 80
+    conn: Optional[tuple[asyncio.StreamReader, asyncio.StreamWriter]] = None
+    while time.monotonic() < deadline:
+        if random.random() < write_ratio:
+            method, path = "POST", "/api/orders"
+            body = json.dumps({"customer": "bench", "notes": "load test"}).encode()
+        else:
+            method, path, body = "GET", "/api/orders?limit=20", b""
+        started = time.perf_counter()
+        try:
+            if conn is None:
+                conn = await asyncio.open_connection(host, port)
+            status = await request(*conn, parts.netloc, method, path, body)
+        except (OSError, asyncio.IncompleteReadError, ValueError) as exc:
+            errors.append(type(exc).__name__)
+            if conn is not None:
+                conn[1].close()
+            conn = None
+            await asyncio.sleep(0.05)
+            continue
+        latencies.append(time.perf_counter() - started)
+        if status >= 400:
+            errors.append(str(status))
+    if conn is not None:
+        conn[1].close()
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))]
+
+
+async def run_target(target: str, concurrency: int, duration: float, write_ratio: float) -> dict[str, object]:
+    url, _, pid = target.partition("@")
+    latencies: list[float] = []
+    errors: list[str] = []
+    cpu_before = process_tree_cpu_seconds(int(pid)) if pid else None
+    started = time.monotonic()
+    deadline = started + duration
+    await asyncio.gather(
+        *(client(url, deadline, write_ratio, latencies, errors) for _ in range(concurrency))
+    )
+    elapsed = time.monotonic() - started
+    cpu = process_tree_cpu_seconds(int(pid)) - cpu_before if cpu_before is not None else None
+
+    latencies.sort()
+    return {
+        "target": url,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p90_ms": percentile(latencies, 90) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "cpu_s": cpu,
+        "req_per_cpu_s": len(latencies) / cpu if cpu else None,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("targets", nargs="+", help="URL or URL@PID of each server to compare")
+    parser.add_argument("--concurrency", type=int, default=64, help="simultaneous keep-alive clients")
+    parser.add_argument("--duration", type=float, default=20, help="seconds per target")
+    parser.add_argument("--warmup", type=float, default=3, help="unmeasured seconds per target")
+    parser.add_argument("--write-ratio", type=float, default=0.2, help="share of requests that POST an order")
+    parser.add_argument("--json", action="store_true", help="print results as JSON lines")
+    args = parser.parse_args()
+
+    results = []
+    for target in args.targets:
+        if args.warmup > 0:
+            asyncio.run(run_target(target, args.concurrency, args.warmup, args.write_ratio))
+        results.append(asyncio.run(run_target(target, args.concurrency, args.duration, args.write_ratio)))
+
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+        return
+
+    print(f"{'target':<32} {'reqs':>8} {'errors':>7} {'req/s':>9} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'req/cpu-s':>10}")
+    for r in results:
+        per_cpu = f"{r['req_per_cpu_s']:.0f}" if r["req_per_cpu_s"] else "-"
+        print(
+            f"{r['target']:<32} {r['requests']:>8} {r['errors']:>7} {r['rps']:>9.1f} "
+            f"{r['p50_ms']:>8.1f} {r['p90_ms']:>8.1f} {r['p99_ms']:>8.1f} {per_cpu:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+from typing import Any
+
+from orders.consumer import persist_orders
+from orders.publisher import PERSISTED_ATTRIBUTE
+from orders.serialization import dumps
+from orders.store import MemoryOrderStore
+
+
+def message(order_id: str, *, persisted: bool = False) -> dict[str, Any]:
+    body = {"id": order_id, "customer": "c", "notes": "", "createdAt": "2024-01-01T00:00:00+00:00"}
+    msg: dict[str, Any] = {"MessageId": order_id, "Body": dumps(body).decode()}
+    if persisted:
+        msg["MessageAttributes"] = {PERSISTED_ATTRIBUTE: {"DataType": "String", "StringValue": "true"}}
+    return msg
+
+
+class CountingStore(MemoryOrderStore):
+    def __init__(self) -> None:
+        super().__init__()
+        self.calls = 0
+
+    def add_many(self, orders: list[dict[str, Any]], *, publish: bool = False) -> list[str]:
+        self.calls += 1
+        return super().add_many(orders, publish=publish)
+
+
+def test_persisted_messages_skip_the_insert() -> None:
+    store = CountingStore()
+    handle = persist_orders(store)
+    ids = [f"00000000-0000-4000-8000-00000000000{i}" for i in range(3)]
+
+    assert handle([message(order_id, persisted=True) for order_id in ids]) == []
+    assert (store.calls, store.version) == (0, 0)
+
+    assert handle([message(ids[0]), message(ids[1], persisted=True)]) == []
+    assert store.calls == 1
+    assert [order["id"] for order in store.page(10)[0]] == [ids[0]]
+
+
+def test_malformed_messages_fail() -> None:
+    bad = {"MessageId": "bad", "Body": "{"}
+    assert persist_orders(CountingStore())([bad]) == [bad]
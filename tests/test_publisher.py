@@ -0,0 +1,151 @@
+from typing import Any, Iterator
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from orders import publisher
+from orders.publisher import PERSISTED_ATTRIBUTE, SqsPublisher, message_size, send_batch, split_batches
+from orders.serialization import dumps, loads
+
+
+class FlakyClient:
+    """moto's SQS client, recording each batch and failing the entries in ``failures``.
+
+    ``failures`` maps a message body to one SenderFault flag per attempt
+    that should fail.
+    """
+
+    def __init__(self, client: Any) -> None:
+        self.client = client
+        self.batches: list[list[dict[str, Any]]] = []
+        self.failures: dict[str, list[bool]] = {}
+
+    def send_message_batch(self, QueueUrl: str, Entries: list[dict[str, Any]]) -> dict[str, Any]:
+        self.batches.append(Entries)
+        passed, failed = [], []
+        for entry in Entries:
+            faults = self.failures.get(entry["MessageBody"])
+            if faults:
+                sender_fault = faults.pop(0)
+                failed.append({"Id": entry["Id"], "SenderFault": sender_fault, "Code": "Injected", "Message": "test"})
+            else:
+                passed.append(entry)
+        response: dict[str, Any] = {"Successful": []}
+        if passed:
+            response = self.client.send_message_batch(QueueUrl=QueueUrl, Entries=passed)
+        response["Failed"] = response.get("Failed", []) + failed
+        return response
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.client, name)
+
+
+@pytest.fixture
+def sqs(monkeypatch: pytest.MonkeyPatch) -> Iterator[tuple[FlakyClient, str]]:
+    monkeypatch.setattr(publisher.time, "sleep", lambda seconds: None)
+    with mock_aws():
+        client = boto3.client("sqs", region_name="us-east-1")
+        queue_url = client.create_queue(QueueName="orders")["QueueUrl"]
+        yield FlakyClient(client), queue_url
+
+
+def received(client: FlakyClient, queue_url: str) -> list[dict[str, Any]]:
+    messages = []
+    while True:
+        batch = client.receive_message(
+            QueueUrl=queue_url, MaxNumberOfMessages=10, MessageAttributeNames=["All"]
+        ).get("Messages", [])
+        if not batch:
+            return messages
+        messages.extend(batch)
+
+
+def bodies(n: int, size: int = 0) -> list[bytes]:
+    return [dumps({"id": str(i), "notes": "x" * size}) for i in range(n)]
+
+
+def assert_within_limits(batches: list[list[dict[str, Any]]]) -> None:
+    for entries in batches:
+        assert 1 <= len(entries) <= 10
+        assert sum(message_size(entry["MessageBody"].encode()) for entry in entries) <= 256 * 1024
+
+
+def test_split_batches_caps_entries_at_ten(sqs: tuple[FlakyClient, str]) -> None:
+    client, queue_url = sqs
+    batches = split_batches(bodies(25))
+    assert [len(batch) for batch in batches] == [10, 10, 5]
+
+    for batch in batches:
+        assert send_batch(client, queue_url, batch) == []
+    assert_within_limits(client.batches)
+    assert sorted(m["Body"].encode() for m in received(client, queue_url)) == sorted(bodies(25))
+
+
+def test_split_batches_caps_bytes_including_attributes(sqs: tuple[FlakyClient, str]) -> None:
+    client, queue_url = sqs
+    # two of these bodies fit in 256 KiB, but not with their attributes
+    large = bodies(5, 128 * 1024 - 40)
+    assert 2 * len(large[0]) <= 256 * 1024
+    batches = split_batches(large)
+    assert [len(batch) for batch in batches] == [1, 1, 1, 1, 1]
+    assert [len(batch) for batch in split_batches(bodies(5, 100 * 1024))] == [2, 2, 1]
+
+    for batch in batches:
+        assert send_batch(client, queue_url, batch) == []
+    assert_within_limits(client.batches)
+    messages = received(client, queue_url)
+    assert len(messages) == 5
+    assert all(m["MessageAttributes"][PERSISTED_ATTRIBUTE]["StringValue"] == "true" for m in messages)
+
+
+def test_send_batch_retries_sqs_failures(sqs: tuple[FlakyClient, str]) -> None:
+    client, queue_url = sqs
+    batch = bodies(3)
+    client.failures[batch[1].decode()] = [False, False]
+    counts: dict[str, int] = {}
+
+    def count(name: str, n: int = 1) -> None:
+        counts[name] = counts.get(name, 0) + n
+
+    assert send_batch(client, queue_url, batch, count=count) == []
+    # only the failed entry is sent again
+    assert [len(entries) for entries in client.batches] == [3, 1, 1]
+    assert counts == {"batches": 3, "sent": 3, "retried": 2}
+    assert sorted(m["Body"].encode() for m in received(client, queue_url)) == sorted(batch)
+
+
+def test_send_batch_surfaces_sender_faults(sqs: tuple[FlakyClient, str]) -> None:
+    client, queue_url = sqs
+    batch = bodies(3)
+    client.failures[batch[0].decode()] = [True]
+
+    assert send_batch(client, queue_url, batch) == [0]
+    assert len(client.batches) == 1
+    assert sorted(m["Body"].encode() for m in received(client, queue_url)) == sorted(batch[1:])
+
+
+def test_send_batch_gives_up_after_max_attempts(sqs: tuple[FlakyClient, str]) -> None:
+    client, queue_url = sqs
+    batch = bodies(2)
+    client.failures[batch[1].decode()] = [False] * 5
+
+    assert send_batch(client, queue_url, batch, max_attempts=3) == [1]
+    assert len(client.batches) == 3
+    assert [m["Body"].encode() for m in received(client, queue_url)] == batch[:1]
+
+
+def test_close_flushes_queued_messages(sqs: tuple[FlakyClient, str]) -> None:
+    client, queue_url = sqs
+    sqs_publisher = SqsPublisher(client, queue_url, senders=2, linger_ms=50)
+    sqs_publisher.start()
+    orders = [{"id": str(i), "customer": "c"} for i in range(25)]
+    for order in orders:
+        assert sqs_publisher.publish(order)
+    sqs_publisher.close()
+
+    assert not sqs_publisher.publish(orders[0])
+    stats = sqs_publisher.stats()
+    assert (stats["sent"], stats["failed"], stats["dropped"]) == (25, 0, 1)
+    assert_within_limits(client.batches)
+    assert sorted(loads(m["Body"])["id"] for m in received(client, queue_url)) == sorted(o["id"] for o in orders)
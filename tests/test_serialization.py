@@ -0,0 +1,85 @@
+import json
+import math
+from typing import Any, Callable
+
+import pytest
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from orders import serialization
+from orders.serialization import OrdersJSONProvider
+
+
+def order(customer: str = "c", notes: str = "") -> dict[str, Any]:
+    return {
+        "id": "0b7a4b8e-3c0f-4b8e-9d7c-6c1d2f3e4a5b",
+        "customer": customer,
+        "notes": notes,
+        "createdAt": "2026-01-02T03:04:05.678901+00:00",
+    }
+
+
+FLOATS = [0.1, 1.5, -0.0, 3.0, 1e15, 1e16, 1.2345678901234568e17, 1e-4, 1e-5, 1.5e-7, 5e-324, 1.7976931348623157e308]
+
+TEXT = [
+    order("Zoë", "crème brûlée, 日本語, ✓"),
+    order("\U0001f355 pizza", "astral \U0001d11e"),
+    order("line\u2028separator", "paragraph\u2029separator"),
+    order("next\x85line", "crlf\r\nand\rcr\x7f"),
+]
+
+SAMPLES: list[Any] = [
+    *TEXT,
+    {"orders": TEXT, "nextCursor": None},
+    {"status": "ok", "floats": FLOATS, "nested": [{"lagSeconds": value} for value in FLOATS]},
+    {"status": "ok", "count": 3, "ratio": 0.25},
+    [1, 2.5, "x"],
+]
+
+# both encoders, whichever one the process picked
+BACKENDS: dict[str, tuple[Callable[[Any], bytes], Callable[[Any], bytes]]] = {
+    "stdlib": (serialization._stdlib_dumps, serialization._stdlib_dumps_response),
+}
+if serialization.orjson is not None:
+    BACKENDS["orjson"] = (serialization._orjson_dumps, serialization._orjson_dumps_response)
+
+
+def jsonify_body(provider: type, obj: Any) -> bytes:
+    app = Flask(__name__)
+    app.json = provider(app)
+    with app.app_context():
+        return app.json.response(obj).get_data()
+
+
+@pytest.mark.parametrize("sample", SAMPLES)
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_dumps_response_matches_jsonify(backend: str, sample: Any) -> None:
+    _, dumps_response = BACKENDS[backend]
+    assert dumps_response(sample) + b"\n" == jsonify_body(DefaultJSONProvider, sample)
+
+
+@pytest.mark.parametrize("sample", SAMPLES)
+def test_provider_matches_default_provider(sample: Any) -> None:
+    assert jsonify_body(OrdersJSONProvider, sample) == jsonify_body(DefaultJSONProvider, sample)
+
+
+@pytest.mark.parametrize("value", [math.nan, math.inf, -math.inf])
+def test_dumps_response_non_finite_floats_match_jsonify(value: float) -> None:
+    sample = {"value": value}
+    assert serialization.dumps_response(sample) + b"\n" == jsonify_body(DefaultJSONProvider, sample)
+
+
+@pytest.mark.parametrize("sample", SAMPLES)
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_dumps_decodes_like_old_sqs_body(backend: str, sample: Any) -> None:
+    dumps, _ = BACKENDS[backend]
+    # SQS bodies used to be json.dumps(order)
+    assert json.loads(dumps(sample)) == json.loads(json.dumps(sample))
+    assert serialization.loads(dumps(sample)) == sample
+
+
+@pytest.mark.parametrize("sample", TEXT)
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_dumps_keeps_text_as_utf8(backend: str, sample: Any) -> None:
+    dumps, _ = BACKENDS[backend]
+    assert dumps(sample) == json.dumps(sample, ensure_ascii=False, separators=(",", ":")).encode()
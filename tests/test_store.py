@@ -0,0 +1,99 @@
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+import pytest
+
+from orders import store as store_module
+from orders.store import MemoryOrderStore, PostgresOrderStore
+
+
+def make_order(order_id: str) -> dict[str, Any]:
+    return {
+        "id": order_id,
+        "customer": "c",
+        "notes": "",
+        "createdAt": "2024-01-01T00:00:00+00:00",
+    }
+
+
+ORDERS = [make_order(f"00000000-0000-4000-8000-00000000000{i}") for i in range(3)]
+
+
+class FakeCursor:
+    """Records statements; ``stored`` plays the orders table for ON CONFLICT."""
+
+    def __init__(self, stored: set[str]) -> None:
+        self.stored = stored
+        self.statements: list[str] = []
+        self.rowcount = 0
+
+    def __enter__(self) -> "FakeCursor":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        pass
+
+    def execute(self, sql: str, args: Any = None) -> None:
+        self.statements.append(sql)
+        if sql.startswith("INSERT INTO orders"):
+            self.rowcount = 0 if args[0] in self.stored else 1
+            self.stored.add(args[0])
+
+
+class FakePool:
+    def __init__(self) -> None:
+        self.stored: set[str] = set()
+        self.statements: list[str] = []
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        cur = FakeCursor(self.stored)
+
+        class Conn:
+            def cursor(self) -> FakeCursor:
+                return cur
+
+        yield Conn()
+        self.statements.extend(cur.statements)
+
+
+@pytest.fixture
+def pg(monkeypatch: pytest.MonkeyPatch) -> tuple[PostgresOrderStore, FakePool]:
+    def execute_values(cur: FakeCursor, sql: str, rows: list[tuple], **kwargs: Any) -> list[tuple[str]]:
+        cur.statements.append(sql)
+        new = [row[0] for row in rows if row[0] not in cur.stored]
+        cur.stored.update(new)
+        return [(order_id,) for order_id in new]
+
+    monkeypatch.setattr(store_module, "execute_values", execute_values)
+    pool = FakePool()
+    return PostgresOrderStore(pool, notify=True), pool  # type: ignore[arg-type]
+
+
+def notifies(pool: FakePool) -> int:
+    return sum(1 for sql in pool.statements if sql.startswith("NOTIFY"))
+
+
+def test_memory_duplicate_add_many_keeps_version() -> None:
+    store = MemoryOrderStore()
+    assert store.add_many(ORDERS) == [order["id"] for order in ORDERS]
+    version = store.version
+    assert store.add_many(ORDERS) == []
+    store.add(ORDERS[0])
+    assert store.version == version
+
+
+def test_postgres_duplicate_add_many_keeps_version(pg: tuple[PostgresOrderStore, FakePool]) -> None:
+    store, pool = pg
+    assert store.add_many(ORDERS) == [order["id"] for order in ORDERS]
+    assert (store.version, notifies(pool)) == (1, 1)
+
+    assert store.add_many(ORDERS) == []
+    assert (store.version, notifies(pool)) == (1, 1)
+
+
+def test_postgres_duplicate_add_keeps_version(pg: tuple[PostgresOrderStore, FakePool]) -> None:
+    store, pool = pg
+    store.add(ORDERS[0])
+    store.add(ORDERS[0])
+    assert (store.version, notifies(pool)) == (1, 1)